@@ -0,0 +1,335 @@
+"""
+This module is used to fit many capacity-rate datasets to Tian et al.'s
+empirical model at once. Instead of one curve_fit() call per dataset, the
+ragged (rate, normq) series are packed into padded arrays with a mask and
+a single vectorized Levenberg-Marquardt loop updates every dataset per
+iteration, using the analytic Jacobian fitjac(). The same solver fits all
+bootstrap resamples of a dataset at once for percentile intervals.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+import pandas as pd
+from batteryratecap.fitcaprate import fitfunc, fitjac
+from batteryratecap.fitcaprate import POPT_COLUMNS
+from batteryratecap.datasets import as_datasets
+from batteryratecap.writers import write_dataframe
+
+# Same default tolerances as scipy.optimize.curve_fit (MINPACK lmdif)
+TOLERANCE = 1.49012e-08
+
+
+def pack_datasets(dframe):
+    '''
+    This function packs the datasets of a capacity-rate dataframe
+    into padded 2D arrays, one row per dataset.
+    Inputs
+    - dframe: capacity-rate dataframe, even columns are rates and
+      odd columns are capacities, or CapacityRateData
+    Output
+    - rate: (k, m) float array, padded entries set to 1
+    - normq: (k, m) float array, padded entries set to 0
+    - mask: (k, m) boolean array, True where both values are present
+    '''
+    # discard null datapoints through the mask,
+    # padded entries hold harmless values for the model
+    data = as_datasets(dframe)
+    lengths = data.lengths()
+    width = int(lengths.max()) if len(data) else 0
+    mask = np.arange(width) < lengths[:, None]
+    rate = np.ones(mask.shape)
+    normq = np.zeros(mask.shape)
+    # boolean assignment is row-major, dataset after dataset
+    rate[mask] = data.rate
+    normq[mask] = data.capacity
+    return rate, normq, mask
+
+
+def _residuals(params, rate, normq, mask):
+    '''
+    Masked residuals and sum of squares of every dataset.
+    Non-finite model values give an infinite cost so that
+    the step leading to them is rejected.
+    '''
+    with np.errstate(all='ignore'):
+        model = fitfunc(rate, params[:, 0:1], params[:, 1:2], params[:, 2:3])
+        resid = np.where(mask, normq - model, 0.0)
+        cost = np.sum(resid**2, axis=1)
+    cost[~np.isfinite(cost)] = np.inf
+    return resid, cost
+
+
+def _jacobian(params, rate, mask):
+    '''
+    Masked analytic Jacobian of every dataset, shape (k, m, 3).
+    '''
+    with np.errstate(all='ignore'):
+        jac = fitjac(rate, params[:, 0:1], params[:, 1:2], params[:, 2:3])
+    jac = np.where(mask[..., None], jac, 0.0)
+    jac[~np.isfinite(jac)] = 0.0
+    return jac
+
+
+def _solve(matrix, vector):
+    '''
+    Batched solve of matrix @ x = vector, falling back on the
+    pseudo-inverse when one of the systems is singular.
+    '''
+    try:
+        return np.linalg.solve(matrix, vector[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        return np.einsum('kij,kj->ki', np.linalg.pinv(matrix), vector)
+
+
+def batch_fit(rate, normq, mask, params0, max_iter=200,
+              ftol=TOLERANCE, xtol=TOLERANCE):
+    '''
+    This function fits k padded datasets to fitfunc() with a vectorized
+    Levenberg-Marquardt solver. Every iteration builds the normal
+    equations of all still-active datasets with one einsum and solves
+    them with one batched np.linalg.solve call.
+    Inputs
+    - rate, normq, mask: (k, m) arrays as returned by pack_datasets()
+    - params0: initial [tau, n, Qmax], either one list shared by all
+      datasets or a (k, 3) array with one row per dataset
+    - max_iter: maximum number of iterations
+    - ftol, xtol: relative tolerances on the sum of squares and on
+      the parameters, as in curve_fit()
+    Output
+    - popt: (k, 3) optimized parameters [tau, n, Qmax]
+    - pcov: (k, 3, 3) estimated covariances of popt, scaled by the
+      residual variance like curve_fit(absolute_sigma=False), NaN
+      for datasets of three datapoints or less
+    - converged: (k,) boolean array
+    - nfev: (k,) number of model evaluations per dataset
+    '''
+    num = rate.shape[0]
+    params = np.array(np.broadcast_to(np.asarray(params0, dtype=float),
+                                      (num, 3)))
+    resid, cost = _residuals(params, rate, normq, mask)
+    damping = np.full(num, 1e-3)
+    nfev = np.ones(num, dtype=int)
+    converged = np.zeros(num, dtype=bool)
+    active = np.isfinite(cost)
+    diag = np.arange(3)
+    for _ in range(max_iter):
+        index = np.flatnonzero(active)
+        if index.size == 0:
+            break
+        # normal equations of the active datasets
+        jac = _jacobian(params[index], rate[index], mask[index])
+        hessian = np.einsum('kmi,kmj->kij', jac, jac)
+        gradient = np.einsum('kmi,km->ki', jac, resid[index])
+        scale = np.maximum(hessian[:, diag, diag], 1e-12)
+        damped = hessian.copy()
+        damped[:, diag, diag] += damping[index, None] * scale
+        step = _solve(damped, gradient)
+        trial = params[index] + step
+        trial_resid, trial_cost = _residuals(trial, rate[index],
+                                             normq[index], mask[index])
+        nfev[index] += 1
+        # accept the steps that lower the sum of squares
+        better = trial_cost < cost[index]
+        accepted = index[better]
+        reduction = cost[accepted] - trial_cost[better]
+        params[accepted] = trial[better]
+        resid[accepted] = trial_resid[better]
+        cost[accepted] = trial_cost[better]
+        damping[accepted] /= 10
+        damping[index[~better]] *= 10
+        # convergence tests on the accepted steps
+        small_step = (np.linalg.norm(step[better], axis=1) <=
+                      xtol * (xtol + np.linalg.norm(trial[better], axis=1)))
+        small_gain = reduction <= ftol * (cost[accepted] + reduction)
+        done = accepted[small_step | small_gain]
+        converged[done] = True
+        active[done] = False
+        # the damping only grows when no step can lower the cost
+        stalled = index[~better][damping[index[~better]] > 1e16]
+        converged[stalled] = True
+        active[stalled] = False
+    # covariance from the Jacobian at the optimum
+    jac = _jacobian(params, rate, mask)
+    hessian = np.einsum('kmi,kmj->kij', jac, jac)
+    dof = mask.sum(axis=1) - 3
+    # without residual degrees of freedom the covariance is unknown
+    known = dof > 0
+    pcov = np.full(hessian.shape, np.nan)
+    pcov[known] = (np.linalg.pinv(hessian[known]) *
+                   (cost[known] / dof[known])[:, None, None])
+    return params, pcov, converged, nfev
+
+
+def fitmodel_batch(dframe, output_xlsx, params0, max_iter=200, writer=None):
+    '''
+    This function fits all datasets of a capacity-rate dataframe in
+    one batch and returns the same table of optimized parameters and
+    standard deviations as fitmodel().
+    Inputs
+    - dframe: capacity-rate dataframe or CapacityRateData
+    - output_xlsx: string, output file path and name with extension,
+      or None to skip writing the file. The extension picks the file
+      format (.xlsx, .csv, .parquet, .feather) unless *writer* is given
+    - params0: a list of initial points for searching [tau, n, Qmax]
+    - max_iter: maximum number of Levenberg-Marquardt iterations
+    - writer: None, a writer name ('xlsx', 'csv', 'parquet', 'feather')
+      or a callable, see batteryratecap.writers.write_dataframe()
+    Output
+    - dataframe of paper and set numbers, fit parameters
+      and their standard deviations
+    '''
+    data = as_datasets(dframe)
+    rate, normq, mask = pack_datasets(data)
+    # fit dataset with more than four datapoints
+    # otherwise, report zeros
+    enough = mask.sum(axis=1) >= 4
+    popt = np.zeros((rate.shape[0], 3))
+    sigma = np.zeros((rate.shape[0], 3))
+    if enough.any():
+        popt_fit, pcov, _, _ = batch_fit(rate[enough], normq[enough],
+                                         mask[enough], params0,
+                                         max_iter=max_iter)
+        popt[enough] = popt_fit
+        sigma[enough] = np.sqrt(np.diagonal(pcov, axis1=1, axis2=2))
+    labels = np.array(data.labels(), dtype=int).reshape(-1, 2)
+    popt_dframe = pd.DataFrame(np.column_stack([labels, popt, sigma]),
+                               columns=POPT_COLUMNS)
+    popt_dframe = popt_dframe.astype({'Paper #': int, 'Set': int})
+    if output_xlsx is not None:
+        # Export dataframe of optimized parameter to the output file
+        write_dataframe(popt_dframe, output_xlsx, writer=writer)
+    return popt_dframe
+
+
+def bootstrap_fit(rate, normq, params0, num_resamples=1000,
+                  method='residual', alpha=0.05, seed=None, max_iter=200):
+    '''
+    This function estimates percentile confidence intervals of tau, n
+    and Qmax of one dataset by bootstrap. All resamples are packed into
+    (num_resamples, m) arrays and fitted together by batch_fit(),
+    starting from the fit of the original data.
+    Inputs
+    - rate, normq: 1D numpy arrays of one dataset, nulls are discarded
+    - params0: initial point for searching [tau, n, Qmax]
+    - num_resamples: integer, number of bootstrap resamples
+    - method: 'residual' adds resampled residuals of the fit to the
+      fitted curve, 'case' resamples the (rate, normq) pairs
+    - alpha: the intervals have level 1 - alpha
+    - seed: integer seed or numpy SeedSequence, default None is not
+      reproducible
+    - max_iter: maximum number of Levenberg-Marquardt iterations
+    Output
+    - popt: (3,) fit parameters of the original data
+    - conf_int: (3, 2) lower and upper bounds of tau, n and Qmax,
+      NaN when no resample converged
+    - num_valid: integer, number of converged resamples used
+    '''
+    assert method in ('residual', 'case'), 'Unknown bootstrap ' + str(method)
+    rate = np.asarray(rate, dtype=float)
+    normq = np.asarray(normq, dtype=float)
+    # discard null datapoints
+    keep = ~np.isnan(rate) & ~np.isnan(normq)
+    rate = rate[keep]
+    normq = normq[keep]
+    num = len(rate)
+    assert num > 3, 'At least four datapoints are needed'
+    popt, _, _, _ = batch_fit(rate[None], normq[None],
+                              np.ones((1, num), dtype=bool), params0,
+                              max_iter=max_iter)
+    popt = popt[0]
+    rng = np.random.default_rng(seed)
+    index = rng.integers(0, num, (num_resamples, num))
+    mask = np.ones((num_resamples, num), dtype=bool)
+    if method == 'residual':
+        fitted = fitfunc(rate, *popt)
+        resid = normq - fitted
+        # centered residuals, inflated for the three fitted parameters
+        resid = (resid - resid.mean()) * np.sqrt(num / (num - 3))
+        boot_rate = np.broadcast_to(rate, (num_resamples, num))
+        boot_normq = fitted + resid[index]
+    else:
+        boot_rate = rate[index]
+        boot_normq = normq[index]
+        # resamples with less than three distinct rates cannot be fitted
+        distinct = 1 + np.sum(np.diff(np.sort(boot_rate, axis=1)) > 0,
+                              axis=1)
+        mask[distinct < 3] = False
+    boot_popt, _, converged, _ = batch_fit(boot_rate, boot_normq, mask,
+                                           popt, max_iter=max_iter)
+    valid = converged & mask.all(axis=1) & np.isfinite(boot_popt).all(axis=1)
+    if not valid.any():
+        return popt, np.full((3, 2), np.nan), 0
+    conf_int = np.quantile(boot_popt[valid], [alpha / 2, 1 - alpha / 2],
+                           axis=0).T
+    return popt, conf_int, int(valid.sum())
+
+
+def fitmodel_bootstrap(dframe, output_xlsx, params0, num_resamples=1000,
+                       method='residual', alpha=0.05, seed=None,
+                       max_iter=200, workers=None, executor=None,
+                       chunksize=1, writer=None):
+    '''
+    This function runs bootstrap_fit() on every dataset of a
+    capacity-rate dataframe, optionally across worker processes. Every
+    dataset draws from its own random stream spawned from *seed*, so the
+    intervals do not depend on the number of workers.
+    Inputs
+    - dframe: capacity-rate dataframe or CapacityRateData
+    - output_xlsx: string, output file path and name with extension,
+      or None to skip writing the file
+    - params0: a list of initial points for searching [tau, n, Qmax]
+    - num_resamples, method, alpha, max_iter: see bootstrap_fit()
+    - seed: integer seed, default None is not reproducible
+    - workers: integer, number of worker processes of a
+      ProcessPoolExecutor, default None runs in this process
+    - executor: an existing concurrent.futures executor
+    - chunksize: integer, number of datasets per task
+    - writer: None, a writer name or a callable, see
+      batteryratecap.writers.write_dataframe()
+    Output
+    - dataframe of paper and set numbers, fit parameters, their
+      interval bounds (tau_low, tau_high, ...) and the number of
+      converged resamples. Datasets with less than four datapoints
+      report zeros
+    '''
+    data = as_datasets(dframe)
+    datasets = list(data)
+    seeds = np.random.SeedSequence(seed).spawn(len(datasets))
+    args = (datasets, seeds, repeat(params0), repeat(num_resamples),
+            repeat(method), repeat(alpha), repeat(max_iter))
+    if executor is None and (workers is None or workers <= 1):
+        results = list(map(_bootstrap_task, *args))
+    elif executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_bootstrap_task, *args,
+                                    chunksize=chunksize))
+    else:
+        results = list(executor.map(_bootstrap_task, *args,
+                                    chunksize=chunksize))
+    labels = np.array(data.labels(), dtype=int).reshape(-1, 2)
+    bound_columns = [name + bound for name in POPT_COLUMNS[2:5]
+                     for bound in ('_low', '_high')]
+    boot_dframe = pd.DataFrame(np.column_stack([labels, np.array(results)]),
+                               columns=(POPT_COLUMNS[:5] + bound_columns +
+                                        ['Resamples']))
+    boot_dframe = boot_dframe.astype({'Paper #': int, 'Set': int,
+                                      'Resamples': int})
+    if output_xlsx is not None:
+        write_dataframe(boot_dframe, output_xlsx, writer=writer)
+    return boot_dframe
+
+
+def _bootstrap_task(dataset, seed, params0, num_resamples, method, alpha,
+                    max_iter):
+    '''
+    One row of fitmodel_bootstrap(): tau, n, Qmax, the interval bounds
+    of each and the number of converged resamples, zeros when the
+    dataset has less than four datapoints.
+    '''
+    rate, normq = dataset
+    if len(rate) < 4:
+        return np.zeros(10)
+    popt, conf_int, num_valid = bootstrap_fit(
+        rate, normq, params0, num_resamples=num_resamples, method=method,
+        alpha=alpha, seed=seed, max_iter=max_iter)
+    return np.concatenate([popt, conf_int.ravel(), [num_valid]])
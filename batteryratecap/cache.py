@@ -0,0 +1,292 @@
+"""
+This module is used to cache parsed input workbooks on disk. The sheets
+of a workbook, read with 3-level headers as data_converter expects, are
+stored once per file content as parquet files (pickle when pyarrow is not
+installed), so repeated conversions of the same workbook skip
+pd.read_excel completely. Entries are looked up by file path and
+modification time first and by a SHA-256 hash of the file content, and
+the least recently used entries are evicted above a size limit.
+The cache can be shared by concurrent processes: the index is only read
+and rewritten under a file lock (where fcntl is available), and every
+file is written under a temporary name and moved into place, so that a
+reader never sees a partial index, manifest or sheet.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+import pandas as pd
+try:
+    import fcntl
+except ImportError:
+    # no file locks on Windows, files are still replaced atomically
+    fcntl = None
+
+# Default cache location and size limit
+CACHE_DIR = os.environ.get('BATTERYRATECAP_CACHE',
+                           os.path.join(os.path.expanduser('~'), '.cache',
+                                        'batteryratecap', 'workbooks'))
+MAX_BYTES = 1024**3
+# Part of every hash, changes whenever the cached format changes
+_PARSE_TAG = b'pd.read_excel header=[0, 1, 2] v1'
+_INDEX_FILE = 'index.json'
+_MANIFEST_FILE = 'manifest.json'
+_LOCK_FILE = 'index.lock'
+
+
+def read_workbook(input_file, sheet_name=None, cache_dir=None,
+                  max_bytes=MAX_BYTES):
+    '''
+    This function reads an excel workbook like
+    pd.read_excel(input_file, sheet_name, header=[0, 1, 2]) through the
+    on-disk cache. The first call for a file content parses every sheet
+    and stores them, later calls load the stored sheets instead.
+    Inputs
+    - input_file: string, excel file path
+    - sheet_name: None for all sheets, a sheet name or a list of names
+    - cache_dir: string, cache directory, default CACHE_DIR
+    - max_bytes: integer, size limit of the cache directory in bytes
+    Output
+    - dictionary of sheet name to dataframe, or a single dataframe
+      when *sheet_name* is a string
+    '''
+    cache_dir = cache_dir or CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    sheets = None
+    with _locked(cache_dir):
+        index = _load_index(cache_dir)
+        digest = _lookup_digest(index, input_file)
+        entry_dir = os.path.join(cache_dir, digest)
+        manifest_path = os.path.join(entry_dir, _MANIFEST_FILE)
+        if digest in index['entries'] and os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as file:
+                manifest = json.load(file)
+            # read under the lock, so that no other process evicts
+            # the entry meanwhile
+            sheets = _select_sheets(manifest, sheet_name, entry_dir)
+            index['entries'][digest]['last_used'] = time.time()
+            _evict(cache_dir, index, max_bytes, keep=digest)
+        _save_index(cache_dir, index)
+    if sheets is None:
+        # parse without holding the lock, other processes keep reading
+        parsed = pd.read_excel(input_file, sheet_name=None, header=[0, 1, 2])
+        manifest = _store_entry(entry_dir, parsed)
+        sheets = _select_sheets(manifest, sheet_name, parsed=parsed)
+        with _locked(cache_dir):
+            index = _load_index(cache_dir)
+            _lookup_digest(index, input_file)
+            index['entries'][digest] = {'bytes': manifest['bytes'],
+                                        'last_used': time.time()}
+            _evict(cache_dir, index, max_bytes, keep=digest)
+            _save_index(cache_dir, index)
+    if isinstance(sheet_name, str):
+        return sheets[sheet_name]
+    return sheets
+
+
+def _select_sheets(manifest, sheet_name, entry_dir=None, parsed=None):
+    '''
+    The requested sheets of a cache entry, read from *entry_dir* or
+    taken from the *parsed* workbook.
+    '''
+    files = dict(manifest['sheets'])
+    if sheet_name is None:
+        names = list(files)
+    elif isinstance(sheet_name, str):
+        names = [sheet_name]
+    else:
+        names = list(sheet_name)
+    for name in names:
+        assert name in files, 'Worksheet ' + str(name) + ' not found'
+    if parsed is None:
+        return {name: read_frame(os.path.join(entry_dir, files[name]))
+                for name in names}
+    return {name: parsed[name] for name in names}
+
+
+def invalidate(input_file=None, cache_dir=None):
+    '''
+    This function removes cached workbooks.
+    Inputs
+    - input_file: string, excel file path whose cached sheets are removed,
+      default None clears the whole cache
+    - cache_dir: string, cache directory, default CACHE_DIR
+    '''
+    cache_dir = cache_dir or CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        return
+    with _locked(cache_dir):
+        index = _load_index(cache_dir)
+        if input_file is None:
+            digests = list(index['entries'])
+            index['files'] = {}
+        else:
+            record = index['files'].pop(os.path.abspath(input_file), None)
+            digests = [record['digest']] if record else []
+            if os.path.exists(input_file):
+                digests.append(file_digest(input_file))
+        for digest in digests:
+            index['entries'].pop(digest, None)
+            shutil.rmtree(os.path.join(cache_dir, digest),
+                          ignore_errors=True)
+        _save_index(cache_dir, index)
+
+
+def file_digest(input_file):
+    '''
+    This function returns the SHA-256 hex digest of a file content,
+    read in 1 MB blocks.
+    '''
+    sha = hashlib.sha256(_PARSE_TAG)
+    with open(input_file, 'rb') as file:
+        for block in iter(lambda: file.read(1024**2), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _lookup_digest(index, input_file):
+    '''
+    Content digest of a file, only rehashed when its path, size or
+    modification time is new to the index.
+    '''
+    stat = os.stat(input_file)
+    key = os.path.abspath(input_file)
+    record = index['files'].get(key)
+    if (record is None or record['mtime'] != stat.st_mtime_ns or
+            record['size'] != stat.st_size):
+        record = {'mtime': stat.st_mtime_ns, 'size': stat.st_size,
+                  'digest': file_digest(input_file)}
+        index['files'][key] = record
+    return record['digest']
+
+
+def _store_entry(entry_dir, sheets):
+    '''
+    Write every sheet dataframe to its own file and return the manifest
+    of (sheet name, file name) pairs and total bytes. The entry is
+    written to a temporary directory and renamed, when another process
+    stored the same entry first its manifest is kept.
+    '''
+    cache_dir = os.path.dirname(entry_dir)
+    temp_dir = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp-')
+    try:
+        manifest = {'sheets': [], 'bytes': 0}
+        for i, (name, dframe) in enumerate(sheets.items()):
+            path = write_frame(dframe, os.path.join(temp_dir,
+                                                    'sheet' + str(i)))
+            manifest['sheets'].append([name, os.path.basename(path)])
+            manifest['bytes'] += os.path.getsize(path)
+        with open(os.path.join(temp_dir, _MANIFEST_FILE), 'w',
+                  encoding='utf-8') as file:
+            json.dump(manifest, file)
+        with _locked(cache_dir):
+            if not os.path.exists(os.path.join(entry_dir, _MANIFEST_FILE)):
+                # a directory without manifest is left over by a crash
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.replace(temp_dir, entry_dir)
+            else:
+                with open(os.path.join(entry_dir, _MANIFEST_FILE),
+                          encoding='utf-8') as file:
+                    manifest = json.load(file)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return manifest
+
+
+def write_frame(dframe, path):
+    '''
+    This function stores a dataframe as *path* + '.parquet', or as
+    *path* + '.pkl' when pyarrow is not installed or cannot store its
+    headers, and returns the file written. The file is written under a
+    temporary name and moved into place, so it is never seen partial.
+    '''
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                         prefix='.tmp-')
+    os.close(handle)
+    try:
+        try:
+            dframe.to_parquet(temp_path, engine='pyarrow')
+            extension = '.parquet'
+        except (ImportError, ValueError, TypeError):
+            # pyarrow missing, or headers parquet cannot store
+            dframe.to_pickle(temp_path)
+            extension = '.pkl'
+        os.replace(temp_path, path + extension)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return path + extension
+
+
+def read_frame(path):
+    '''
+    This function reads back a dataframe stored by write_frame().
+    '''
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, engine='pyarrow')
+    return pd.read_pickle(path)
+
+
+def _evict(cache_dir, index, max_bytes, keep):
+    '''
+    Remove least recently used entries until the cache fits in
+    *max_bytes*, never removing the entry *keep* just used.
+    '''
+    entries = index['entries']
+    total = sum(entry['bytes'] for entry in entries.values())
+    for digest in sorted(entries, key=lambda d: entries[d]['last_used']):
+        if total <= max_bytes:
+            break
+        if digest == keep:
+            continue
+        total -= entries.pop(digest)['bytes']
+        shutil.rmtree(os.path.join(cache_dir, digest), ignore_errors=True)
+    # forget file records pointing at evicted entries
+    index['files'] = {path: record for path, record in index['files'].items()
+                      if record['digest'] in entries}
+
+
+@contextmanager
+def _locked(cache_dir):
+    '''
+    Hold the exclusive lock of the cache index, a no-op without fcntl.
+    '''
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(cache_dir, _LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _load_index(cache_dir):
+    '''
+    Read the cache index, or start an empty one.
+    '''
+    try:
+        with open(os.path.join(cache_dir, _INDEX_FILE),
+                  encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {'files': {}, 'entries': {}}
+
+
+def _save_index(cache_dir, index):
+    '''
+    Write the cache index atomically, under a temporary name of its own
+    so that concurrent writers never share a file.
+    '''
+    handle, temp_path = tempfile.mkstemp(dir=cache_dir, prefix='.tmp-')
+    try:
+        with os.fdopen(handle, 'w', encoding='utf-8') as file:
+            json.dump(index, file)
+        os.replace(temp_path, os.path.join(cache_dir, _INDEX_FILE))
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -0,0 +1,335 @@
+"""
+This module is the batteryratecap command line tool. It runs the data
+converter, the fit and the correlation test on many workbooks at once:
+    batteryratecap convert "data/*.xls" --output-dir out
+    batteryratecap fit "out/*_capacity_rate.xlsx" --jobs 4
+    batteryratecap correlate "out/*_fitparameters.xlsx" \\
+        --features input_parameterlog.xls
+Input patterns are expanded with glob. With several input files,
+--jobs N processes N files at a time in worker processes, with one file
+the N workers fit its datasets. --profile FILE writes one JSON object
+per line: the wall time of every input file with the peak resident
+memory of the process that ran it (event 'file'), the fit time of every
+dataset (event 'dataset') and the totals of the command (event 'total').
+The peak of a file record is the high-water mark of its process since
+that process started, so it also covers the files processed before it
+in the same process, and only the first file of a process measures its
+own peak. --trace FILE appends the
+stage and dataset events of batteryratecap.instrument. The library
+logs its messages to stderr, so that with --profile - stdout only holds
+the profile records.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from batteryratecap.data_converter import potential_rate_all
+from batteryratecap.data_converter import potential_rate_paper_set
+from batteryratecap.fitcaprate import fitmodel
+from batteryratecap.pipeline import feature_correlations, read_features
+from batteryratecap.pipeline import run_pipeline
+from batteryratecap.instrument import instrument
+from batteryratecap.writers import write_dataframe, EXTENSIONS
+
+# Suffix of the output file name of every command
+SUFFIXES = {'convert': '_capacity_rate',
+            'fit': '_fitparameters',
+            'correlate': '_correlations'}
+
+
+def main(argv=None):
+    '''
+    Command line entry point, *argv* defaults to sys.argv[1:].
+    '''
+    args = build_parser().parse_args(argv)
+    # pipeline stages and files written are logged to stderr
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.command == 'run':
+        return _run(args)
+    inputs = expand_inputs(args.inputs)
+    if not inputs:
+        raise SystemExit('No input file matches ' + ' '.join(args.inputs))
+    os.makedirs(args.output_dir, exist_ok=True)
+    extension = _extension(args.file_format)
+    outputs = [os.path.join(args.output_dir,
+                            os.path.splitext(os.path.basename(path))[0] +
+                            SUFFIXES[args.command] + extension)
+               for path in inputs]
+    options = {key: value for key, value in vars(args).items()
+               if key not in ('inputs', 'profile')}
+    start = time.perf_counter()
+    records = []
+    if len(inputs) > 1 and args.jobs > 1:
+        # one file per task, every file processed serially
+        options['workers'] = None
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            for file_records in pool.map(run_file, inputs, outputs,
+                                         [options] * len(inputs)):
+                records.extend(file_records)
+    else:
+        options['workers'] = args.jobs if args.jobs > 1 else None
+        for input_file, output_file in zip(inputs, outputs):
+            records.extend(run_file(input_file, output_file, options))
+    records.append({'event': 'total', 'command': args.command,
+                    'inputs': len(inputs),
+                    'wall_time': time.perf_counter() - start,
+                    'peak_rss_mb': peak_rss_mb(children=True)})
+    # stdout only holds the profile records with --profile -
+    for record in records:
+        if record['event'] == 'file' and args.profile != '-':
+            print(record['input'], '->', record['output'],
+                  f"{record['wall_time']:.2f} s")
+    if args.profile:
+        write_profile(records, args.profile)
+    return 0
+
+
+def build_parser():
+    '''
+    This function builds the argument parser of the subcommands
+    convert, fit, correlate and run.
+    '''
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--jobs', type=int, default=1,
+                        help='worker processes, default 1')
+    common.add_argument('--profile', metavar='FILE',
+                        help="JSON lines profile, '-' for stdout")
+    common.add_argument('--trace', metavar='FILE',
+                        help='JSON lines of the instrumentation events '
+                        'of batteryratecap.instrument')
+    files = argparse.ArgumentParser(add_help=False, parents=[common])
+    files.add_argument('inputs', nargs='+',
+                       help='input files or glob patterns')
+    files.add_argument('--output-dir', default='.')
+    files.add_argument('--format', dest='file_format', default='xlsx',
+                       choices=sorted(set(EXTENSIONS.values())))
+    parser = argparse.ArgumentParser(
+        prog='batteryratecap',
+        description='Convert, fit and correlate battery rate data.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser(
+        'convert', parents=[files],
+        help='charge/discharge workbooks to capacity-rate data')
+    convert.add_argument('--sheets', nargs='+',
+                         help='sheets of one paper, with --paper')
+    convert.add_argument('--paper', help="e.g. 'Paper # 32'")
+    convert.add_argument('--sets', type=int, default=1,
+                         help='number of sets of --paper')
+    convert.add_argument('--streaming', action='store_true',
+                         help='read the sheets one at a time')
+    convert.add_argument('--cache', action='store_true',
+                         help='keep the parsed workbooks on disk')
+    fit = commands.add_parser('fit', parents=[files],
+                              help='fit capacity-rate data')
+    fit.add_argument('--sheet', help='capacity-rate sheet, default '
+                     "'CapacityRate' or the first sheet")
+    fit.add_argument('--params0', nargs='+', default=['0.5', '1', '200'],
+                     help="tau n Qmax, or 'auto', 'grid' or 'warm'")
+    fit.add_argument('--store', help='SQLite file of fit results')
+    correlate = commands.add_parser(
+        'correlate', parents=[files],
+        help='test fit parameters against design features')
+    correlate.add_argument('--features', required=True,
+                           help='workbook of design features')
+    correlate.add_argument('--feature-sheet', nargs='+',
+                           help='feature sheets, default all')
+    correlate.add_argument('--methods', nargs='+',
+                           default=['pearson', 'spearman'],
+                           choices=['pearson', 'spearman'])
+    correlate.add_argument('--correction',
+                           choices=['bonferroni', 'holm', 'fdr_bh'])
+    run = commands.add_parser(
+        'run', parents=[common],
+        help='convert, fit and correlate one workbook with checkpoints')
+    run.add_argument('input_file')
+    run.add_argument('--features', help='workbook of design features')
+    run.add_argument('--sheet', help='capacity-rate sheet of the input')
+    run.add_argument('--params0', nargs='+', default=['0.5', '1', '200'])
+    run.add_argument('--output-dir', default='.')
+    run.add_argument('--format', dest='file_format', default='xlsx',
+                     choices=sorted(set(EXTENSIONS.values())))
+    run.add_argument('--cache-dir')
+    return parser
+
+
+def expand_inputs(patterns):
+    '''
+    This function expands glob patterns into a sorted list of files,
+    without duplicates, keeping the order of the patterns.
+    '''
+    inputs = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or \
+                ([pattern] if os.path.isfile(pattern) else []):
+            if path not in inputs:
+                inputs.append(path)
+    return inputs
+
+
+def run_file(input_file, output_file, options):
+    '''
+    This function runs one command on one input file, this is the task
+    of every worker process. It returns the profile records of the
+    file and, for the fit, of its datasets.
+    '''
+    if options['trace']:
+        with instrument(options['trace']):
+            return run_file(input_file, output_file,
+                            dict(options, trace=None))
+    start = time.perf_counter()
+    command = options['command']
+    records = []
+    if command == 'convert':
+        if options['paper'] is not None:
+            assert options['sheets'], '--paper needs --sheets'
+            result = potential_rate_paper_set(
+                input_file, options['sheets'], output_file,
+                options['paper'], options['sets'],
+                cache=True if options['cache'] else None)
+        else:
+            result = potential_rate_all(
+                input_file, output_file, streaming=options['streaming'],
+                cache=True if options['cache'] else None)
+        num = len(result.columns) // 2
+    elif command == 'fit':
+        _, report = fitmodel(read_capacity_rate(input_file,
+                                                options['sheet']),
+                             output_file, _params0(options['params0']),
+                             workers=options['workers'], report=True,
+                             store=options['store'])
+        num = len(report)
+        for row in report.itertuples(index=False):
+            records.append({'event': 'dataset', 'command': command,
+                            'input': input_file, 'paper': int(row[0]),
+                            'set': int(row[1]), 'fit_time': row.Seconds,
+                            'nfev': int(row.nfev), 'error': row.Error})
+    else:
+        feature_sheet = options['feature_sheet']
+        if feature_sheet is not None and len(feature_sheet) == 1:
+            feature_sheet = feature_sheet[0]
+        result = feature_correlations(
+            read_table(input_file),
+            read_features(options['features'], feature_sheet),
+            methods=options['methods'], correction=options['correction'])
+        write_dataframe(result, output_file, writer=options['file_format'])
+        num = len(result)
+    records.insert(0, {'event': 'file', 'command': command,
+                       'input': input_file, 'output': output_file,
+                       'items': num,
+                       'wall_time': time.perf_counter() - start,
+                       'process_peak_rss_mb': peak_rss_mb()})
+    return records
+
+
+def read_capacity_rate(input_file, sheet_name=None):
+    '''
+    This function reads a capacity-rate table with 3-level headers from
+    an excel workbook or a parquet file, as written by the converter.
+    The excel sheet defaults to 'CapacityRate' when the workbook has
+    one, else the first sheet, and an index column is dropped.
+    '''
+    if input_file.lower().endswith(('.parquet', '.pq')):
+        return pd.read_parquet(input_file)
+    if sheet_name is None:
+        sheet_names = pd.ExcelFile(input_file).sheet_names
+        sheet_name = 'CapacityRate' if 'CapacityRate' in sheet_names else 0
+    dframe = pd.read_excel(input_file, sheet_name=sheet_name,
+                           header=[0, 1, 2])
+    index_columns = [column for column in dframe.columns
+                     if str(column[0]).startswith('Unnamed:')]
+    return dframe.drop(columns=index_columns)
+
+
+def read_table(input_file):
+    '''
+    This function reads a plain table, such as the fit parameters,
+    from an excel, csv or parquet file.
+    '''
+    lower = input_file.lower()
+    if lower.endswith(('.parquet', '.pq')):
+        return pd.read_parquet(input_file)
+    if lower.endswith('.csv'):
+        return pd.read_csv(input_file)
+    return pd.read_excel(input_file)
+
+
+def peak_rss_mb(children=False):
+    '''
+    This function returns the peak resident memory of this process in
+    MB since it started, with *children* the largest of it and of its
+    finished child processes, or None where the resource module is
+    missing.
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if children:
+        peak = max(peak,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and in kB elsewhere
+    return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+
+
+def write_profile(records, profile):
+    '''
+    This function writes profile records as JSON lines to a file, or
+    to stdout when *profile* is '-'.
+    '''
+    lines = ''.join(json.dumps(record) + '\n' for record in records)
+    if profile == '-':
+        sys.stdout.write(lines)
+    else:
+        with open(profile, 'a', encoding='utf-8') as file:
+            file.write(lines)
+
+
+def _run(args):
+    '''
+    The run subcommand, batteryratecap.pipeline.run_pipeline() with
+    one total profile record.
+    '''
+    if args.trace:
+        with instrument(args.trace):
+            return _run(argparse.Namespace(**dict(vars(args), trace=None)))
+    start = time.perf_counter()
+    run_pipeline(args.input_file, args.features, args.sheet,
+                 params0=_params0(args.params0),
+                 workers=args.jobs if args.jobs > 1 else None,
+                 output_dir=args.output_dir, file_format=args.file_format,
+                 cache_dir=args.cache_dir)
+    if args.profile:
+        write_profile([{'event': 'total', 'command': 'run', 'inputs': 1,
+                        'wall_time': time.perf_counter() - start,
+                        'peak_rss_mb': peak_rss_mb(children=True)}],
+                      args.profile)
+    return 0
+
+
+def _params0(values):
+    '''
+    Initial guess from the command line, a strategy or three numbers.
+    '''
+    if len(values) == 1:
+        return values[0]
+    return [float(value) for value in values]
+
+
+def _extension(file_format):
+    '''
+    First file extension registered for a writer, e.g. '.xlsx'.
+    '''
+    for extension, name in EXTENSIONS.items():
+        if name == file_format:
+            return extension
+    raise ValueError('Unknown output format ' + str(file_format))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
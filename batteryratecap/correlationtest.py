@@ -3,12 +3,16 @@ This module can be used to conduct correlations tests between two variables,
 plot their linear gression line (if exists), and detects outliers in the
 linear relationship.
 """
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import numpy as np
-from matplotlib import pyplot as plt
+import pandas as pd
 import scipy.stats
 
 
-def correlation_hypothesis(x_array, y_array, alpha, test='pearson'):
+def correlation_hypothesis(x_array, y_array, alpha, test='pearson',
+                           resampling=None, num_resamples=10000, seed=None,
+                           workers=None, executor=None):
     '''
     This function prints out the correlation and p values
     and returns the hypothesis testing results for two
@@ -20,24 +24,40 @@ def correlation_hypothesis(x_array, y_array, alpha, test='pearson'):
                 usually 0.05
         test - type of correlation test, including
                pearson and spearman test.
+        resampling - default None for the analytic p value, or
+                     'permutation' or 'bootstrap', see
+                     resampled_correlation()
+        num_resamples - integer, number of resamples
+        seed - integer seed of the resamples
+        workers - integer, number of worker processes
+        executor - an existing concurrent.futures executor
     Output:
         correlation - correlation value (between -1 and 1)
         p - p value
+        conf_int - (low, high) confidence interval of the correlation
+                   at level 1 - alpha, only returned with resampling,
+                   see resampled_correlation()
         print out hypothesis test result
     '''
     # Test that input parameters are the same length
     assert len(x_array) == len(y_array), 'Input arrays have different lengths'
     # Test that alpha is in acceptable range
     assert 0 < alpha <= 0.1, 'Alpha is not in valid range'
+    conf_int = None
     # Set test type
-    if test == 'pearson':
-        correlation, p_value = scipy.stats.pearsonr(x_array, y_array)
-    elif test == 'spearman':
-        correlation, p_value = scipy.stats.spearmanr(x_array, y_array)
-    else:
+    if test not in ('pearson', 'spearman'):
         print('Unknown correlation test')
         correlation = np.nan
         p_value = np.nan
+    elif resampling is not None:
+        correlation, p_value, conf_int, _ = resampled_correlation(
+            x_array, y_array, test=test, resampling=resampling,
+            num_resamples=num_resamples, alpha=alpha, seed=seed,
+            workers=workers, executor=executor)
+    elif test == 'pearson':
+        correlation, p_value = scipy.stats.pearsonr(x_array, y_array)
+    else:
+        correlation, p_value = scipy.stats.spearmanr(x_array, y_array)
     print(test, 'correlation betweeen the input variables is',
           "{:.2f}".format(correlation), 'with p value',
           "{:.2f}".format(p_value))
@@ -47,7 +67,170 @@ def correlation_hypothesis(x_array, y_array, alpha, test='pearson'):
     else:
         print('Accept null hypothesis. The linear correlation',
               ' is statistically insignificant')
-    return correlation, p_value
+    if resampling is None:
+        return correlation, p_value
+    return correlation, p_value, conf_int
+
+
+def resampled_correlation(x_array, y_array, test='pearson',
+                          resampling='permutation', num_resamples=10000,
+                          alpha=0.05, seed=None, block_size=None,
+                          workers=None, executor=None):
+    '''
+    This function tests the correlation of x and y by resampling instead
+    of the normal approximation, without printing. The resamples are
+    drawn and correlated in vectorized blocks of *block_size* rows, each
+    block with its own random stream spawned from *seed*, so the results
+    do not depend on the number of workers and memory stays bounded.
+    Input:
+        x - nx1 array
+        y - nx1 array
+        test - pearson or spearman
+        resampling - 'permutation': p value is the fraction of
+                     permutations of y with a correlation at least as
+                     large in magnitude.
+                     'bootstrap': p value is the smallest alpha whose
+                     two-sided bootstrap interval excludes zero.
+                     In both modes the interval of the correlation is
+                     the percentile interval over *num_resamples*
+                     resampled (x, y) pairs, without normal theory
+        num_resamples - integer, number of resamples, e.g. 1e4 to 1e6
+        alpha - the intervals have level 1 - alpha
+        seed - integer seed, default None is not reproducible
+        block_size - integer, resamples per block, default keeps a block
+                     near 32 MB
+        workers - integer, number of worker processes of a
+                  ProcessPoolExecutor, default None runs in this process
+        executor - an existing concurrent.futures executor
+    Output:
+        correlation - correlation of the input data
+        p - p value
+        conf_int - (low, high) confidence interval of the correlation
+        p_int - (low, high) Clopper-Pearson interval of the p value,
+                which is a Monte Carlo estimate in both modes
+    '''
+    assert len(x_array) == len(y_array), 'Input arrays have different lengths'
+    assert test in ('pearson', 'spearman'), 'Unknown correlation test'
+    assert resampling in ('permutation', 'bootstrap'), \
+        'Unknown resampling ' + str(resampling)
+    num_resamples = int(num_resamples)
+    assert num_resamples > 0, 'num_resamples must be positive'
+    x_values = np.asarray(x_array, dtype=float)
+    y_values = np.asarray(y_array, dtype=float)
+    correlation = _row_correlation(x_values[None], y_values[None], test)[0]
+    if block_size is None:
+        block_size = max(1, 2**22 // len(x_values))
+    sizes = [min(block_size, num_resamples - start)
+             for start in range(0, num_resamples, block_size)]
+    # the bootstrap blocks are spawned first in both modes, so that
+    # both give the same interval for the same seed
+    streams = np.random.SeedSequence(seed)
+    boot = _resample_blocks(x_values, y_values, test, 'bootstrap', sizes,
+                            streams.spawn(len(sizes)), workers, executor)
+    boot = boot[np.isfinite(boot)]
+    conf_int = tuple(np.quantile(boot, [alpha / 2, 1 - alpha / 2]))
+    if resampling == 'permutation':
+        if test == 'spearman':
+            # permuting ranks gives the ranks of the permutation,
+            # so the data is ranked once
+            x_values = scipy.stats.rankdata(x_values)
+            y_values = scipy.stats.rankdata(y_values)
+        permuted = _resample_blocks(x_values, y_values, 'pearson',
+                                    'permutation', sizes,
+                                    streams.spawn(len(sizes)), workers,
+                                    executor)
+        # small tolerance so that ties with the data count as extreme
+        extreme = np.sum(np.abs(permuted) >=
+                         np.abs(correlation) * (1 - 1e-12))
+        p_value = (extreme + 1) / (num_resamples + 1)
+        p_int = _clopper_pearson(extreme, num_resamples, alpha)
+    else:
+        tail = min(np.sum(boot <= 0), np.sum(boot >= 0))
+        p_value = min(1.0, 2 * tail / len(boot))
+        p_int = tuple(min(1.0, 2 * bound) for bound in
+                      _clopper_pearson(tail, len(boot), alpha))
+    return correlation, p_value, conf_int, p_int
+
+
+def _resample_blocks(x_values, y_values, test, resampling, sizes, seeds,
+                     workers, executor):
+    '''
+    Correlations of all resamples, one block of *sizes* per seed.
+    '''
+    args = (repeat(x_values), repeat(y_values), repeat(test),
+            repeat(resampling), sizes, seeds)
+    if executor is None and (workers is None or workers <= 1):
+        blocks = list(map(_resample_block, *args))
+    elif executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            blocks = list(pool.map(_resample_block, *args))
+    else:
+        blocks = list(executor.map(_resample_block, *args))
+    return np.concatenate(blocks)
+
+
+def _resample_block(x_values, y_values, test, resampling, size, seed):
+    '''
+    Correlations of one block of *size* resamples drawn with the
+    random stream *seed*.
+    '''
+    rng = np.random.default_rng(seed)
+    num = len(x_values)
+    if resampling == 'permutation':
+        index = rng.permuted(np.tile(np.arange(num), (size, 1)), axis=1)
+        return _row_correlation(np.broadcast_to(x_values, (size, num)),
+                                y_values[index], test)
+    index = rng.integers(0, num, (size, num))
+    return _row_correlation(x_values[index], y_values[index], test)
+
+
+def _row_correlation(x_values, y_values, test):
+    '''
+    Correlation of every row of x with the same row of y, NaN for
+    constant rows.
+    '''
+    if test == 'spearman':
+        x_values = _row_ranks(x_values)
+        y_values = _row_ranks(y_values)
+    x_values = x_values - x_values.mean(axis=1, keepdims=True)
+    y_values = y_values - y_values.mean(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = (np.einsum('ij,ij->i', x_values, y_values) /
+                np.sqrt(np.einsum('ij,ij->i', x_values, x_values) *
+                        np.einsum('ij,ij->i', y_values, y_values)))
+    return np.clip(corr, -1, 1)
+
+
+def _row_ranks(values):
+    '''
+    Average ranks within every row, like scipy.stats.rankdata(axis=1)
+    but with one argsort for all rows.
+    '''
+    order = np.argsort(values, axis=1, kind='stable')
+    ordered = np.take_along_axis(values, order, axis=1)
+    position = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+    # first and last position of every run of tied values
+    new_run = np.ones(values.shape, dtype=bool)
+    new_run[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    first = np.maximum.accumulate(np.where(new_run, position, 0), axis=1)
+    end_run = np.ones(values.shape, dtype=bool)
+    end_run[:, :-1] = new_run[:, 1:]
+    last = np.minimum.accumulate(
+        np.where(end_run, position, values.shape[1])[:, ::-1], axis=1)[:, ::-1]
+    ranks = np.empty(values.shape)
+    np.put_along_axis(ranks, order, (first + last) / 2 + 1, axis=1)
+    return ranks
+
+
+def _clopper_pearson(count, num, alpha):
+    '''
+    Exact binomial confidence interval of the proportion count / num.
+    '''
+    low = scipy.stats.beta.ppf(alpha / 2, count, num - count + 1) \
+        if count > 0 else 0.0
+    high = scipy.stats.beta.ppf(1 - alpha / 2, count + 1, num - count) \
+        if count < num else 1.0
+    return low, high
 
 
 def plot_linear_regression(x_array, y_array, plot=True):
@@ -64,6 +247,7 @@ def plot_linear_regression(x_array, y_array, plot=True):
     slope, intercept, _, _, stderr = scipy.stats.linregress(x_array, y_array)
     line_label = f'Regression line: y={intercept:.2f}+{slope:.2f}x'
     if plot is True:
+        from matplotlib import pyplot as plt
         plt.figure(figsize=(10, 8))
         plt.scatter(x_array, y_array,
                     marker='o', color='green',
@@ -78,7 +262,7 @@ def linear_outliers(x_array, y_array, num):
     '''
     This function plots and highlights the outliers from the
     regression line and return lists of x,y with outliers
-    removed.
+    removed. The outliers are found by outlier_indices().
     Input:
         x - nx1 array
         y - nx1 array
@@ -88,54 +272,238 @@ def linear_outliers(x_array, y_array, num):
         y_no_outliers - (n-num)x1 array
         plot x, y data and highlights the outliers
     '''
+    x_array = np.asarray(x_array)
+    y_array = np.asarray(y_array)
     # Plot original data
     _, _, stderr = plot_linear_regression(x_array, y_array, plot=False)
     print('original std error is', stderr)
-    # Starting x and y before outlier removal
-    x_no_outliers = x_array
-    y_no_outliers = y_array
-    # Calculate std error with each datapoint index removed
-    for _ in range(num):
-        err_list = []
-        for index, _ in enumerate(x_no_outliers):
-            x_remove = []
-            y_remove = []
-            x_remove = np.append(x_no_outliers[:int(index)],
-                                 x_no_outliers[int(index)+1:])
-            y_remove = np.append(y_no_outliers[:int(index)],
-                                 y_no_outliers[int(index)+1:])
-            _, _, stderr = plot_linear_regression(x_remove,
-                                                  y_remove,
-                                                  plot=False)
-            err_list.append(abs(stderr))
-        # Sort error index from min to max and
-        # get the index that returns the min stderr
-        max_index = np.argsort(err_list)[0]
+    outliers = outlier_indices(x_array, y_array, num)
+    for index in outliers:
         print('Detect outlier at position', 'x=',
-              x_no_outliers[max_index], 'y=', y_no_outliers[max_index])
-        # Remove outlier
-        x_no_outliers = np.append(x_no_outliers[:int(max_index)],
-                                  x_no_outliers[int(max_index+1):])
-        y_no_outliers = np.append(y_no_outliers[:int(max_index)],
-                                  y_no_outliers[int(max_index+1):])
-    # Find outlier arrays
-    x_outliers = list(x_array)
-    y_outliers = list(y_array)
-    # Remove elements in x_outliers that match elements in x_no_outliers
-    # At the end, only the outliers are left in x_outliers
-    for element in list(x_outliers):
-        if element in list(x_no_outliers):
-            x_outliers.remove(element)
-            list(x_no_outliers).remove(element)
-    for element in list(y_outliers):
-        if element in list(y_no_outliers):
-            y_outliers.remove(element)
-            list(y_no_outliers).remove(element)
+              x_array[index], 'y=', y_array[index])
+    # Remove outliers by position, so that duplicated values
+    # elsewhere in the arrays are kept
+    x_no_outliers = np.delete(x_array, outliers)
+    y_no_outliers = np.delete(y_array, outliers)
     # Plot regression line without outliers
     _, _, stderr = plot_linear_regression(x_no_outliers,
                                           y_no_outliers)
     print('new std error is', stderr)
-    plt.scatter(x_outliers, y_outliers, marker='o',
+    from matplotlib import pyplot as plt
+    plt.scatter(x_array[outliers], y_array[outliers], marker='o',
                 color='r', label='outliers', s=200)
     plt.legend()
     return x_no_outliers, y_no_outliers
+
+
+def outlier_indices(x_array, y_array, num):
+    '''
+    This function finds the *num* points whose removal most reduces the
+    standard error of the regression slope, one at a time like
+    linear_outliers(). The leave-one-out standard errors of all points
+    are computed at once from the running sums n, sum(x), sum(y),
+    sum(x*x), sum(x*y) and sum(y*y), which are updated as outliers are
+    removed, so each outlier costs O(n) instead of n regressions.
+    Input:
+        x - nx1 array
+        y - nx1 array
+        num - integar, number of outliers
+    Output:
+        indices of the outliers in *x* and *y*, in order of removal
+    '''
+    assert len(x_array) == len(y_array), 'Input arrays have different lengths'
+    assert isinstance(num, (int, np.integer)), 'num must be an integer'
+    assert 0 <= num <= len(x_array) - 3, 'num leaves less than 3 points'
+    # center the data once to limit cancellation in the sums
+    x_values = np.asarray(x_array, dtype=float)
+    y_values = np.asarray(y_array, dtype=float)
+    x_values = x_values - x_values.mean()
+    y_values = y_values - y_values.mean()
+    sums = np.array([len(x_values), x_values.sum(), y_values.sum(),
+                     x_values @ x_values, x_values @ y_values,
+                     y_values @ y_values])
+    remaining = np.ones(len(x_values), dtype=bool)
+    outliers = []
+    for _ in range(num):
+        stderr = leave_one_out_stderr(sums, x_values, y_values)
+        stderr[~remaining | ~np.isfinite(stderr)] = np.inf
+        index = int(np.argmin(stderr))
+        outliers.append(index)
+        remaining[index] = False
+        # update the running sums
+        sums -= [1, x_values[index], y_values[index],
+                 x_values[index]**2, x_values[index] * y_values[index],
+                 y_values[index]**2]
+    return np.array(outliers, dtype=int)
+
+
+def leave_one_out_stderr(sums, x_array, y_array):
+    '''
+    This function returns, for every point, the standard error of the
+    regression slope (as scipy.stats.linregress reports it) of the data
+    without that point.
+    Input:
+        sums - running sums [n, sum(x), sum(y), sum(x*x), sum(x*y),
+               sum(y*y)] of the data
+        x - nx1 array
+        y - nx1 array
+    Output:
+        nx1 array of standard errors
+    '''
+    num = sums[0] - 1
+    sum_x = sums[1] - x_array
+    sum_y = sums[2] - y_array
+    sxx = sums[3] - x_array**2 - sum_x**2 / num
+    sxy = sums[4] - x_array * y_array - sum_x * sum_y / num
+    syy = sums[5] - y_array**2 - sum_y**2 / num
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # residual sum of squares of the regression line
+        residual = np.maximum(syy - sxy**2 / sxx, 0)
+        return np.sqrt(residual / sxx / (num - 2))
+
+
+def correlation_matrix(features, fit_params, parameters=('tau', 'n', 'Qmax'),
+                       methods=('pearson', 'spearman'), correction=None):
+    '''
+    This function tests the correlation of every feature with every
+    fit parameter at once and returns the results as a tidy dataframe,
+    without printing. For the spearman test, columns with the same
+    missing values are ranked together once, and the correlations of
+    all pairs come from a few matrix products over the pairwise
+    complete rows.
+    Input:
+        features - dataframe of design features, one row per dataset
+        fit_params - dataframe of fit parameters with the same rows,
+                     e.g. returned by fitmodel()
+        parameters - columns of fit_params to test
+        methods - correlation tests, pearson and/or spearman
+        correction - None, or multiple-testing correction applied to all
+                     pairs of each test: 'bonferroni', 'holm' or 'fdr_bh'
+    Output:
+        dataframe with one row per feature, parameter and test and the
+        columns feature, parameter, test, n, correlation, p_value and,
+        with a correction, p_adjusted
+    '''
+    # Test that input frames have the same rows
+    assert len(features) == len(fit_params), 'Input frames have \
+    different lengths'
+    for method in methods:
+        assert method in ('pearson', 'spearman'), \
+            'Unknown correlation test ' + str(method)
+    assert correction in (None, 'bonferroni', 'holm', 'fdr_bh'), \
+        'Unknown correction ' + str(correction)
+    parameters = list(parameters)
+    x_values = features.to_numpy(dtype=float)
+    y_values = fit_params[parameters].to_numpy(dtype=float)
+    results = []
+    for method in methods:
+        if method == 'spearman':
+            corr, num = _masked_spearman(x_values, y_values)
+        else:
+            corr, num = _masked_pearson(x_values, y_values)
+        p_value = _correlation_p_value(corr, num)
+        result = {'feature': np.repeat(features.columns, len(parameters)),
+                  'parameter': np.tile(parameters, len(features.columns)),
+                  'test': method,
+                  'n': num.ravel(),
+                  'correlation': corr.ravel(),
+                  'p_value': p_value.ravel()}
+        if correction is not None:
+            result['p_adjusted'] = adjust_p_values(p_value.ravel(), correction)
+        results.append(pd.DataFrame(result))
+    return pd.concat(results, ignore_index=True)
+
+
+def adjust_p_values(p_values, correction='fdr_bh'):
+    '''
+    This function adjusts p values for multiple testing.
+    Input:
+        p_values - 1D array, NaN values are left out of the correction
+        correction - 'bonferroni', 'holm' (step-down family-wise error)
+                     or 'fdr_bh' (Benjamini-Hochberg false discovery rate)
+    Output:
+        1D array of adjusted p values
+    '''
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = np.full(p_values.shape, np.nan)
+    valid = np.flatnonzero(~np.isnan(p_values))
+    num = valid.size
+    if num == 0:
+        return adjusted
+    order = valid[np.argsort(p_values[valid], kind='stable')]
+    ordered = p_values[order]
+    if correction == 'bonferroni':
+        scaled = ordered * num
+    elif correction == 'holm':
+        scaled = np.maximum.accumulate(ordered * np.arange(num, 0, -1))
+    elif correction == 'fdr_bh':
+        scaled = ordered * num / np.arange(1, num + 1)
+        scaled = np.minimum.accumulate(scaled[::-1])[::-1]
+    else:
+        raise ValueError('Unknown correction ' + str(correction))
+    adjusted[order] = np.minimum(scaled, 1)
+    return adjusted
+
+
+def _masked_spearman(x_values, y_values):
+    '''
+    Spearman correlations of every column of x with every column of y
+    over their pairwise complete rows. Columns are grouped by missing
+    values so that each group pair is ranked once, a single group
+    when nothing is missing.
+    '''
+    corr = np.full((x_values.shape[1], y_values.shape[1]), np.nan)
+    num = np.zeros(corr.shape, dtype=int)
+    x_patterns, x_groups = np.unique(np.isnan(x_values).T, axis=0,
+                                     return_inverse=True)
+    y_patterns, y_groups = np.unique(np.isnan(y_values).T, axis=0,
+                                     return_inverse=True)
+    for i, x_missing in enumerate(x_patterns):
+        for j, y_missing in enumerate(y_patterns):
+            rows = ~x_missing & ~y_missing
+            x_cols = np.flatnonzero(x_groups.ravel() == i)
+            y_cols = np.flatnonzero(y_groups.ravel() == j)
+            # rank the complete rows, ties get the average rank
+            x_ranks = scipy.stats.rankdata(x_values[np.ix_(rows, x_cols)],
+                                           axis=0)
+            y_ranks = scipy.stats.rankdata(y_values[np.ix_(rows, y_cols)],
+                                           axis=0)
+            block_corr, block_num = _masked_pearson(x_ranks, y_ranks)
+            corr[np.ix_(x_cols, y_cols)] = block_corr
+            num[np.ix_(x_cols, y_cols)] = block_num
+    return corr, num
+
+
+def _masked_pearson(x_values, y_values):
+    '''
+    Pearson correlations of every column of x with every column of y
+    over their pairwise complete rows, and the number of those rows.
+    '''
+    x_mask = (~np.isnan(x_values)).astype(float)
+    y_mask = (~np.isnan(y_values)).astype(float)
+    # center the columns to limit cancellation in the sums
+    x_values = np.nan_to_num(x_values - np.nansum(x_values, axis=0) /
+                             np.maximum(x_mask.sum(axis=0), 1))
+    y_values = np.nan_to_num(y_values - np.nansum(y_values, axis=0) /
+                             np.maximum(y_mask.sum(axis=0), 1))
+    num = x_mask.T @ y_mask
+    sum_x = x_values.T @ y_mask
+    sum_y = x_mask.T @ y_values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sxy = x_values.T @ y_values - sum_x * sum_y / num
+        sxx = (x_values**2).T @ y_mask - sum_x**2 / num
+        syy = x_mask.T @ y_values**2 - sum_y**2 / num
+        corr = sxy / np.sqrt(sxx * syy)
+    return np.clip(corr, -1, 1), num.astype(int)
+
+
+def _correlation_p_value(corr, num):
+    '''
+    Two-sided p values of correlations from the t distribution with
+    n - 2 degrees of freedom, NaN with less than 3 rows.
+    '''
+    dof = (num - 2).astype(float)
+    dof[dof < 1] = np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_value = corr * np.sqrt(dof / (1 - corr**2))
+    return 2 * scipy.stats.t.sf(np.abs(t_value), dof)
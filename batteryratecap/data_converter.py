@@ -1,18 +1,27 @@
 """
 This module is used to convert battery cycling data
-and battery charge/discharge data into capacity-rate data.
+and battery charge/discharge data into capacity-rate data. The files
+written are logged to the 'batteryratecap.data_converter' logger.
 """
 import os
+import time
+import logging
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import numpy as np
 import pandas as pd
-from matplotlib import pyplot as plt
-import openpyxl
-from openpyxl.utils.dataframe import dataframe_to_rows
-from sklearn.mixture import GaussianMixture
+from batteryratecap import instrument
+from batteryratecap.writers import write_dataframe
+from batteryratecap.cache import read_workbook
+from batteryratecap.datasets import CapacityRateData
+
+_LOGGER = logging.getLogger(__name__)
 
 
 def potential_rate_paper_set(input_file, sheet_name,
-                             output_file, paper_num, set_num):
+                             output_file, paper_num, set_num, writer=None,
+                             cache=None):
     """
     This function converts potential vs. capacity data to capacity vs c-rate
     data. The Highest x-value (capacity [mAh]) from the charge/discharge graph.
@@ -30,6 +39,11 @@ def potential_rate_paper_set(input_file, sheet_name,
     2) sheetnames - list
     3) Paper # - string
     4) Set # - integer: max number of sets
+    5) writer - None, a writer name ('xlsx', 'csv', 'parquet', 'feather')
+       or a callable, by default picked from the output file extension
+    6) cache - None, True or a cache directory. If given, the parsed sheets
+       are kept on disk by batteryratecap.cache and reused by later calls
+       on the same file
     RETURNS
     -------
     Capacity vs c-rate dataframe
@@ -48,7 +62,7 @@ def potential_rate_paper_set(input_file, sheet_name,
     for _, name in enumerate(sheet_name):
         assert 'C_' in name, 'input sheet names are not in the correct format'
     # Dataframing the interested potential vs capacity excel sheet
-    df_input = pd.read_excel(input_file, sheet_name, header=[0, 1, 2])
+    df_input = _read_sheets(input_file, sheet_name, cache)
     # Merging multiple spreadsheets
     df_sheets = []
     for _, name in enumerate(sheet_name):
@@ -77,21 +91,111 @@ def potential_rate_paper_set(input_file, sheet_name,
     # Test that the output is a dataframe
     assert isinstance(df_cap_rate, pd.DataFrame) is True, '\
     The output must be a dataframe'
-    # Exporting the converted dataframe to an excel file
-    workbook = openpyxl.Workbook()
-    worksheet = workbook.active
-    for row in dataframe_to_rows(df_cap_rate, index=True, header=True):
-        worksheet.append(row)
-    workbook.save(output_file)
+    # Exporting the converted dataframe to the output file
+    with instrument.timer('convert.write', output=output_file):
+        write_dataframe(df_cap_rate, output_file, writer=writer, index=True)
 #     df_cap_rate.to_excel(output_file,sheet_name=paper_num,
 #                          index=False, header=True)
     # Test that the sheet name is a string
     assert isinstance(paper_num, str) is True, 'sheetname must be a string'
-    print('saved succesfully to' + output_file)
+    _LOGGER.info('saved successfully to %s', output_file)
     return df_cap_rate
 
 
-def potential_rate_all(input_file, output_file):
+def potential_rate_papers(input_file, sheet_name, output_file,
+                          papers='all', writer=None, cache=None,
+                          layout='wide'):
+    """
+    This function is the batch version of potential_rate_paper_set(). It
+    converts potential vs. capacity data of many papers to capacity vs
+    c-rate data at once: the sheets are read and merged a single time, the
+    maximum capacity of every paper, set and sheet is found in one groupby
+    over the merged column headers, and all papers are written to a single
+    output file.
+    PARAMETERS
+    ----------
+    1) Excel file (file path) - string
+    2) sheetnames - list
+    3) Output file name - string
+    4) papers - 'all', or a list of (Paper #, Set #) pairs such as
+       [('Paper # 32', 2)], where Set # is the max number of sets as in
+       potential_rate_paper_set()
+    5) writer - None, a writer name ('xlsx', 'csv', 'parquet', 'feather')
+       or a callable, by default picked from the output file extension
+    6) cache - None, True or a cache directory, see potential_rate_all()
+    7) layout - 'wide' or 'long', see potential_rate_all()
+    RETURNS
+    -------
+    Capacity vs c-rate dataframe with a ('C rate', 'Capacity (mAh/g)')
+    pair of columns per paper and set, or CapacityRateData
+    """
+    assert layout in ('wide', 'long'), 'Unknown layout ' + str(layout)
+    # Assert input sheet names are in a list
+    if isinstance(sheet_name, list) is not True:
+        raise TypeError('sheet_name must be a list of strings')
+    # Assert sheetname contains 'C_'
+    for _, name in enumerate(sheet_name):
+        assert 'C_' in name, 'input sheet names are not in the correct format'
+    if papers != 'all':
+        for paper_num, set_num in papers:
+            assert isinstance(set_num, int) is True, \
+                'set_num must be an integer'
+            assert isinstance(paper_num, str) is True, \
+                'paper_num must be a string'
+            assert 'Paper # ' in paper_num, 'paper_num not in correct format'
+    # Dataframing and merging the potential vs capacity excel sheets,
+    # the sheet name becomes the first column level
+    df_input = _read_sheets(input_file, sheet_name, cache)
+    df_merged = pd.concat([df_input[name] for name in sheet_name], axis=1,
+                          keys=sheet_name)
+    # Maximum capacity of each sheet, paper and set
+    capacity = df_merged.columns.get_level_values(3) == 'Capacity (mAh/g)'
+    maxima = df_merged.loc[:, capacity].apply(pd.to_numeric, errors='coerce')
+    maxima = maxima.max(axis=0).groupby(level=[0, 1, 2], sort=False).max()
+    # One row per paper and set, one column per sheet
+    if papers == 'all':
+        pairs = list(maxima.index.droplevel(0).unique())
+    else:
+        pairs = [(paper_num, 'set #' + str(i))
+                 for paper_num, set_num in papers
+                 for i in range(1, set_num + 1)]
+    table = maxima.unstack(level=0)
+    for pair in pairs:
+        assert pair in table.index, str(pair) + ' not found in the sheets'
+    table = table.reindex(index=pd.MultiIndex.from_tuples(pairs),
+                          columns=sheet_name)
+    # Flatten into (paper, set, quantity, C-rate, max) records
+    rates = [name.split("C_")[0] for name in sheet_name]
+    num_sheet = len(sheet_name)
+    records = (np.repeat(table.index.get_level_values(0), num_sheet),
+               np.repeat(table.index.get_level_values(1), num_sheet),
+               ['Capacity (mAh/g)'] * table.size, rates * len(pairs),
+               table.to_numpy(dtype=float).ravel())
+    result, df_cap_rate = _layout_records(records, 'C rate', layout)
+    # Exporting the converted dataframe to the output file
+    with instrument.timer('convert.write', output=output_file):
+        write_dataframe(df_cap_rate, output_file, writer=writer, index=True)
+    _LOGGER.info('saved successfully to %s', output_file)
+    return result
+
+
+def _layout_records(records, rate_header, layout):
+    """
+    Capacity-rate result of (paper, set, quantity, C-rate, max) records in
+    the requested layout, and the wide dataframe written to output files.
+    """
+    with instrument.timer('convert.build', records=len(records[0]),
+                          layout=layout):
+        if layout == 'long':
+            data = CapacityRateData.from_records(*records,
+                                                 rate_header=rate_header)
+            return data, data.to_frame()
+        df_cap_rate = _capacity_rate_frame(*records, rate_header=rate_header)
+        return df_cap_rate, df_cap_rate
+
+
+def potential_rate_all(input_file, output_file, writer=None,
+                       streaming=False, cache=None, layout='wide'):
     """
     This function converts and dataframes all voltage potential data and
     separates them by paper and set numbers such that the users can see
@@ -107,45 +211,249 @@ def potential_rate_all(input_file, output_file):
     PARAMETERS
     ----------
     1) Excel file (file path) - string
-    2) Output Excel file name - string
+    2) Output Excel file name - string, or None to skip writing the file
+    3) writer - None, a writer name ('xlsx', 'csv', 'parquet', 'feather')
+       or a callable, by default picked from the output file extension
+    4) streaming - boolean, default False. If True, the sheets are read one
+       at a time with iter_potential_rate() instead of all at once
+    5) cache - None, True or a cache directory. If given, the parsed sheets
+       are kept on disk by batteryratecap.cache and reused by later calls
+       on the same file. Not used when streaming
+    6) layout - 'wide' (default) returns the dataframe, 'long' returns
+       the compact batteryratecap.datasets.CapacityRateData built
+       directly from the records. The output file is written in the
+       wide layout either way
     RETURNS
     -------
-    A voltage-capaity dataframe by paper and set number
-    """
-    # Read all sheets in the input file into a dictionary
-    dict_excel = pd.read_excel(input_file, sheet_name=None, header=[0, 1, 2])
-    sheetnames = list(dict_excel.keys())
-#     dict_excel[sheetnames[0]]
-    df_cap_rate = pd.DataFrame()
-    for _, sheetname in enumerate(sheetnames):
-        df_input = dict_excel[sheetname]
+    A voltage-capaity dataframe by paper and set number,
+    or CapacityRateData
+    """
+    assert layout in ('wide', 'long'), 'Unknown layout ' + str(layout)
+    # Collect one (paper, set, quantity, C-rate, max) record
+    # per capacity column of every sheet
+    papers, sets, quantities, rates, maxima = [], [], [], [], []
+    for sheetname, sheet_maxima in _iter_sheet_maxima(input_file, streaming,
+                                                      cache=cache):
         rate = sheetname.split("C_")[0]
-        for headers, columnval in df_input.items():
-            paper_num, set_num, quan = headers
-            assert 'Paper' in paper_num, 'Wrong paper number header'
-            assert 'set' in set_num, 'Wrong set number format'
-            # Takes only the capacity data
-            if 'capacity' in quan or 'Capacity' in quan:
-                max_cap = np.nanmax(columnval.values)
-                # Must create the dataframe first
-                # before adding multiple headers
-                newdf = pd.DataFrame([[rate, max_cap]])
-                # Add headers
-                newdf_header = [[paper_num, paper_num],
-                                [set_num, set_num], ['C-rate', quan]]
-                newdf.columns = newdf_header
-                df_cap_rate = pd.concat([df_cap_rate, newdf])
-    # apply lambda function to each column to drop Nans
-    df_cap_rate_all = df_cap_rate.apply(lambda x: pd.Series(x.dropna().values))
-    # Export dataframe to Excel
-    workbook = openpyxl.Workbook()
-    worksheet = workbook.active
-    for row in dataframe_to_rows(df_cap_rate_all, index=True, header=True):
-        worksheet.append(row)
-    workbook.save(output_file)
+        for paper_num, set_num, quan, max_cap in sheet_maxima:
+            papers.append(paper_num)
+            sets.append(set_num)
+            quantities.append(quan)
+            rates.append(rate)
+            maxima.append(max_cap)
+    # Build the capacity-rate result in one step
+    result, df_cap_rate_all = _layout_records(
+        (papers, sets, quantities, rates, maxima), 'C-rate', layout)
+    if output_file is not None:
+        # Export dataframe to the output file
+        with instrument.timer('convert.write', output=output_file):
+            write_dataframe(df_cap_rate_all, output_file, writer=writer,
+                            index=True)
 #     df_cap_rate_all.to_excel(output_file,sheet_name='CapacityRate',
 #                              index=True, header=True)
-    return df_cap_rate_all
+    return result
+
+
+def iter_potential_rate(input_file, chunksize=10000):
+    """
+    This generator reads the charge/discharge workbook of
+    potential_rate_all() one sheet at a time and yields the partial
+    capacity-rate result of each sheet as soon as it is read. For .xlsx
+    files the sheet rows are streamed through an openpyxl read-only
+    workbook and the maximum of every capacity column is updated chunk
+    by chunk, so no full sheet dataframe is built. Other Excel files are
+    parsed with pandas, still one sheet at a time.
+    PARAMETERS
+    ----------
+    1) Excel file (file path) - string
+    2) chunksize - integer, number of rows reduced at once when streaming
+    YIELDS
+    ------
+    One-row dataframe per sheet with a ('C-rate', capacity) pair of
+    columns for each paper and set number
+    """
+    for sheetname, maxima in _iter_sheet_maxima(input_file, True, chunksize):
+        rate = sheetname.split("C_")[0]
+        papers = [paper_num for paper_num, _, _, _ in maxima]
+        sets = [set_num for _, set_num, _, _ in maxima]
+        quantities = [quan for _, _, quan, _ in maxima]
+        max_caps = [max_cap for _, _, _, max_cap in maxima]
+        yield _capacity_rate_frame(papers, sets, quantities,
+                                   [rate] * len(maxima), max_caps)
+
+
+def _iter_sheet_maxima(input_file, streaming, chunksize=10000, cache=None):
+    """
+    Yield the name of every sheet with the maximum of each of its capacity
+    columns, as a list of (paper, set, quantity, max) tuples.
+    """
+    _, ext = os.path.splitext(input_file)
+    if streaming and ext.lower() in ('.xlsx', '.xlsm'):
+        import openpyxl
+        workbook = openpyxl.load_workbook(input_file, read_only=True,
+                                          data_only=True)
+        try:
+            for worksheet in workbook.worksheets:
+                with instrument.timer('convert.sheet',
+                                      sheet=worksheet.title, streaming=True):
+                    maxima = _stream_capacity_maxima(worksheet, chunksize)
+                _count_maxima(maxima)
+                yield worksheet.title, maxima
+        finally:
+            workbook.close()
+    elif streaming:
+        excel_file = pd.ExcelFile(input_file)
+        for sheetname in excel_file.sheet_names:
+            with instrument.timer('convert.sheet', sheet=sheetname,
+                                  streaming=True):
+                df_input = excel_file.parse(sheetname, header=[0, 1, 2])
+                maxima = _frame_capacity_maxima(df_input)
+            _count_maxima(maxima)
+            yield sheetname, maxima
+    else:
+        # Read all sheets in the input file into a dictionary
+        dict_excel = _read_sheets(input_file, None, cache)
+        for sheetname, df_input in dict_excel.items():
+            with instrument.timer('convert.sheet', sheet=sheetname,
+                                  streaming=False):
+                maxima = _frame_capacity_maxima(df_input)
+            _count_maxima(maxima)
+            yield sheetname, maxima
+
+
+def _count_maxima(maxima):
+    """
+    Count the sheets, capacity columns and columns without any number
+    of the instrumentation sessions.
+    """
+    if instrument.enabled():
+        instrument.count('convert.sheets')
+        instrument.count('convert.columns', len(maxima))
+        instrument.count('convert.empty_columns',
+                         sum(1 for *_, max_cap in maxima
+                             if pd.isnull(max_cap)))
+
+
+def _read_sheets(input_file, sheet_name, cache):
+    """
+    pd.read_excel() of sheets with 3-level headers, through the on-disk
+    workbook cache unless *cache* is None or False.
+    """
+    cached = cache is not None and cache is not False
+    with instrument.timer('convert.read', input=input_file, cache=cached):
+        if not cached:
+            return pd.read_excel(input_file, sheet_name, header=[0, 1, 2])
+        cache_dir = None if cache is True else cache
+        return read_workbook(input_file, sheet_name, cache_dir=cache_dir)
+
+
+def _frame_capacity_maxima(df_input):
+    """
+    Maximum of every capacity column of a sheet dataframe, as a list
+    of (paper, set, quantity, max) tuples in column order.
+    """
+    for paper_num, set_num, _ in df_input.columns:
+        _check_headers(paper_num, set_num)
+    # Takes only the capacity data
+    quantities = df_input.columns.get_level_values(2).astype(str)
+    capacity = np.asarray(quantities.str.contains('capacity|Capacity'))
+    max_caps = df_input.loc[:, capacity].apply(pd.to_numeric,
+                                               errors='coerce').max(axis=0)
+    return [headers + (max_cap,) for headers, max_cap in max_caps.items()]
+
+
+def _stream_capacity_maxima(worksheet, chunksize):
+    """
+    Maximum of every capacity column of a read-only worksheet, as a list
+    of (paper, set, quantity, max) tuples in column order.
+    """
+    rows = worksheet.iter_rows(values_only=True)
+    headers = [list(next(rows, ())) for _ in range(3)]
+    num_col = max(len(level) for level in headers)
+    headers = [level + [None] * (num_col - len(level)) for level in headers]
+    # Paper and set headers span their columns as merged cells,
+    # fill them forward like pd.read_excel(header=[0, 1, 2]) does
+    for level in headers[:2]:
+        for col in range(1, num_col):
+            if level[col] is None:
+                level[col] = level[col - 1]
+    columns = []
+    for col in range(num_col):
+        paper_num, set_num, quan = (str(level[col]) for level in headers)
+        _check_headers(paper_num, set_num)
+        # Takes only the capacity data
+        if 'capacity' in quan or 'Capacity' in quan:
+            columns.append(col)
+    maxima = np.full(len(columns), -np.inf)
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunksize:
+            maxima = np.fmax(maxima, _chunk_maxima(chunk, columns))
+            chunk = []
+    if chunk:
+        maxima = np.fmax(maxima, _chunk_maxima(chunk, columns))
+    # columns without any number give NaN like np.nanmax
+    maxima[np.isneginf(maxima)] = np.nan
+    return [(headers[0][col], headers[1][col], headers[2][col], max_cap)
+            for col, max_cap in zip(columns, maxima)]
+
+
+def _chunk_maxima(chunk, columns):
+    """
+    Column maxima of a list of worksheet rows, ignoring empty cells
+    and text.
+    """
+    values = pd.DataFrame.from_records(chunk).reindex(columns=columns)
+    values = values.apply(pd.to_numeric, errors='coerce')
+    return values.max(axis=0).fillna(-np.inf).to_numpy()
+
+
+def _check_headers(paper_num, set_num):
+    """
+    Assert the paper and set number headers of a sheet column.
+    """
+    assert 'Paper' in paper_num, 'Wrong paper number header'
+    assert 'set' in set_num, 'Wrong set number format'
+
+
+def _capacity_rate_frame(papers, sets, quantities, rates, maxima,
+                         rate_header='C-rate'):
+    """
+    Capacity-rate dataframe from flat lists of (paper, set, quantity,
+    C-rate, max) records. Every (paper, set, quantity) gets a *rate_header*
+    and a capacity column, in order of first appearance, holding its
+    records top down. Records without a maximum are dropped.
+    """
+    maxima = np.asarray(maxima, dtype=float)
+    keep = ~np.isnan(maxima)
+    if not keep.any():
+        return pd.DataFrame()
+    keys = pd.MultiIndex.from_arrays([np.asarray(papers, dtype=object),
+                                      np.asarray(sets, dtype=object),
+                                      np.asarray(quantities, dtype=object)])
+    codes, uniques = pd.factorize(keys[keep])
+    # row of each record within its (paper, set, quantity) group
+    counts = np.bincount(codes)
+    order = np.argsort(codes, kind='stable')
+    row = np.empty_like(codes)
+    row[order] = np.arange(len(codes)) - np.repeat(np.cumsum(counts) -
+                                                   counts, counts)
+    rate_block = np.full((counts.max(), len(uniques)), np.nan, dtype=object)
+    rate_block[row, codes] = np.asarray(rates, dtype=object)[keep]
+    cap_block = np.full((counts.max(), len(uniques)), np.nan)
+    cap_block[row, codes] = maxima[keep]
+    # interleave the C-rate and capacity columns
+    columns = {}
+    headers = []
+    for i, (paper_num, set_num, quan) in enumerate(uniques):
+        columns[2 * i] = rate_block[:, i]
+        columns[2 * i + 1] = cap_block[:, i]
+        headers.extend([(paper_num, set_num, rate_header),
+                        (paper_num, set_num, quan)])
+    df_cap_rate = pd.DataFrame(columns)
+    df_cap_rate.columns = pd.MultiIndex.from_tuples(headers)
+    return df_cap_rate
 
 
 def excel_merge(dataframe, xls_file, sheetname):
@@ -153,7 +461,7 @@ def excel_merge(dataframe, xls_file, sheetname):
     This function adds the converted dataframe to an existing excel file
     PARAMETERS
     ----------
-    1) converted dataframe - dataframe
+    1) converted dataframe - dataframe or CapacityRateData
     2) Excel file (file path) - string
     3) sheetname - string
     RETURNS
@@ -165,49 +473,75 @@ def excel_merge(dataframe, xls_file, sheetname):
     assert ext == '.xls' or ext == '.xlsx', 'Wrong output file type'
     # Test that the sheet name is a string
     assert isinstance(sheetname, str) is True, 'sheetname must be a string'
+    if isinstance(dataframe, CapacityRateData):
+        dataframe = dataframe.to_frame()
     dataframe.to_excel(xls_file, sheet_name=sheetname,
                        index=False, header=True)
-    print('saved succesfully to' + xls_file)
+    _LOGGER.info('saved successfully to %s', xls_file)
 
 
 def capacity_cycle(capacity_cycle_array, num_rate,
-                   current_list, current_unit, capacity_unit):
+                   current_list, current_unit, capacity_unit,
+                   method='steps', plot=True):
     '''
     This function converts capacity-cycle data to capacity-rate plots.
-    For different selections of paper/set, the user will have to adjust
-    'n_components' until the groups are properly grouped, as seen in the
-    plot below.
+    By default the 'stairs' are found by detect_steps(), a change-point
+    segmentation of the capacity along the cycle number, which also
+    detects the number of stairs when *num_rate* is None. With
+    method='gmm' the points are grouped by a GaussianMixture instead;
+    for different selections of paper/set, the user will then have to
+    adjust 'n_components' until the groups are properly grouped, as seen
+    in the plot below.
     Inputs
     - capacity_cycle_array: nx2 capacity vs cycle # array
-    - n: number of C-rates, or 'stairs'
+    - num_rate: number of C-rates, or 'stairs', None to detect it
+      (not with method='gmm')
     - current_list: a list of current rates or current densities
     - current_unit: a text string of current unit
     - capacity_unit: a text string od capacity unit
+    - method: 'steps' (default) or 'gmm'
+    - plot: boolean, default True plots the grouped points
     '''
     assert capacity_cycle_array.shape[1] == 2, 'Input array wrong shape'
-    assert len(current_list) == num_rate, 'Input number of current wrong'
-    model = GaussianMixture(n_components=num_rate)
-    model.fit(capacity_cycle_array)
-    # Use the model to make predictions about which group each datapoint
-    # belongs to.
-    # Predictions stored as an np array with indexes corresponding to points,
-    # and values to their assigned class
-    prediction = model.predict(capacity_cycle_array)
-    # np.array of the unique classes
-    clusters = np.unique(prediction)
-    # Plot the points now that they are grouped
-    plt.figure(figsize=(10, 8))
-    for cluster in clusters:
-        row_ix = np.where(prediction == cluster)
-        plt.scatter(capacity_cycle_array[row_ix, 0],
-                    capacity_cycle_array[row_ix, 1],
-                    s=300)
-    plt.ylabel("Capacity "+capacity_unit, fontsize=22)
-    plt.xlabel("Cycle #", fontsize=22)
-    # Return the means of each 'stair' and sort
-    means = model.means_
-    means = means[np.argsort(means[:, 0])]
-    means_of_groups = means[:, 1]
+    assert method in ('steps', 'gmm'), 'Unknown method ' + str(method)
+    if num_rate is not None:
+        assert len(current_list) == num_rate, 'Input number of current wrong'
+    if method == 'gmm':
+        assert num_rate is not None, 'num_rate is required by method gmm'
+        from sklearn.mixture import GaussianMixture
+        model = GaussianMixture(n_components=num_rate)
+        model.fit(capacity_cycle_array)
+        # Use the model to make predictions about which group each
+        # datapoint belongs to.
+        # Predictions stored as an np array with indexes corresponding to
+        # points, and values to their assigned class
+        prediction = model.predict(capacity_cycle_array)
+        # Return the means of each 'stair' and sort
+        means = model.means_
+        means = means[np.argsort(means[:, 0])]
+        means_of_groups = means[:, 1]
+    else:
+        prediction = detect_steps(capacity_cycle_array, num_rate)
+        # Mean capacity of each 'stair', already in cycle order
+        means_of_groups = (np.bincount(prediction,
+                                       weights=capacity_cycle_array[:, 1]) /
+                           np.bincount(prediction))
+        assert len(current_list) == len(means_of_groups), \
+            'Input number of current wrong, ' + \
+            str(len(means_of_groups)) + ' stairs detected'
+    if plot:
+        from matplotlib import pyplot as plt
+        # np.array of the unique classes
+        clusters = np.unique(prediction)
+        # Plot the points now that they are grouped
+        plt.figure(figsize=(10, 8))
+        for cluster in clusters:
+            row_ix = np.where(prediction == cluster)
+            plt.scatter(capacity_cycle_array[row_ix, 0],
+                        capacity_cycle_array[row_ix, 1],
+                        s=300)
+        plt.ylabel("Capacity "+capacity_unit, fontsize=22)
+        plt.xlabel("Cycle #", fontsize=22)
     means_of_groups = pd.DataFrame(means_of_groups)
     means_of_groups = means_of_groups.rename(
         columns={0: "Capacity"+capacity_unit})
@@ -218,3 +552,141 @@ def capacity_cycle(capacity_cycle_array, num_rate,
     capacity_vs_current_density_df = pd.concat([current_list,
                                                 means_of_groups], axis=1)
     return capacity_vs_current_density_df
+
+
+def capacity_cycle_batch(cells, current_unit, capacity_unit,
+                         method='steps', workers=None, executor=None,
+                         chunksize=1):
+    '''
+    This function runs capacity_cycle() on many cells, without plotting,
+    and gathers the stairs of all cells in one long-format dataframe.
+    A cell that fails is reported and skipped, the batch goes on.
+    Inputs
+    - cells: dictionary of cell id to (capacity_cycle_array, current_list),
+      the number of stairs of each cell being len(current_list)
+    - current_unit: a text string of current unit
+    - capacity_unit: a text string od capacity unit
+    - method: 'steps' (default) or 'gmm', see capacity_cycle()
+    - workers: integer, number of worker processes of a
+      ProcessPoolExecutor, default None runs in this process
+    - executor: an existing concurrent.futures executor, which is
+      left running after the batch
+    - chunksize: integer, number of cells per task sent to a worker,
+      also passed to the map() of *executor*
+    Output
+    - capacity vs current dataframe with columns 'Cell', the current and
+      the capacity, one row per stair of every successful cell
+    - report dataframe with columns 'Cell', 'Seconds' and 'Error'
+      (None for cells that succeeded), one row per cell in input order
+    '''
+    cell_ids = list(cells)
+    arrays = [cells[cell][0] for cell in cell_ids]
+    currents = [cells[cell][1] for cell in cell_ids]
+    args = (cell_ids, arrays, currents, repeat(current_unit),
+            repeat(capacity_unit), repeat(method))
+    if executor is not None:
+        results = list(executor.map(_capacity_cycle_task, *args,
+                                    chunksize=chunksize))
+    elif workers is not None and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_capacity_cycle_task, *args,
+                                    chunksize=chunksize))
+    else:
+        results = list(map(_capacity_cycle_task, *args))
+    frames = [frame for _, frame, _, _ in results if frame is not None]
+    if frames:
+        capacity_df = pd.concat(frames, ignore_index=True)
+    else:
+        capacity_df = pd.DataFrame(columns=['Cell',
+                                            'Current ' + current_unit,
+                                            'Capacity' + capacity_unit])
+    report = pd.DataFrame([(cell, seconds, error)
+                           for cell, _, seconds, error in results],
+                          columns=['Cell', 'Seconds', 'Error'])
+    return capacity_df, report
+
+
+def _capacity_cycle_task(cell, capacity_cycle_array, current_list,
+                         current_unit, capacity_unit, method):
+    """
+    Run capacity_cycle() on one cell for capacity_cycle_batch(), returning
+    (cell, dataframe or None, seconds, error message or None).
+    """
+    start = time.perf_counter()
+    try:
+        frame = capacity_cycle(np.asarray(capacity_cycle_array),
+                               len(current_list), current_list,
+                               current_unit, capacity_unit,
+                               method=method, plot=False)
+    except Exception as err:  # pylint: disable=broad-except
+        return (cell, None, time.perf_counter() - start,
+                type(err).__name__ + ': ' + str(err))
+    frame.insert(0, 'Cell', cell)
+    return cell, frame, time.perf_counter() - start, None
+
+
+def detect_steps(capacity_cycle_array, num_rate=None, min_size=2,
+                 penalty=3.0):
+    '''
+    This function finds the 'stairs' of capacity-cycle data, the runs of
+    cycles at one C-rate, by binary segmentation of the capacity ordered
+    by cycle number. Each split is the one that most reduces the squared
+    deviation from the run means, found for all candidate positions at
+    once from cumulative sums; the best pending split is taken from a
+    heap. The cost is O(n log n) for the sort plus O(n) per level of
+    splits, and the result is deterministic.
+    Inputs
+    - capacity_cycle_array: nx2 capacity vs cycle # array
+    - num_rate: number of stairs, None to keep splitting while a split
+      reduces the squared deviation by more than
+      penalty * sigma**2 * log(n), sigma being a robust estimate of the
+      capacity noise from the median absolute cycle-to-cycle difference
+    - min_size: integer, minimum number of cycles per stair
+    - penalty: float, see *num_rate*
+    Output
+    - (n,) integer array, stair index of each row, numbered in cycle order
+    '''
+    order = np.argsort(capacity_cycle_array[:, 0], kind='stable')
+    capacity = np.asarray(capacity_cycle_array[order, 1], dtype=float)
+    num = len(capacity)
+    if num_rate is not None:
+        assert num_rate * min_size <= num, 'Too few cycles for num_rate'
+    csum = np.concatenate([[0.0], np.cumsum(capacity)])
+    if num_rate is None:
+        diff = np.diff(capacity)
+        sigma = 1.4826 * np.median(np.abs(diff - np.median(diff))) / np.sqrt(2)
+        sigma = max(sigma, 1e-12 * np.max(np.abs(capacity), initial=1.0))
+        threshold = penalty * sigma**2 * np.log(max(num, 2))
+    bounds = [0, num]
+    heap = []
+    _push_split(heap, csum, 0, num, min_size)
+    while heap:
+        gain, start, end, split = heapq.heappop(heap)
+        if num_rate is not None:
+            if len(bounds) - 1 >= num_rate:
+                break
+        elif -gain <= threshold:
+            break
+        bounds.append(split)
+        _push_split(heap, csum, start, split, min_size)
+        _push_split(heap, csum, split, end, min_size)
+    bounds = np.sort(bounds)
+    labels = np.empty(num, dtype=int)
+    labels[order] = np.repeat(np.arange(len(bounds) - 1), np.diff(bounds))
+    return labels
+
+
+def _push_split(heap, csum, start, end, min_size):
+    """
+    Push the best split of capacity[start:end] on the heap, keyed by
+    minus its reduction of the squared deviation from the run means.
+    """
+    num = end - start
+    if num < 2 * min_size:
+        return
+    sums = csum[start:end + 1] - csum[start]
+    size = np.arange(min_size, num - min_size + 1)
+    gain = (sums[size]**2 / size + (sums[-1] - sums[size])**2 /
+            (num - size) - sums[-1]**2 / num)
+    best = np.argmax(gain)
+    heapq.heappush(heap, (-gain[best], start, end, start + size[best]))
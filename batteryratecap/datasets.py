@@ -0,0 +1,186 @@
+"""
+This module holds capacity-rate datasets in a compact long layout. Instead
+of the wide dataframe, where every dataset takes a (C-rate, capacity) pair
+of columns padded with NaNs, the datapoints of all datasets are stored in
+two flat arrays, dataset after dataset, with an offsets array marking where
+each dataset starts (as in a CSR sparse matrix) and one paper and set
+number per dataset. Every dataset is read as a zero-copy slice.
+"""
+import re
+import numpy as np
+import pandas as pd
+
+
+class CapacityRateData:
+    '''
+    Capacity-rate datasets in flat arrays.
+    Attributes
+    - rate: 1D float array of the C-rates of all datapoints
+    - capacity: 1D float array of the capacities, same length
+    - offsets: (k + 1,) integer array, dataset i holds the datapoints
+      offsets[i] to offsets[i + 1]
+    - paper_ids, set_ids: (k,) integer arrays of paper and set numbers
+    - headers: list of k (rate header, capacity header) pairs of column
+      tuples, used to write the wide dataframe back
+    '''
+
+    def __init__(self, rate, capacity, offsets, paper_ids, set_ids,
+                 headers=None):
+        self.rate = np.asarray(rate, dtype=float)
+        self.capacity = np.asarray(capacity, dtype=float)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.paper_ids = np.asarray(paper_ids, dtype=int)
+        self.set_ids = np.asarray(set_ids, dtype=int)
+        num = len(self.offsets) - 1
+        assert len(self.rate) == len(self.capacity) == self.offsets[-1], \
+            'rate and capacity must hold offsets[-1] datapoints'
+        assert np.all(np.diff(self.offsets) >= 0) and self.offsets[0] == 0, \
+            'offsets must start at 0 and not decrease'
+        assert len(self.paper_ids) == len(self.set_ids) == num, \
+            'One paper and set number per dataset expected'
+        if headers is None:
+            headers = [(('Paper # ' + str(paper), 'set #' + str(set_num),
+                         'C-rate'),
+                        ('Paper # ' + str(paper), 'set #' + str(set_num),
+                         'Capacity'))
+                       for paper, set_num in zip(self.paper_ids,
+                                                 self.set_ids)]
+        assert len(headers) == num, 'One header pair per dataset expected'
+        self.headers = list(headers)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        '''
+        (rate, capacity) views of dataset *index*.
+        '''
+        if index < 0:
+            index += len(self)
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.rate[start:end], self.capacity[start:end]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def lengths(self):
+        '''
+        Number of datapoints of every dataset.
+        '''
+        return np.diff(self.offsets)
+
+    def labels(self):
+        '''
+        List of (paper #, set #) integer pairs, in column order, the
+        first integer of the first two header levels.
+        '''
+        return list(zip(self.paper_ids.tolist(), self.set_ids.tolist()))
+
+    def dataset_index(self):
+        '''
+        Dataset number of every datapoint.
+        '''
+        return np.repeat(np.arange(len(self)), self.lengths())
+
+    @classmethod
+    def from_frame(cls, dframe):
+        '''
+        This function converts a wide capacity-rate dataframe, even
+        columns are rates and odd columns are capacities. Datapoints
+        missing either value are dropped, non-numeric values count as
+        missing, and paper and set numbers are read from the first two
+        header levels like 'Paper # 1' and 'set #1', ValueError being
+        raised when one of them has no number.
+        '''
+        assert (len(dframe.columns) / 2) % 1 == 0, " \
+        Input dataframe does not have the correct number of columns"
+        try:
+            values = dframe.to_numpy(dtype=float)
+        except (ValueError, TypeError):
+            values = dframe.apply(pd.to_numeric, errors='coerce')
+            values = values.to_numpy(dtype=float)
+        rate = values[:, 0::2].T
+        capacity = values[:, 1::2].T
+        mask = ~np.isnan(rate) & ~np.isnan(capacity)
+        offsets = np.concatenate([[0], np.cumsum(mask.sum(axis=1))])
+        columns = list(dframe.columns)
+        headers = list(zip(columns[0::2], columns[1::2]))
+        paper_ids = [_header_number(header[1], 0) for header in headers]
+        set_ids = [_header_number(header[1], 1) for header in headers]
+        # boolean indexing is row-major, dataset after dataset
+        return cls(rate[mask], capacity[mask], offsets, paper_ids, set_ids,
+                   headers)
+
+    @classmethod
+    def from_records(cls, papers, sets, quantities, rates, capacities,
+                     rate_header='C-rate'):
+        '''
+        This function builds the datasets from flat (paper, set, quantity,
+        C-rate, capacity) records, one dataset per (paper, set, quantity)
+        in order of first appearance, as data_converter builds the wide
+        dataframe. Records without a numeric rate or capacity are dropped.
+        '''
+        rates = pd.to_numeric(pd.Series(rates, dtype=object),
+                              errors='coerce').to_numpy(dtype=float)
+        capacities = np.asarray(capacities, dtype=float)
+        keep = ~np.isnan(rates) & ~np.isnan(capacities)
+        keys = pd.MultiIndex.from_arrays([np.asarray(papers, dtype=object),
+                                          np.asarray(sets, dtype=object),
+                                          np.asarray(quantities,
+                                                     dtype=object)])
+        codes, uniques = pd.factorize(keys[keep])
+        order = np.argsort(codes, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(
+            codes, minlength=len(uniques)))])
+        headers = [((paper, set_num, rate_header), (paper, set_num, quan))
+                   for paper, set_num, quan in uniques]
+        return cls(rates[keep][order], capacities[keep][order], offsets,
+                   [_header_number(header[1], 0) for header in headers],
+                   [_header_number(header[1], 1) for header in headers],
+                   headers)
+
+    def to_frame(self):
+        '''
+        This function converts back to the wide capacity-rate dataframe
+        with NaN padding and 3-level headers.
+        '''
+        lengths = self.lengths()
+        num = len(self)
+        rows = int(lengths.max()) if num else 0
+        # row of every datapoint within its dataset
+        row = np.arange(len(self.rate)) - np.repeat(self.offsets[:-1],
+                                                    lengths)
+        column = self.dataset_index()
+        block = np.full((rows, 2 * num), np.nan)
+        block[row, 2 * column] = self.rate
+        block[row, 2 * column + 1] = self.capacity
+        columns = [header for pair in self.headers for header in pair]
+        if num and all(isinstance(header, tuple) for header in columns):
+            columns = pd.MultiIndex.from_tuples(columns)
+        return pd.DataFrame(block, columns=columns)
+
+
+def as_datasets(data):
+    '''
+    This function returns *data* as CapacityRateData, converting a
+    wide capacity-rate dataframe with CapacityRateData.from_frame().
+    '''
+    if isinstance(data, CapacityRateData):
+        return data
+    return CapacityRateData.from_frame(data)
+
+
+def _header_number(header, level):
+    '''
+    First integer in one level of a column header, like 1 in 'Paper # 1',
+    0 for single-level headers, which have no paper and set levels.
+    Raises ValueError showing the header when that level has no number.
+    '''
+    if not isinstance(header, tuple) or len(header) <= level:
+        return 0
+    numbers = re.findall(r'\d+', str(header[level]))
+    if not numbers:
+        raise ValueError('No paper or set number in level ' + str(level) +
+                         ' of the column header ' + repr(header))
+    return int(numbers[0])
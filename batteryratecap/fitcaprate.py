@@ -2,105 +2,297 @@
 This module is used to fit experimental capacitye -rate data to
 Tian et al.'s empirical model, plot the fit, and return fitting parameters.
 """
-import re
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import numpy as np
 import pandas as pd
-from scipy.optimize import curve_fit
-import matplotlib
-from matplotlib import pyplot as plt
-import openpyxl
-from openpyxl.utils.dataframe import dataframe_to_rows
+from scipy.optimize import leastsq, OptimizeWarning
+from batteryratecap import instrument
+from batteryratecap.writers import write_dataframe
+from batteryratecap.datasets import CapacityRateData, as_datasets
+from batteryratecap.fitstore import dataset_digest
+from batteryratecap.fitstore import load_results, save_results
+from batteryratecap.paging import write_pages
 
+# Columns of the optimized parameter table written by fitmodel()
+POPT_COLUMNS = ['Paper #', 'Set',
+                'tau', 'n', 'Qmax',
+                'sigma_tau', 'sigma_n', 'sigma_Qmax']
 
-def fitmodel(dframe, output_xlsx, params0):
+
+def fitmodel(dframe, output_xlsx, params0, writer=None,
+             workers=None, executor=None, report=False, store=None):
     '''
     This function fits capacity-rate dataframe and outputs
     the optimized fit parameters and covaraiances in a excel file.
     Inputs
-    - dframe: capacity-rate dataframe
-    - output_xlsx: string, output xlsx file path and name with extension
-    - params0: a list of initial points for searching [tau, n, Qmax]
+    - dframe: capacity-rate dataframe or CapacityRateData
+    - output_xlsx: string, output file path and name with extension,
+      or None to skip writing the file. The extension picks the file
+      format (.xlsx, .csv, .parquet, .feather) unless *writer* is given
+    - params0: a list of initial points for searching [tau, n, Qmax],
+      or a guess strategy per dataset: 'auto' for initial_guess(),
+      'grid' for grid_guess(), or 'warm' to start from the fit of the
+      previous set of the same paper
+    - writer: None, a writer name ('xlsx', 'csv', 'parquet', 'feather')
+      or a callable, see batteryratecap.writers.write_dataframe()
+    - workers: integer, number of worker processes used to fit the
+      datasets, default None fits them one by one in this process
+    - executor: an existing concurrent.futures executor to fit the
+      datasets with, takes precedence over *workers*, which then gives
+      its number of workers, default os.cpu_count()
+    - report: boolean, whether to also return the fit report
+    - store: string, SQLite file of fit results kept between runs, see
+      batteryratecap.fitstore. Only the datasets whose values or
+      *params0* are not in the store yet are fitted, default None
+      fits every dataset. 'warm' fits bypass the store, as each one
+      depends on the fit of the previous set
+    Output
+    - dataframe of paper and set numbers, optimized parameters
+      and their standard deviations, as written to *output_xlsx*.
+      Datasets that were not fitted report zeros
+    - with *report*, a dataframe of paper and set numbers, number of
+      model evaluations ('nfev'), wall time of every fit in seconds
+      ('Seconds') and the reason a dataset was not fitted ('Error',
+      empty when it was), and with *store* whether the results came
+      from the store ('Cached', taking 0 seconds)
     The data fitting is done using the fit() function below in this file.
     '''
+    if not isinstance(dframe, CapacityRateData):
+        assert (len(dframe.columns) / 2) % 1 == 0, " \
+        Input dataframe does not have the correct number of columns"
+    # import xdata and ydata from dataframe into flat arrays,
+    # each dataset is a view of them without null datapoints
+    with instrument.timer('fit.prepare'):
+        data = as_datasets(dframe)
+        datasets = list(data)
+    if instrument.enabled() and not isinstance(dframe, CapacityRateData):
+        # datapoints missing a rate or capacity in the wide dataframe
+        instrument.count('fit.dropped_datapoints',
+                         len(dframe) * len(data) - len(data.rate))
+    # Define paper and set numbers of dataset from original dataframe
+    colnames = np.column_stack([data.paper_ids, data.set_ids])
     # Fit procedure
-    # define list of fit parameters and of their standard deviations
-    taus = []
-    sigma_taus = []
-    exponenet_ns = []
-    sigma_ns = []
-    capacity_qs = []
-    sigma_qs = []
-    assert (len(dframe.columns) / 2) % 1 == 0, " \
-    Input dataframe does not have the correct number of columns"
-    numdataset = range(int(len(dframe.columns) / 2))
-    # fit dataset
-    for i in numdataset:
-        # import xdata and ydata from dataframe
-        xdata = dframe.iloc[:, (2 * i)].values[0:]
-        ydata = dframe.iloc[:, ((2 * i) + 1)].values[0:]
+    # one row of fit parameters and of their standard deviations
+    # per dataset, in column order
+    seconds = np.zeros(len(datasets))
+    # a warm start depends on the previous dataset, which is not part
+    # of the fingerprint of a dataset
+    warm = isinstance(params0, str) and params0 == 'warm'
+    with instrument.timer('fit.datasets', datasets=len(datasets)):
+        if store is None or warm:
+            results, nfev, errors = fit_datasets(datasets, params0,
+                                                 workers=workers,
+                                                 executor=executor,
+                                                 papers=colnames[:, 0],
+                                                 return_info=True,
+                                                 seconds=seconds)
+        else:
+            results, nfev, errors, cached = _fit_with_store(
+                datasets, params0, colnames[:, 0], store,
+                workers=workers, executor=executor, seconds=seconds)
+    # Structure the optimized parameters into a dataframe
+    popt_dframe = pd.DataFrame(results, columns=POPT_COLUMNS[2:])
+    popt_dframe.insert(0, POPT_COLUMNS[1], colnames[:, 1])
+    popt_dframe.insert(0, POPT_COLUMNS[0], colnames[:, 0])
+    if output_xlsx is not None:
+        # Export dataframe of optimized parameter to the output file
+        with instrument.timer('fit.write', output=output_xlsx):
+            write_dataframe(popt_dframe, output_xlsx, writer=writer)
+    if report:
+        report_dframe = pd.DataFrame({POPT_COLUMNS[0]: colnames[:, 0],
+                                      POPT_COLUMNS[1]: colnames[:, 1],
+                                      'nfev': nfev, 'Seconds': seconds,
+                                      'Error': errors})
+        if store is not None:
+            report_dframe['Cached'] = False if warm else cached
+        return popt_dframe, report_dframe
+    return popt_dframe
+
+
+def _fit_with_store(datasets, params0, papers, store, seconds=None,
+                    **kwargs):
+    '''
+    Fit the datasets missing from the results store with
+    fit_datasets(), save their results, and return the results of
+    every dataset with the mask of those found in the store.
+    '''
+    digests = [dataset_digest(xdata, ydata, params0)
+               for xdata, ydata in datasets]
+    found = load_results(store, digests)
+    cached = np.array([digest in found for digest in digests], dtype=bool)
+    instrument.count('fit.cached', int(cached.sum()))
+    results = np.zeros((len(datasets), 6))
+    nfev = np.zeros(len(datasets), dtype=int)
+    errors = [''] * len(datasets)
+    for index in np.flatnonzero(cached):
+        results[index], nfev[index], errors[index] = found[digests[index]]
+    misses = np.flatnonzero(~cached)
+    instrument.count('fit.store_misses', len(misses))
+    if len(misses) > 0:
+        miss_seconds = np.zeros(len(misses))
+        fitted = fit_datasets([datasets[i] for i in misses], params0,
+                              papers=np.asarray(papers)[misses],
+                              return_info=True, seconds=miss_seconds,
+                              **kwargs)
+        if seconds is not None:
+            seconds[misses] = miss_seconds
+        results[misses] = fitted[0]
+        nfev[misses] = fitted[1]
+        for index, error in zip(misses, fitted[2]):
+            errors[index] = error
+        save_results(store, [digests[i] for i in misses], *fitted)
+    return results, nfev, errors, cached
+
+
+def fit_datasets(datasets, params0, workers=None,
+                 executor=None, chunksize=None, papers=None,
+                 return_info=False, seconds=None):
+    '''
+    This function fits a list of datasets with fit() and returns their
+    optimized parameters and standard deviations in the input order.
+    With *workers* or *executor*, the datasets are split into chunks
+    that are fitted in parallel worker processes. A dataset that
+    cannot be fitted keeps zeros and its error is recorded instead of
+    stopping the other fits.
+    Inputs
+    - datasets: list of (xdata, ydata) numpy array pairs, may hold NaNs
+    - params0: a list of initial points for searching [tau, n, Qmax],
+      or 'auto', 'grid' or 'warm', see fitmodel()
+    - workers: integer, number of worker processes of a
+      ProcessPoolExecutor, default None fits in this process
+    - executor: an existing concurrent.futures executor, which is
+      left running after the fit. *workers* then gives its number of
+      workers to split the datasets for, default os.cpu_count()
+    - chunksize: integer, number of datasets per task, default
+      spreads the datasets over four tasks per worker
+    - papers: paper number of every dataset, needed by 'warm', whose
+      chunks only end where the paper changes
+    - return_info: boolean, whether to also return the numbers of
+      model evaluations and the errors
+    - seconds: (k,) float array filled with the wall time of every
+      dataset fit, default None does not keep them
+    Output
+    - (k, 6) array, one row of tau, n, Qmax, sigma_tau, sigma_n and
+      sigma_Qmax per dataset
+    - with *return_info*, a (k,) integer array of model evaluations
+      and a list of k error messages, empty strings for fitted datasets
+    '''
+    warm = isinstance(params0, str) and params0 == 'warm'
+    if isinstance(params0, str):
+        assert params0 in ('auto', 'grid', 'warm'), \
+            'Unknown initial guess ' + params0
+    if papers is None:
+        papers = np.zeros(len(datasets), dtype=int)
+    results = np.zeros((len(datasets), 6))
+    nfev = np.zeros(len(datasets), dtype=int)
+    errors = [''] * len(datasets)
+    if seconds is None:
+        seconds = np.zeros(len(datasets))
+    if executor is None and (workers is None or workers <= 1):
+        _fit_chunk(params0, datasets, papers,
+                   out=(results, nfev, errors, seconds))
+    else:
+        if chunksize is None:
+            num_tasks = 4 * (workers or os.cpu_count() or 1)
+            chunksize = max(1, -(-len(datasets) // num_tasks))
+        starts = list(range(0, len(datasets), chunksize))
+        if warm:
+            # move every chunk start to the next change of paper
+            changes = np.flatnonzero(np.diff(papers)) + 1
+            starts = sorted({0} | {int(changes[changes >= start][0])
+                                   for start in starts[1:]
+                                   if (changes >= start).any()})
+        ends = starts[1:] + [len(datasets)]
+        chunks = [datasets[i:j] for i, j in zip(starts, ends)]
+        chunk_papers = [papers[i:j] for i, j in zip(starts, ends)]
+        if executor is None:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                chunk_results = list(pool.map(_fit_chunk, repeat(params0),
+                                              chunks, chunk_papers))
+        else:
+            chunk_results = list(executor.map(_fit_chunk, repeat(params0),
+                                              chunks, chunk_papers))
+        # executor.map() yields the chunks in submission order
+        for start, end, chunk in zip(starts, ends, chunk_results):
+            results[start:end] = chunk[0]
+            nfev[start:end] = chunk[1]
+            errors[start:end] = chunk[2]
+            seconds[start:end] = chunk[3]
+    if instrument.enabled():
+        _emit_fits(datasets, papers, nfev, errors, seconds)
+    if return_info:
+        return results, nfev, errors
+    return results
+
+
+def _emit_fits(datasets, papers, nfev, errors, seconds):
+    '''
+    Report every dataset fit to the instrumentation sessions, from the
+    process that called fit_datasets().
+    '''
+    for index, (xdata, ydata) in enumerate(datasets):
+        nulls = int(pd.isnull(xdata).sum() + pd.isnull(ydata).sum())
+        converged = errors[index] == ''
+        instrument.emit('fit.dataset', index=index,
+                        paper=int(papers[index]), datapoints=len(xdata),
+                        nulls=nulls, nfev=int(nfev[index]),
+                        seconds=float(seconds[index]), converged=converged,
+                        status='converged' if converged else errors[index])
+        instrument.count('fit.converged' if converged else 'fit.failed')
+        instrument.count('fit.nfev', int(nfev[index]))
+        instrument.count('fit.nulls', nulls)
+
+
+def _fit_chunk(params0, datasets, papers, out=None):
+    '''
+    Fit a chunk of (xdata, ydata) pairs one by one, this is the task
+    run by each worker process of fit_datasets(). Returns the
+    (len(datasets), 6) array of results, the numbers of model
+    evaluations, the error messages and the wall time of every fit,
+    or fills *out*.
+    '''
+    if out is None:
+        out = (np.zeros((len(datasets), 6)),
+               np.zeros(len(datasets), dtype=int), [''] * len(datasets),
+               np.zeros(len(datasets)))
+    results, nfev, errors, seconds = out
+    warm = isinstance(params0, str) and params0 == 'warm'
+    previous = None
+    for index, (xdata, ydata) in enumerate(datasets):
         # discard null datapoints
         # and define input and output of fit function
-        rate = xdata[~pd.isnull(xdata)]
-        normq = ydata[~pd.isnull(ydata)]
+        rate = xdata[~pd.isnull(xdata)].astype(float)
+        normq = ydata[~pd.isnull(ydata)].astype(float)
+        # start from the fit of the previous set of the same paper
+        if index == 0 or papers[index] != papers[index - 1]:
+            previous = None
         # fit dataset with more than four datapoints
         # otherwise, discard
-        if len(rate) >= 4:
-            popt, pcov = fit(params0, xdata=rate, ydata=normq)
-            tau, exponent_n, capacity = popt
-            # standard deviation
-            sigma_tau, sigma_n, sigma_q = np.sqrt(np.diag(pcov))
-        else:
-            tau = 0
-            exponent_n = 0
-            capacity = 0
-            sigma_tau, sigma_n, sigma_q = [0, 0, 0]
-        # append optimized fit parameters to list
-        taus.append(tau)
-        exponenet_ns.append(exponent_n)
-        capacity_qs.append(capacity)
-        # append standard deviation of
-        # error margin on fit parameters to list
-        sigma_taus.append(sigma_tau)
-        sigma_ns.append(sigma_n)
-        sigma_qs.append(sigma_q)
-
-    # Structure the optimized parameters into a dataframe
-    # Define all column names of dataset from original dataframe
-    colnames = list(dframe.columns)[1::2]
-    # Turn the tuples if column names into lists
-    for index, element in enumerate(colnames):
-        colnames[index] = list(element[:-1])
-        for subindex, string in enumerate(colnames[index]):
-            # conserve numbers only
-            colnames[index][subindex] = int(re.findall(r'\d+', string)[0])
-        colnames[index] = tuple(colnames[index])
-    # insert optimized parameters into dataframe
-    popt_dframe = pd.DataFrame(columns=['Paper #', 'Set',
-                                        'tau', 'n', 'Qmax',
-                                        'sigma_tau', 'sigma_n', 'sigma_Qmax'])
-    # Input paper, set numbers, optimized parameters and
-    # their error margins into dataframe
-    for index, element in enumerate(colnames):
-        row = [int(element[0]),
-               int(element[1]),
-               taus[index],
-               exponenet_ns[index],
-               capacity_qs[index],
-               sigma_taus[index],
-               sigma_ns[index],
-               sigma_qs[index]
-               ]
-        row_series = pd.Series(row, index=popt_dframe.columns)
-        popt_dframe = popt_dframe.append(row_series, ignore_index=True)
-#     # Write dataframe of optimized parameters to csv file
-#     outputpath = os.path.join(output_dir, "fitparameters.csv")
-#     popt_dframe.to_csv(path_or_buf=outputpath, index=False)
-    # Export dataframe of optimized parameter to excel file
-    workbook = openpyxl.Workbook()
-    worksheet = workbook.active
-    for row in dataframe_to_rows(popt_dframe, index=False, header=True):
-        worksheet.append(row)
-    workbook.save(output_xlsx)
+        if len(rate) < 4:
+            errors[index] = 'less than four datapoints'
+            continue
+        guess = params0
+        if warm:
+            guess = 'auto' if previous is None else previous
+        start = time.perf_counter()
+        try:
+            popt, pcov, info = fit(guess, xdata=rate, ydata=normq,
+                                   full_output=True)
+        except (RuntimeError, ValueError, np.linalg.LinAlgError) as err:
+            errors[index] = str(err)
+            continue
+        finally:
+            seconds[index] = time.perf_counter() - start
+        nfev[index] = info['nfev']
+        results[index, :3] = popt
+        # standard deviation
+        results[index, 3:] = np.sqrt(np.diag(pcov))
+        previous = popt
+    return out
 
 
 def fit(params0, **kwargs):
@@ -108,11 +300,16 @@ def fit(params0, **kwargs):
     This function fits capacity-rate data to an empirical model and outputs
     the optimized fit parameters (chracteristic time,
     the exponent *n*, and the maximum capacity) and their covariances.
+    Input Argument
+    params0: initial point [tau, n, Qmax], or 'auto' for
+        initial_guess() and 'grid' for grid_guess()
     Keyword Arguments
     xdata: 1D numpy array, default as 'rate'
     ydata: 1D numpy array, default as normq
     filename: string, filepath
         (excel format) first column is xdata, second, ydata
+    full_output: boolean, also return the leastsq infodict, whose
+        'nfev' is the number of model evaluations
     Output Argument
     Return the optimized parameters tau, n, Qmax
     '''
@@ -125,39 +322,234 @@ def fit(params0, **kwargs):
         dframe = pd.read_excel(filepath, header=[0, 1, 2])
         rate = dframe.iloc[:, 0].values
         normq = dframe.iloc[:, 1].values
+    if isinstance(params0, str):
+        assert params0 in ('auto', 'grid'), 'Unknown initial guess ' + params0
+        guess = initial_guess if params0 == 'auto' else grid_guess
+        params0 = guess(rate, normq)
     # Fit procedure
-    popt, pcov = curve_fit(fitfunc, rate, normq, p0=params0)
+    popt, pcov, info = _leastsq_fit(rate, normq, params0)
+    if kwargs.get('full_output', False):
+        return popt, pcov, info
     return popt, pcov
 
 
+def initial_guess(rate, normq):
+    '''
+    This function estimates [tau, n, Qmax] of a dataset from the data
+    alone. Qmax is the low-rate plateau, the largest capacity. Every
+    other capacity is turned into w = (rate * tau)**(-n) by inverting
+    the model, and log(w) is linear in log(rate) with slope -n and
+    intercept -n * log(tau). Falls back on grid_guess() when less than
+    two capacities are below the plateau or the slope is not negative.
+    Inputs
+    - rate, normq: 1D numpy arrays of one dataset without nulls
+    Output
+    - numpy array [tau, n, Qmax]
+    '''
+    rate = np.asarray(rate, dtype=float)
+    normq = np.asarray(normq, dtype=float)
+    capacity_q = np.max(normq)
+    ratio = normq / capacity_q
+    # the model is too flat near the plateau to invert
+    usable = (ratio > 0.02) & (ratio < 0.98) & (rate > 0)
+    if np.sum(usable) < 2 or np.ptp(rate[usable]) == 0:
+        return grid_guess(rate, normq)
+    log_weight = _invert_model(ratio[usable])
+    slope, intercept = np.polyfit(np.log(rate[usable]), log_weight, 1)
+    if not slope < 0:
+        return grid_guess(rate, normq)
+    exponent_n = -slope
+    return np.array([np.exp(-intercept / exponent_n), exponent_n,
+                     capacity_q])
+
+
+def grid_guess(rate, normq, taus=None, exponents=None):
+    '''
+    This function picks [tau, n, Qmax] from a coarse grid of tau and n,
+    evaluated at once. The model is linear in Qmax, so for every grid
+    point the best Qmax and the sum of squares are closed-form.
+    Inputs
+    - rate, normq: 1D numpy arrays of one dataset without nulls
+    - taus: 1D array of tau values, default 60 log-spaced values from
+      0.01 / max(rate) to 100 / min(rate)
+    - exponents: 1D array of n values, default 0.2 to 6
+    Output
+    - numpy array [tau, n, Qmax]
+    '''
+    rate = np.asarray(rate, dtype=float)
+    normq = np.asarray(normq, dtype=float)
+    positive = rate[rate > 0]
+    if taus is None:
+        taus = np.logspace(np.log10(0.01 / np.max(positive)),
+                           np.log10(100 / np.min(positive)), 60)
+    if exponents is None:
+        exponents = np.linspace(0.2, 6, 30)
+    # model with Qmax = 1 on a (tau, n, point) grid
+    model = fitkernel(rate, np.asarray(taus)[:, None, None],
+                      np.asarray(exponents)[None, :, None], 1.0, jac=False)
+    cross = model @ normq
+    square = np.einsum('tnm,tnm->tn', model, model)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cost = np.where(square > 0, -cross**2 / square, np.inf)
+    i, j = np.unravel_index(np.argmin(cost), cost.shape)
+    return np.array([taus[i], exponents[j], cross[i, j] / square[i, j]])
+
+
+def _invert_model(ratio):
+    '''
+    log(w) of the model ratios Q / Qmax in [0.02, 0.98] by
+    interpolating a table of g(w), fitkernel() at rate 1 / w and
+    tau = n = Qmax = 1, which increases with w.
+    '''
+    log_weight = np.linspace(-8, 8, 801)
+    table = fitkernel(np.exp(-log_weight), 1.0, 1.0, 1.0, jac=False)
+    return np.interp(ratio, table, log_weight)
+
+
 def fitfunc(rate, tau, exponent_n, capacity_q):
     '''
     This is the empirical model developed by Tian et al.(2019):
     https://www.nature.com/articles/s41467-019-09792-9
+    It is evaluated by fitkernel().
+    '''
+    return fitkernel(rate, tau, exponent_n, capacity_q, jac=False)
+
+
+def fitjac(rate, tau, exponent_n, capacity_q):
+    '''
+    This is the analytic Jacobian of fitfunc() with respect to
+    (tau, n, Qmax), evaluated by fitkernel().
+    Inputs broadcast like fitfunc(), e.g. rate (k, m) against
+    parameters of shape (k, 1) for k datasets at once.
+    Output
+    - array of shape rate.shape + (3,), the last axis holding
+      d/dtau, d/dn and d/dQmax
+    '''
+    return fitkernel(rate, tau, exponent_n, capacity_q)[1]
+
+
+def _leastsq_fit(rate, normq, params0, jac=fitjac):
+    '''
+    Least squares fit of fitfunc() by MINPACK, as curve_fit() without
+    sigma and bounds does it, but calling leastsq(full_output=True)
+    directly so that the number of model evaluations is available on
+    every SciPy version. *jac* is the Jacobian in the calling convention
+    of fitjac(), None for finite differences.
+    Output
+    - popt, pcov, infodict of leastsq(); pcov is scaled by the residual
+      variance like curve_fit(absolute_sigma=False), inf when it cannot
+      be estimated
+    '''
+    rate = np.asarray_chkfinite(rate, dtype=float)
+    normq = np.asarray_chkfinite(normq, dtype=float)
+
+    def residuals(params):
+        return fitfunc(rate, *params) - normq
+
+    def jacobian(params):
+        return jac(rate, *params)
+    popt, pcov, info, errmsg, ier = leastsq(
+        residuals, np.asarray(params0, dtype=float),
+        Dfun=None if jac is None else jacobian, full_output=True)
+    if ier not in (1, 2, 3, 4):
+        raise RuntimeError('Optimal parameters not found: ' + errmsg)
+    # residual variance, as in curve_fit()
+    dof = len(normq) - len(popt)
+    if pcov is None or np.isnan(pcov).any() or dof <= 0:
+        pcov = np.full((len(popt), len(popt)), np.inf)
+        warnings.warn('Covariance of the parameters could not be estimated',
+                      category=OptimizeWarning)
+    else:
+        pcov = pcov * np.sum(info['fvec'] ** 2) / dof
+    return popt, pcov, info
+
+
+def fitkernel(rate, tau, exponent_n, capacity_q, jac=True,
+              out=None, jac_out=None):
+    '''
+    This function evaluates fitfunc() and, optionally, its Jacobian in
+    one pass. With w = (rate * tau)**(-n), computed in log space, the
+    model reads Qmax * g(w) with g(w) = 1 + expm1(-w) / w, and the
+    derivatives share u * dg/du = k(w) = (expm1(-w) + w * exp(-w)) / w.
+    Series expansions replace g and k where w is small (high C-rates),
+    where the direct forms cancel, and no power of the rate is taken
+    outside log space, so low C-rates do not overflow.
+    Inputs
+    - rate, tau, exponent_n, capacity_q: arrays or scalars that
+      broadcast together
+    - jac: boolean, whether to return the Jacobian too
+    - out: optional array of the broadcast shape for the model
+    - jac_out: optional array of the broadcast shape + (3,)
+      for the Jacobian
+    Output
+    - the model values, and with *jac* the Jacobian with the last
+      axis holding d/dtau, d/dn and d/dQmax
     '''
-    normq = capacity_q * (1 -
-                          (rate * tau)**exponent_n *
-                          (1 - np.exp(- (rate * tau)**(- exponent_n)))
-                          )
-    return normq
+    with np.errstate(all='ignore'):
+        log_rate_tau = np.log(rate * tau)
+        log_weight = -exponent_n * log_rate_tau
+        weight = np.exp(log_weight)
+        expm1 = np.expm1(-weight)
+        # g(w), the model divided by Qmax, which tends to 1 - 1/w
+        # without overflow at large w since expm1(-w) is then -1
+        model = np.asarray(expm1 / weight)
+        model += 1
+        small = weight < 1e-3
+        if small.any():
+            model[small] = _series(weight[small], _MODEL_SERIES)
+        out = np.multiply(capacity_q, model, out=out)
+        if not jac:
+            return out
+        # k(w) = u * dg/du, with w * exp(-w) as exp(log(w) - w)
+        slope = np.asarray(expm1 + np.exp(log_weight - weight))
+        slope /= weight
+        if small.any():
+            slope[small] = _series(weight[small], _SLOPE_SERIES)
+        slope = np.multiply(capacity_q, slope)
+        shape = np.broadcast(rate, tau, exponent_n, capacity_q).shape
+        if jac_out is None:
+            jac_out = np.empty(shape + (3,))
+        np.multiply(slope, exponent_n / tau, out=jac_out[..., 0])
+        np.multiply(slope, log_rate_tau, out=jac_out[..., 1])
+        jac_out[..., 2] = model
+    return out, jac_out
+
+
+# Taylor coefficients of g(w) and k(w) in powers of w, from w**1
+_MODEL_SERIES = (1 / 2, -1 / 6, 1 / 24, -1 / 120)
+_SLOPE_SERIES = (-1 / 2, 1 / 3, -1 / 8, 1 / 30)
+
+
+def _series(weight, coefficients):
+    '''
+    Evaluate sum(c_i * w**(i + 1)) by Horner's rule.
+    '''
+    result = np.zeros_like(weight)
+    for coefficient in coefficients[::-1]:
+        result = (result + coefficient) * weight
+    return result
 
 
 def plotfit(dframe, dframe_out):
     '''
     This function fits and plots capacity-rate data and their fitting
-    results as a panel figure.
+    results as a panel figure. *dframe* is a capacity-rate dataframe
+    or CapacityRateData.
     '''
+    # pyplot is imported on first use so that fitting never loads it
+    import matplotlib
+    from matplotlib import pyplot as plt
     # plot for predicted capacity (with optimized parameters)
     # compared to known (measured) capacity outputs
     matplotlib.rcParams.update({'font.size': 18})
     plt.figure(figsize=(20, 20))
-    for i in range(int(len(dframe.columns)/2)):
+    data = as_datasets(dframe)
+    for i, (xdata, ydata) in enumerate(data):
         # test data
-        # even columns for xdata; odd columns for ydata
-        # then sort values by the even(th) columns
-        data = dframe.iloc[:, [2*i, 2*i+1]].sort_values(by=dframe.columns[2*i])
-        xdata = data[dframe.columns[2*i]].to_numpy()
-        ydata = data[dframe.columns[2*i+1]].to_numpy()
+        # sort values by rate
+        order = np.argsort(xdata, kind='stable')
+        xdata = xdata[order]
+        ydata = ydata[order]
         # Prediction
         # optimized parameters
         tau = dframe_out.loc[i, "tau"]
@@ -194,7 +586,121 @@ def plotfit(dframe, dframe_out):
             plt.text(0.1, 0.1,
                      'not enough datapoints', transform=axis.transAxes)
         plt.legend(markerscale=0.5, fontsize='xx-small', loc='upper right')
-        capacity_unit = dframe.columns[2*i+1][2]
+        capacity_unit = data.headers[i][1][-1]
         axis.set_xlabel('C-rate (1/hour)')
         axis.set_ylabel(capacity_unit)
         plt.tight_layout()
+
+
+def plotfit_pages(dframe, dframe_out, output_file, rows=5, columns=4,
+                  workers=None, executor=None, dpi=100):
+    '''
+    This function plots capacity-rate data and their fitting results
+    like plotfit(), on as many pages of rows x columns panels as needed.
+    The pages are drawn with matplotlib's object-oriented API on Agg
+    canvases, without pyplot state, and can be rendered in parallel
+    worker processes. Datapoints are sorted and the model curves of all
+    datasets are evaluated in one vectorized call beforehand.
+    Inputs
+    - dframe: capacity-rate dataframe or CapacityRateData
+    - dframe_out: dataframe of fit parameters returned by fitmodel()
+    - output_file: string, '.png' writes one numbered file per page
+      (e.g. fits-0001.png), '.pdf' writes a multi-page PDF file. The
+      pages drawn by workers are written into the PDF file as images
+      at *dpi*, see paging.write_pages()
+    - rows, columns: integers, panels per page
+    - workers: integer, number of worker processes of a
+      ProcessPoolExecutor, default None renders in this process
+    - executor: an existing concurrent.futures executor, *workers*
+      then gives its number of workers, default os.cpu_count()
+    - dpi: integer, resolution of the PNG pages
+    Output
+    - list of the files written
+    '''
+    ext = os.path.splitext(output_file)[1]
+    assert ext.lower() in ('.png', '.pdf'), 'Output file must be png or pdf'
+    data = as_datasets(dframe)
+    num = len(data)
+    assert len(dframe_out) == num, 'One row of fit parameters per dataset'
+    params = dframe_out[POPT_COLUMNS[2:5]].to_numpy(dtype=float)
+    sigmas = dframe_out[POPT_COLUMNS[5:8]].to_numpy(dtype=float)
+    # sort the datapoints by rate within every dataset at once
+    order = np.lexsort((data.rate, data.dataset_index()))
+    rate = data.rate[order]
+    capacity = data.capacity[order]
+    # model curves of all datasets in one call,
+    # only for datasets with more than four data points
+    lengths = data.lengths()
+    low = np.full(num, np.nan)
+    high = np.full(num, np.nan)
+    filled = lengths > 0
+    if filled.any():
+        starts = data.offsets[:-1][filled]
+        low[filled] = np.minimum.reduceat(rate, starts)
+        high[filled] = np.maximum.reduceat(rate, starts)
+    grid = low[:, None] + (high - low)[:, None] * np.linspace(0, 1, 100)
+    with np.errstate(all='ignore'):
+        curves = fitfunc(grid, params[:, 0:1], params[:, 1:2],
+                         params[:, 2:3])
+    curves[(params == 0).all(axis=1)] = np.nan
+    # one task per page, holding only the arrays of its datasets
+    per_page = rows * columns
+    pages = []
+    for start in range(0, num, per_page):
+        end = min(start + per_page, num)
+        first, last = data.offsets[start], data.offsets[end]
+        pages.append({'offsets': data.offsets[start:end + 1] - first,
+                      'rate': rate[first:last],
+                      'capacity': capacity[first:last],
+                      'grid': grid[start:end], 'curves': curves[start:end],
+                      'params': params[start:end],
+                      'sigmas': sigmas[start:end],
+                      'labels': data.labels()[start:end],
+                      'units': [pair[1][-1] for pair
+                                in data.headers[start:end]],
+                      'first': start})
+    return write_pages(_page_figure, pages, output_file, (rows, columns),
+                       workers, executor, dpi)
+
+
+def _page_figure(page, rows, columns):
+    '''
+    One page of panels on an Agg canvas, with a fixed layout
+    instead of tight_layout() and a single legend.
+    '''
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    figure = Figure(figsize=(4 * columns, 3.2 * rows))
+    FigureCanvasAgg(figure)
+    figure.subplots_adjust(left=0.06, right=0.98, bottom=0.06, top=0.95,
+                           wspace=0.3, hspace=0.55)
+    offsets = page['offsets']
+    for i, (paper_num, set_num) in enumerate(page['labels']):
+        axis = figure.add_subplot(rows, columns, i + 1)
+        sigma_tau, sigma_n, sigma_q = page['sigmas'][i]
+        axis.set_title('#' + str(page['first'] + i) + ' paper ' +
+                       str(paper_num) + ' set ' + str(set_num) +
+                       '\nSE =' + f'{sigma_tau:.2f}' + ',' +
+                       f'{sigma_n:.2f}' + ',' + f'{sigma_q:.2f}',
+                       fontsize=8)
+        axis.plot(page['rate'][offsets[i]:offsets[i + 1]],
+                  page['capacity'][offsets[i]:offsets[i + 1]],
+                  color='b', marker='o', markersize=3, linestyle='None',
+                  label='data')
+        tau, exponent_n, capacity_q = page['params'][i]
+        if np.isfinite(page['curves'][i]).any():
+            axis.plot(page['grid'][i], page['curves'][i], color='r',
+                      linewidth=1.5, linestyle='--', label='lsqcurvefit')
+            labels = 'tau = ' + f'{tau:.2f}' + '\nn = ' + \
+                f'{exponent_n:.2f}' + '\nQmax = ' + f'{capacity_q:.2f}'
+        else:
+            labels = 'not enough datapoints'
+        axis.text(0.05, 0.05, labels, transform=axis.transAxes, fontsize=7)
+        axis.locator_params(nbins=4)
+        axis.tick_params(labelsize=7)
+        axis.set_xlabel('C-rate (1/hour)', fontsize=7)
+        axis.set_ylabel(str(page['units'][i]), fontsize=7)
+    # one legend per page instead of one per panel
+    figure.legend(*figure.axes[0].get_legend_handles_labels(),
+                  loc='upper right', fontsize='small')
+    return figure
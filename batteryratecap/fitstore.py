@@ -0,0 +1,103 @@
+"""
+This module is used to keep fit results between runs of fitmodel(). Every
+(rate, normq) column pair is fingerprinted by a SHA-256 hash of its
+non-null values and of the initial guess, and its fit parameters,
+standard deviations, number of model evaluations and error are stored
+in a SQLite file under that fingerprint, so that only new or changed
+datasets are fitted again. Warm-started fits are not stored: they depend
+on the fit of the previous set, which the fingerprint does not cover.
+"""
+import time
+import hashlib
+import sqlite3
+from contextlib import closing
+import numpy as np
+
+# Part of every fingerprint, changes whenever the fit procedure changes
+FIT_TAG = b'fitcaprate.fit v1'
+_COLUMNS = ['tau', 'n', 'qmax', 'sigma_tau', 'sigma_n', 'sigma_qmax']
+# SQLite limits the number of parameters of one statement
+_BATCH = 500
+
+
+def dataset_digest(xdata, ydata, params0):
+    '''
+    This function returns the fingerprint of one dataset.
+    Inputs
+    - xdata, ydata: 1D arrays of rate and capacity, may hold NaNs
+    - params0: the initial point or guess strategy of the fit
+    Output
+    - string, SHA-256 hex digest
+    '''
+    xdata = np.asarray(xdata, dtype=float)
+    ydata = np.asarray(ydata, dtype=float)
+    sha = hashlib.sha256(FIT_TAG)
+    sha.update(repr(params0 if isinstance(params0, str) else
+                    [float(value) for value in params0]).encode())
+    # null datapoints are discarded by the fit, so not hashed
+    for values in (xdata[~np.isnan(xdata)], ydata[~np.isnan(ydata)]):
+        sha.update(str(len(values)).encode())
+        sha.update(np.ascontiguousarray(values).tobytes())
+    return sha.hexdigest()
+
+
+def load_results(store, digests):
+    '''
+    This function looks up stored fit results.
+    Inputs
+    - store: string, SQLite file path
+    - digests: list of fingerprints from dataset_digest()
+    Output
+    - dictionary of the fingerprints found to tuples of
+      ((6,) array of parameters and standard deviations, nfev, error)
+    '''
+    found = {}
+    with closing(_connect(store)) as connection, connection:
+        for start in range(0, len(digests), _BATCH):
+            batch = list(digests[start:start + _BATCH])
+            rows = connection.execute(
+                'SELECT digest, ' + ', '.join(_COLUMNS) + ', nfev, error '
+                'FROM results WHERE digest IN (' +
+                ', '.join('?' * len(batch)) + ')', batch).fetchall()
+            for row in rows:
+                found[row[0]] = (np.array(row[1:7], dtype=float),
+                                 row[7], row[8])
+            connection.executemany(
+                'UPDATE results SET last_used = ? WHERE digest = ?',
+                [(time.time(), row[0]) for row in rows])
+    return found
+
+
+def save_results(store, digests, results, nfev, errors):
+    '''
+    This function stores fit results, replacing those with the
+    same fingerprints.
+    Inputs
+    - store: string, SQLite file path
+    - digests: list of k fingerprints from dataset_digest()
+    - results: (k, 6) array of parameters and standard deviations
+    - nfev: k numbers of model evaluations
+    - errors: k error messages, empty strings for fitted datasets
+    '''
+    now = time.time()
+    rows = [(digest, *map(float, result), int(count), error, now)
+            for digest, result, count, error
+            in zip(digests, results, nfev, errors)]
+    with closing(_connect(store)) as connection, connection:
+        connection.executemany(
+            'INSERT OR REPLACE INTO results VALUES (' +
+            ', '.join('?' * (len(_COLUMNS) + 4)) + ')', rows)
+
+
+def _connect(store):
+    '''
+    Open the SQLite file, creating the results table when needed.
+    The connection commits when used as a context manager, closing()
+    closes it.
+    '''
+    connection = sqlite3.connect(store)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS results (digest TEXT PRIMARY KEY, ' +
+        ', '.join(name + ' REAL' for name in _COLUMNS) +
+        ', nfev INTEGER, error TEXT, last_used REAL)')
+    return connection
@@ -0,0 +1,171 @@
+"""
+This module is used to see where the time goes in fitcaprate and
+data_converter without changing their code. The converters and the fit
+report stage timers (reading Excel, taking the column maxima, fitting,
+writing the output), one event per fitted dataset with its fit time,
+number of model evaluations and convergence status, and counters.
+Nothing is recorded unless a session is open:
+    with instrument('profile.jsonl'):
+        fitmodel(dframe, None, [0.5, 1, 200])
+Events are dictionaries with an 'event' name and a 'time' stamp, sent to
+a sink: a callable, a logging.Logger or 'logging' for the
+'batteryratecap' logger, a JSON lines file path, or by default a list
+kept on the session. With no session open every hook returns at once.
+Events are recorded in the process that opened the session; datasets
+fitted by worker processes are reported when their results come back.
+"""
+import json
+import time
+import logging
+from contextlib import contextmanager, nullcontext
+
+# Open sessions, the hooks do nothing while this is empty
+_SESSIONS = []
+# Shared no-op timer of disabled hooks
+_NULL_TIMER = nullcontext()
+
+
+class Session:
+    '''
+    One instrumentation session, see instrument().
+    Attributes
+    - events: list of the events, kept when no sink is given
+    - counters: dictionary of counter name to total
+    '''
+
+    def __init__(self, sink):
+        self.events = []
+        self.counters = {}
+        self.sink = self.events.append if sink is None else sink
+
+    def emit(self, record):
+        '''
+        Send one event to the sink.
+        '''
+        self.sink(record)
+
+
+class _Timer:
+    '''
+    Context manager emitting the wall time of its block.
+    '''
+
+    def __init__(self, event, fields):
+        self.event = event
+        self.fields = fields
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fields = dict(self.fields,
+                      seconds=time.perf_counter() - self.start)
+        if exc_type is not None:
+            fields['error'] = exc_type.__name__ + ': ' + str(exc_value)
+        emit(self.event, **fields)
+        return False
+
+
+@contextmanager
+def instrument(sink=None, level=logging.INFO):
+    '''
+    This function opens an instrumentation session for the block of a
+    with statement. Sessions can be nested, every open session receives
+    every event.
+    Inputs
+    - sink: None keeps the events on the session, a callable receives
+      every event dictionary, 'logging' or a logging.Logger logs every
+      event as JSON, a string path appends JSON lines to that file
+    - level: logging level of the logging sink
+    Output
+    - the Session, whose counters are also sent as a final
+      'counters' event when the block ends
+    '''
+    file = None
+    if isinstance(sink, str) and sink != 'logging':
+        file = open(sink, 'a', encoding='utf-8')
+        sink = _json_lines_sink(file)
+    elif sink == 'logging' or isinstance(sink, logging.Logger):
+        logger = logging.getLogger('batteryratecap') if sink == 'logging' \
+            else sink
+        sink = _logging_sink(logger, level)
+    assert sink is None or callable(sink), 'Unknown instrumentation sink'
+    session = Session(sink)
+    _SESSIONS.append(session)
+    try:
+        yield session
+    finally:
+        _SESSIONS.remove(session)
+        session.emit({'event': 'counters', 'time': time.time(),
+                      'counters': dict(session.counters)})
+        if file is not None:
+            file.close()
+
+
+def enabled():
+    '''
+    This function returns whether any session is open, to skip work
+    that only feeds the hooks.
+    '''
+    return bool(_SESSIONS)
+
+
+def emit(event, **fields):
+    '''
+    This function sends an event with *fields* to every open session.
+    '''
+    if not _SESSIONS:
+        return
+    record = {'event': event, 'time': time.time()}
+    record.update(fields)
+    for session in _SESSIONS:
+        session.emit(record)
+
+
+def timer(event, **fields):
+    '''
+    This function returns a context manager that emits *event* with
+    the wall time of its block in 'seconds', and the exception raised
+    in it as 'error'. Without an open session it is a shared no-op.
+    '''
+    if not _SESSIONS:
+        return _NULL_TIMER
+    return _Timer(event, fields)
+
+
+def count(name, value=1):
+    '''
+    This function adds *value* to the counter *name* of every open
+    session.
+    '''
+    for session in _SESSIONS:
+        session.counters[name] = session.counters.get(name, 0) + value
+
+
+def _json_lines_sink(file):
+    '''
+    Sink writing every event as one line of JSON.
+    '''
+    def write(record):
+        file.write(json.dumps(record, default=_json_default) + '\n')
+    return write
+
+
+def _logging_sink(logger, level):
+    '''
+    Sink logging every event as JSON.
+    '''
+    def log(record):
+        logger.log(level, json.dumps(record, default=_json_default))
+    return log
+
+
+def _json_default(value):
+    '''
+    JSON form of numpy scalars and other values json cannot write.
+    '''
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
@@ -0,0 +1,118 @@
+"""
+This module is used to write the pages of figures drawn by
+fitcaprate.plotfit_pages() and visualization.feature_pages(), as
+numbered PNG files or as one multi-page PDF file, rendering the pages
+in this process or in worker processes. matplotlib is only imported
+when a page is drawn.
+"""
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+
+
+def write_pages(draw, pages, output_file, args=(), workers=None,
+                executor=None, dpi=100):
+    '''
+    This function draws every page with draw(page, *args), which returns
+    a matplotlib Figure, and writes the pages to *output_file*.
+    Inputs
+    - draw: module-level function drawing one page, so that it can be
+      sent to worker processes
+    - pages: iterable of the data of every page, in order
+    - output_file: string, '.png' writes one numbered file per page
+      (e.g. fits-0001.png), '.pdf' writes a multi-page PDF file. Pages
+      drawn by workers come back as PNG images at *dpi*, and are all
+      written into the one PDF file by this process
+    - args: tuple of further arguments of *draw*
+    - workers: integer, number of worker processes of a
+      ProcessPoolExecutor, default None renders in this process
+    - executor: an existing concurrent.futures executor, *workers*
+      then gives its number of workers, default os.cpu_count()
+    - dpi: integer, resolution of the PNG pages and images
+    Output
+    - list of the files written
+    '''
+    stem, ext = os.path.splitext(output_file)
+    is_pdf = ext.lower() == '.pdf'
+    if executor is None and (workers is None or workers <= 1):
+        # vector pages, drawn and released one at a time
+        if is_pdf:
+            from matplotlib.backends.backend_pdf import PdfPages
+            with PdfPages(output_file) as document:
+                for page in pages:
+                    document.savefig(draw(page, *args), dpi=dpi)
+            return [output_file]
+        paths = []
+        for index, page in enumerate(pages):
+            paths.append(_page_path(stem, ext, index))
+            draw(page, *args).savefig(paths[-1], dpi=dpi)
+        return paths
+    # contiguous blocks of pages, one task per worker
+    pages = list(pages)
+    num_blocks = max(1, min(len(pages), workers or os.cpu_count() or 1))
+    bounds = np.linspace(0, len(pages), num_blocks + 1).astype(int)
+    blocks = [pages[i:j] for i, j in zip(bounds[:-1], bounds[1:])]
+    if is_pdf:
+        block_paths = [None] * num_blocks
+    else:
+        block_paths = [[_page_path(stem, ext, index)
+                        for index in range(i, j)]
+                       for i, j in zip(bounds[:-1], bounds[1:])]
+    tasks = (repeat(draw), blocks, block_paths, repeat(args), repeat(dpi))
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return _collect(pool.map(_render_block, *tasks), output_file,
+                            is_pdf, dpi)
+    return _collect(executor.map(_render_block, *tasks), output_file,
+                    is_pdf, dpi)
+
+
+def _page_path(stem, ext, index):
+    '''
+    Numbered file of page *index*, counted from 1.
+    '''
+    return stem + '-' + f'{index + 1:04d}' + ext
+
+
+def _render_block(draw, pages, paths, args, dpi):
+    '''
+    Draw a block of pages, this is the task run by each worker. Writes
+    one PNG file per page to *paths*, or returns the PNG image of every
+    page when *paths* is None.
+    '''
+    if paths is not None:
+        for page, path in zip(pages, paths):
+            draw(page, *args).savefig(path, dpi=dpi)
+        return paths
+    images = []
+    for page in pages:
+        buffer = io.BytesIO()
+        draw(page, *args).savefig(buffer, format='png', dpi=dpi)
+        images.append(buffer.getvalue())
+    return images
+
+
+def _collect(results, output_file, is_pdf, dpi):
+    '''
+    Gather the results of the blocks in order, writing the PNG images
+    of the pages into the PDF file as they arrive.
+    '''
+    if not is_pdf:
+        return [path for paths in results for path in paths]
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.backends.backend_pdf import PdfPages
+    from matplotlib.figure import Figure
+    from matplotlib.image import imread
+    with PdfPages(output_file) as document:
+        for images in results:
+            for image in images:
+                pixels = imread(io.BytesIO(image), format='png')
+                # one image filling a page of the size of the drawing
+                figure = Figure(figsize=(pixels.shape[1] / dpi,
+                                         pixels.shape[0] / dpi), dpi=dpi)
+                FigureCanvasAgg(figure)
+                figure.figimage(pixels)
+                document.savefig(figure, dpi=dpi)
+    return [output_file]
@@ -0,0 +1,278 @@
+"""
+This module runs the whole analysis in one call: a charge/discharge
+workbook is converted to capacity-rate data, the capacity-rate datasets
+are fitted, and the fit parameters are tested for correlation with
+design features. The dataframes are passed from stage to stage in
+memory, and the output of every stage is checkpointed as a parquet file
+named by a SHA-256 hash of its inputs and parameters, chained from the
+previous stage, so that a rerun loads the stages whose inputs did not
+change and resumes from the first stage whose inputs did.
+The status and time of every stage are logged to the
+'batteryratecap.pipeline' logger and sent to batteryratecap.instrument
+as 'pipeline.stage' events. It can also be run from the command line,
+which logs the stages to stderr:
+    batteryratecap-pipeline input.xls --features parameters.xls
+"""
+import os
+import time
+import hashlib
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from batteryratecap import instrument
+from batteryratecap.cache import file_digest, write_frame, read_frame
+from batteryratecap.data_converter import potential_rate_all
+from batteryratecap.fitcaprate import fitmodel, POPT_COLUMNS
+from batteryratecap.fitstore import FIT_TAG
+from batteryratecap.correlationtest import correlation_matrix
+from batteryratecap.writers import write_dataframe, EXTENSIONS
+
+# Stages in order of execution
+STAGES = ['capacity_rate', 'fits', 'correlations']
+# Default checkpoint location
+PIPELINE_DIR = os.environ.get('BATTERYRATECAP_PIPELINE_CACHE',
+                              os.path.join(os.path.expanduser('~'), '.cache',
+                                           'batteryratecap', 'pipeline'))
+# Part of every stage key, changes whenever a stage changes
+_PIPELINE_TAG = b'batteryratecap.pipeline v1'
+# Columns joining the fit parameters to the design features
+_JOIN_COLUMNS = POPT_COLUMNS[:2]
+_LOGGER = logging.getLogger(__name__)
+
+
+def run_pipeline(input_file, features_file=None, sheet_name=None,
+                 feature_sheet=None, params0=(0.5, 1, 200), workers=None,
+                 methods=('pearson', 'spearman'), correction=None,
+                 output_dir=None, file_format='xlsx', cache_dir=None):
+    '''
+    This function converts, fits and tests a workbook of battery data,
+    loading every stage whose inputs are unchanged from its checkpoint.
+    Inputs
+    - input_file: string, excel workbook of charge/discharge sheets
+      converted by data_converter.potential_rate_all(), or, with
+      *sheet_name*, a workbook holding a capacity-rate sheet
+    - features_file: string, excel workbook of design features with
+      'Paper #' and 'Set' columns, e.g. doc/data/input_parameterlog.xls,
+      default None stops after the fits
+    - sheet_name: string, capacity-rate sheet of *input_file* read
+      instead of converting the workbook
+    - feature_sheet: string or list of sheets of *features_file*,
+      default None joins all sheets on 'Paper #' and 'Set'
+    - params0: initial point [tau, n, Qmax] or guess strategy of
+      fitcaprate.fitmodel()
+    - workers: integer, number of worker processes fitting the datasets
+    - methods, correction: correlation tests and multiple-testing
+      correction of correlationtest.correlation_matrix()
+    - output_dir: string, directory the output of every stage is
+      written to as <stage>.<file_format>, default None writes nothing
+    - file_format: string, writer name of batteryratecap.writers,
+      e.g. 'xlsx', 'csv', 'parquet' or 'feather'
+    - cache_dir: string, checkpoint directory, default PIPELINE_DIR,
+      False runs every stage without checkpoints
+    Output
+    - dictionary of stage name ('capacity_rate', 'fits' and, with
+      *features_file*, 'correlations') to dataframe
+    '''
+    if not isinstance(params0, str):
+        params0 = [float(value) for value in params0]
+    if cache_dir is None:
+        cache_dir = PIPELINE_DIR
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    keys = stage_keys(input_file, features_file, sheet_name, feature_sheet,
+                      params0, methods, correction)
+    results = {}
+    for stage, key in keys.items():
+        start = time.perf_counter()
+        path = _checkpoint(cache_dir, stage, key) if cache_dir else None
+        if path is not None:
+            results[stage] = read_frame(path)
+            status = 'loaded from checkpoint'
+        else:
+            results[stage] = _run_stage(stage, results, input_file,
+                                        features_file, sheet_name,
+                                        feature_sheet, params0, workers,
+                                        methods, correction)
+            if cache_dir:
+                _save_checkpoint(cache_dir, stage, key, results[stage])
+            status = 'computed'
+        seconds = time.perf_counter() - start
+        _LOGGER.info('%s %s in %.2f s', stage, status, seconds)
+        instrument.emit('pipeline.stage', stage=stage, status=status,
+                        seconds=seconds)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        # first extension registered for every writer, e.g. .xlsx
+        extension = {}
+        for ext, name in EXTENSIONS.items():
+            extension.setdefault(name, ext)
+        for stage, dframe in results.items():
+            write_dataframe(dframe, os.path.join(output_dir, stage +
+                                                 extension[file_format]),
+                            writer=file_format,
+                            index=stage == 'capacity_rate')
+    return results
+
+
+def stage_keys(input_file, features_file=None, sheet_name=None,
+               feature_sheet=None, params0=(0.5, 1, 200),
+               methods=('pearson', 'spearman'), correction=None):
+    '''
+    This function returns the checkpoint key of every stage to run.
+    Each key hashes the parameters of its stage and the key of the
+    previous stage, so that a change invalidates the later stages too.
+    Input files are hashed by content.
+    Output
+    - dictionary of stage name to SHA-256 hex digest
+    '''
+    if not isinstance(params0, str):
+        params0 = [float(value) for value in params0]
+    stage_inputs = {'capacity_rate': [file_digest(input_file), sheet_name],
+                    'fits': [FIT_TAG, params0]}
+    if features_file is not None:
+        stage_inputs['correlations'] = [file_digest(features_file),
+                                        feature_sheet, list(methods),
+                                        correction]
+    keys = {}
+    previous = b''
+    for stage, inputs in stage_inputs.items():
+        sha = hashlib.sha256(_PIPELINE_TAG + previous)
+        sha.update(repr([stage] + inputs).encode())
+        keys[stage] = sha.hexdigest()
+        previous = keys[stage].encode()
+    return keys
+
+
+def feature_correlations(fit_params, features, methods=('pearson',
+                                                        'spearman'),
+                         correction=None):
+    '''
+    This function joins fit parameters to design features by paper and
+    set number and tests every numeric feature against tau, n and Qmax.
+    Datasets that were not fitted (all parameters zero) and text values
+    such as 'N/R' count as missing, and features without any number
+    are left out.
+    Inputs
+    - fit_params: dataframe returned by fitcaprate.fitmodel()
+    - features: dataframe with 'Paper #' and 'Set' columns and one
+      column per design feature
+    - methods, correction: see correlationtest.correlation_matrix()
+    Output
+    - dataframe returned by correlationtest.correlation_matrix()
+    '''
+    for column in _JOIN_COLUMNS:
+        assert column in features, 'Features are missing the ' + \
+            column + ' column'
+    parameters = POPT_COLUMNS[2:5]
+    fit_params = fit_params.copy()
+    failed = (fit_params[parameters] == 0).all(axis=1)
+    fit_params.loc[failed, parameters] = np.nan
+    merged = fit_params.merge(features, on=_JOIN_COLUMNS, how='inner')
+    columns = [column for column in features.columns
+               if column not in _JOIN_COLUMNS]
+    values = merged[columns].apply(pd.to_numeric, errors='coerce')
+    values = values.dropna(axis=1, how='all')
+    return correlation_matrix(values, merged[parameters], methods=methods,
+                              correction=correction)
+
+
+def read_features(features_file, feature_sheet=None):
+    '''
+    This function reads design features from an excel workbook.
+    Inputs
+    - features_file: string, excel workbook with 'Paper #' and 'Set'
+      columns on every sheet
+    - feature_sheet: string or list of sheets, default None reads all
+    Output
+    - dataframe of the sheets joined on paper and set number
+    '''
+    sheets = pd.read_excel(features_file, sheet_name=feature_sheet)
+    if isinstance(sheets, pd.DataFrame):
+        sheets = {feature_sheet: sheets}
+    features = None
+    for dframe in sheets.values():
+        features = dframe if features is None else \
+            features.merge(dframe, on=_JOIN_COLUMNS, how='outer')
+    return features
+
+
+def _run_stage(stage, results, input_file, features_file, sheet_name,
+               feature_sheet, params0, workers, methods, correction):
+    '''
+    Compute the output of one stage from the outputs before it.
+    '''
+    if stage == 'capacity_rate':
+        if sheet_name is None:
+            return potential_rate_all(input_file, None)
+        return pd.read_excel(input_file, sheet_name=sheet_name,
+                             header=[0, 1, 2])
+    if stage == 'fits':
+        return fitmodel(results['capacity_rate'], None, params0,
+                        workers=workers)
+    return feature_correlations(results['fits'],
+                                read_features(features_file, feature_sheet),
+                                methods=methods, correction=correction)
+
+
+def _checkpoint(cache_dir, stage, key):
+    '''
+    Path of the checkpoint of a stage, None when there is none.
+    '''
+    for extension in ('.parquet', '.pkl'):
+        path = os.path.join(cache_dir, stage + '-' + key + extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _save_checkpoint(cache_dir, stage, key, dframe):
+    '''
+    Write the checkpoint of a stage, write_frame() moves it into place
+    so that an interrupted run never leaves a partial checkpoint.
+    '''
+    write_frame(dframe, os.path.join(cache_dir, stage + '-' + key))
+
+
+def main(argv=None):
+    '''
+    Command line entry point of run_pipeline().
+    '''
+    parser = argparse.ArgumentParser(
+        description='Convert, fit and correlate battery rate data, '
+        'resuming from the first stage whose inputs changed.')
+    parser.add_argument('input_file',
+                        help='charge/discharge or capacity-rate workbook')
+    parser.add_argument('--features', dest='features_file',
+                        help='workbook of design features')
+    parser.add_argument('--sheet', dest='sheet_name',
+                        help='capacity-rate sheet of the input workbook')
+    parser.add_argument('--feature-sheet', nargs='+',
+                        help='feature sheets, default all')
+    parser.add_argument('--params0', nargs='+', default=['0.5', '1', '200'],
+                        help="tau n Qmax, or 'auto', 'grid' or 'warm'")
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--correction',
+                        choices=['bonferroni', 'holm', 'fdr_bh'])
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--format', dest='file_format', default='xlsx',
+                        choices=sorted(set(EXTENSIONS.values())))
+    parser.add_argument('--cache-dir')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='run every stage without checkpoints')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    params0 = args.params0[0] if len(args.params0) == 1 else \
+        [float(value) for value in args.params0]
+    feature_sheet = args.feature_sheet
+    if feature_sheet is not None and len(feature_sheet) == 1:
+        feature_sheet = feature_sheet[0]
+    run_pipeline(args.input_file, args.features_file, args.sheet_name,
+                 feature_sheet, params0, workers=args.workers,
+                 correction=args.correction, output_dir=args.output_dir,
+                 file_format=args.file_format,
+                 cache_dir=False if args.no_cache else args.cache_dir)
+
+
+if __name__ == '__main__':
+    main()
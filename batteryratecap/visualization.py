@@ -3,11 +3,20 @@ This module is used to create panel plots that visualize the relationship
 between fitting parameters n, tau, and Q, and any battery design features
 (geometric or material).
 """
-import matplotlib
-from matplotlib import pyplot as plt
+import os
+import numpy as np
+from batteryratecap.paging import write_pages
 
+# fitting parameter, color and log scale of the three panel columns
+PANEL_COLUMNS = [('n', 'blue', False), ('tau', 'red', True),
+                 ('Qmax', 'green', False)]
+# row counts above which mode='auto' rasterizes the scatter points,
+# and bins them in hexagons instead of drawing them
+RASTERIZE_ROWS = 2000
+HEXBIN_ROWS = 50000
 
-def feature_vs_n_tau_q(visualization_df, features):
+
+def feature_vs_n_tau_q(visualization_df, features, mode='scatter'):
     '''
     This function takes in a pandas dataframe, which contains the columns "n",
     "tau", and "Q" as extracted from the curve fit components as well as any
@@ -18,62 +27,141 @@ def feature_vs_n_tau_q(visualization_df, features):
      - visualization_df: a dataframe that contains column names specified by
                          *features*
      - features: columns in *visualization_df* to be plotted
+     - mode: 'scatter' (default), 'rasterized', 'hexbin' or 'auto', see
+             feature_pages()
     Output:
      - A panel plot with three columns (n, tau, and Q) and x rows, where x
        is the number of features.
     '''
-    # Test that the input dataframe has the requried columns named correctly
+    import matplotlib
+    from matplotlib import pyplot as plt
+    _check_columns(visualization_df)
+    mode = _panel_mode(mode, len(visualization_df))
+    matplotlib.rcParams.update({'font.size': 40})
+    fig = plt.figure(figsize=(36, 10*len(features)))
+    # squeeze=False keeps a 2D array of axes for one feature as well
+    axis = fig.subplots(nrows=len(features), ncols=3, squeeze=False)
+    params = {name: visualization_df[name].values
+              for name, _, _ in PANEL_COLUMNS}
+    for i, feature in enumerate(features):
+        _feature_row(axis[i], feature, visualization_df[feature].values,
+                     params, mode, size=500)
+    plt.tight_layout()
+    return fig
+
+
+def feature_pages(visualization_df, features, output_file, per_page=4,
+                  mode='auto', workers=None, executor=None, dpi=100,
+                  gridsize=40):
+    '''
+    This function plots the same panels as feature_vs_n_tau_q(), one row
+    of three panels per feature, on pages of *per_page* features. Every
+    page is drawn on its own Agg canvas without pyplot state and released
+    once written, so that memory does not grow with the number of
+    features, and pages can be rendered in parallel worker processes.
+    Inputs
+    - visualization_df: a dataframe with the columns "n", "tau", "Qmax"
+      and the *features*
+    - features: columns in *visualization_df* to be plotted
+    - output_file: string, '.png' writes one numbered file per page
+      (e.g. features-0001.png), '.pdf' writes a multi-page PDF file. The
+      pages drawn by workers are written into the PDF file as images
+      at *dpi*, see paging.write_pages()
+    - per_page: integer, features per page
+    - mode: 'scatter' draws every point as a vector marker, 'rasterized'
+      draws the points as one bitmap per panel, 'hexbin' draws counts of
+      points in hexagonal bins, default 'auto' picks by the number of
+      rows (RASTERIZE_ROWS and HEXBIN_ROWS)
+    - workers: integer, number of worker processes of a
+      ProcessPoolExecutor, default None renders in this process
+    - executor: an existing concurrent.futures executor, *workers*
+      then gives its number of workers, default os.cpu_count()
+    - dpi: integer, resolution of the PNG pages and rasterized points
+    - gridsize: integer, number of hexagons across a panel in hexbin mode
+    Output
+    - list of the files written
+    '''
+    ext = os.path.splitext(output_file)[1]
+    assert ext.lower() in ('.png', '.pdf'), 'Output file must be png or pdf'
+    _check_columns(visualization_df)
+    assert per_page >= 1, 'At least one feature per page expected'
+    features = list(features)
+    mode = _panel_mode(mode, len(visualization_df))
+    params = {name: visualization_df[name].values
+              for name, _, _ in PANEL_COLUMNS}
+    # pages copy their feature columns one at a time when rendered in
+    # this process, and only their own columns when sent to workers
+    pages = (visualization_df[features[start:start + per_page]]
+             for start in range(0, len(features), per_page))
+    return write_pages(_feature_figure, pages, output_file,
+                       (params, mode, gridsize), workers, executor, dpi)
+
+
+def _check_columns(visualization_df):
+    '''
+    Test that the input dataframe has the requried columns named correctly.
+    '''
     assert 'n' in visualization_df, 'The dataframe is missing the "n" column'
     assert 'tau' in visualization_df, 'The dataframe is missing \
     the "tau" column'
     assert 'Qmax' in visualization_df, 'The dataframe is missing \
     the "Qmax" column'
-    matplotlib.rcParams.update({'font.size': 40})
-    fig = plt.figure(figsize=(36, 10*len(features)))
-    axis = fig.subplots(nrows=len(features), ncols=3)
-    # For analysis with more than 1 features
-    if len(features) > 1:
-        for i, feature in enumerate(features):
-            # LEFT COLUMN (feature vs. 'n')
-            axis[i, 0].scatter(visualization_df[feature].values,
-                               visualization_df['n'].values,
-                               color='blue', s=500)
-            axis[i, 0].set_xlabel(feature)
-            axis[i, 0].set_ylabel('n')
-            # MIDDLE COLUMN (feature vs. 'tau')
-            axis[i, 1].scatter(visualization_df[feature],
-                               visualization_df['tau'],
-                               color='red', s=500)
-            axis[i, 1].set_xlabel(feature)
-            axis[i, 1].set_ylabel('tau')
-            axis[i, 1].semilogy()
-            # RIGHT COLUMN (feature vs. 'Qmax')
-            axis[i, 2].scatter(visualization_df[feature],
-                               visualization_df['Qmax'],
-                               color='green', s=500)
-            axis[i, 2].set_xlabel(feature)
-            axis[i, 2].set_ylabel('Qmax')
-    # For analysis with only 1 feature
-    elif len(features) == 1:
-        for i, feature in enumerate(features):
-            # LEFT COLUMN (feature vs. 'n')
-            axis[0].scatter(visualization_df[feature].values,
-                            visualization_df['n'].values,
-                            color='blue', s=500)
-            axis[0].set_xlabel(feature)
-            axis[0].set_ylabel('n')
-            # MIDDLE COLUMN (feature vs. 'tau')
-            axis[1].scatter(visualization_df[feature],
-                            visualization_df['tau'],
-                            color='red', s=500)
-            axis[1].set_xlabel(feature)
-            axis[1].set_ylabel('tau')
-            axis[1].semilogy()
-            # RIGHT COLUMN (feature vs. 'Qmax')
-            axis[2].scatter(visualization_df[feature],
-                            visualization_df['Qmax'],
-                            color='green', s=500)
-            axis[2].set_xlabel(feature)
-            axis[2].set_ylabel('Qmax')
-    plt.tight_layout()
-    return fig
+
+
+def _panel_mode(mode, num_rows):
+    '''
+    Drawing mode of the panels, resolving 'auto' by the number of rows.
+    '''
+    assert mode in ('scatter', 'rasterized', 'hexbin', 'auto'), \
+        'Unknown mode ' + str(mode)
+    if mode != 'auto':
+        return mode
+    if num_rows > HEXBIN_ROWS:
+        return 'hexbin'
+    if num_rows > RASTERIZE_ROWS:
+        return 'rasterized'
+    return 'scatter'
+
+
+def _feature_row(axes, feature, values, params, mode, size, gridsize=40):
+    '''
+    Draw one feature against n, tau and Qmax on three axes.
+    '''
+    for axis, (name, color, log) in zip(axes, PANEL_COLUMNS):
+        if mode == 'hexbin':
+            x_values = np.asarray(values, dtype=float)
+            y_values = np.asarray(params[name], dtype=float)
+            keep = np.isfinite(x_values) & np.isfinite(y_values)
+            if log:
+                keep &= y_values > 0
+            axis.hexbin(x_values[keep], y_values[keep], gridsize=gridsize,
+                        yscale='log' if log else 'linear', mincnt=1,
+                        cmap=color.capitalize() + 's')
+        else:
+            axis.scatter(values, params[name], color=color, s=size,
+                         rasterized=mode == 'rasterized')
+            if log:
+                axis.semilogy()
+        axis.set_xlabel(feature)
+        axis.set_ylabel(name)
+
+
+def _feature_figure(page, params, mode, gridsize):
+    '''
+    One page of feature rows on an Agg canvas, with a fixed layout
+    instead of tight_layout().
+    '''
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    num = len(page.columns)
+    figure = Figure(figsize=(12, 3 * num))
+    FigureCanvasAgg(figure)
+    figure.subplots_adjust(left=0.08, right=0.98, bottom=0.25 / num,
+                           top=1 - 0.1 / num, wspace=0.3, hspace=0.45)
+    axes = figure.subplots(nrows=num, ncols=3, squeeze=False)
+    for i, feature in enumerate(page.columns):
+        _feature_row(axes[i], feature, page[feature].values, params, mode,
+                     size=12, gridsize=gridsize)
+        for axis in axes[i]:
+            axis.locator_params(axis='x', nbins=5)
+    return figure
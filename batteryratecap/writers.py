@@ -0,0 +1,116 @@
+"""
+This module is used to export the dataframes produced by fitcaprate and
+data_converter. The output format is chosen from the file extension or
+by naming a writer explicitly: xlsx (openpyxl, streamed in write-only
+mode by default), csv, and parquet or feather through pyarrow.
+"""
+import os
+
+
+def write_xlsx(dframe, output_file, index=False, write_only=True):
+    '''
+    This function writes a dataframe to an excel file with openpyxl.
+    Inputs
+    - dframe: dataframe to export
+    - output_file: string, output file path and name with extension
+    - index: boolean, whether to write the row index
+    - write_only: boolean, default True streams the rows to a write-only
+      workbook instead of building every cell in memory first
+    '''
+    import openpyxl
+    from openpyxl.utils.dataframe import dataframe_to_rows
+    workbook = openpyxl.Workbook(write_only=write_only)
+    if write_only:
+        worksheet = workbook.create_sheet()
+    else:
+        worksheet = workbook.active
+    for row in dataframe_to_rows(dframe, index=index, header=True):
+        worksheet.append(row)
+    workbook.save(output_file)
+
+
+def write_csv(dframe, output_file, index=False):
+    '''
+    This function writes a dataframe to a plain csv file. Multi-level
+    headers take one line per level.
+    '''
+    dframe.to_csv(output_file, index=index)
+
+
+def write_parquet(dframe, output_file, index=False):
+    '''
+    This function writes a dataframe to a parquet file with pyarrow,
+    multi-level headers are kept.
+    '''
+    _require_pyarrow('parquet')
+    dframe.to_parquet(output_file, engine='pyarrow', index=index)
+
+
+def write_feather(dframe, output_file, index=False):
+    '''
+    This function writes a dataframe to a feather (Arrow IPC) file with
+    pyarrow. Feather stores no row index, so with *index* True it is
+    written as the first column.
+    '''
+    _require_pyarrow('feather')
+    dframe.reset_index(drop=not index).to_feather(output_file)
+
+
+def _require_pyarrow(file_type):
+    '''
+    Raise an informative ImportError when pyarrow is not installed.
+    '''
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as err:
+        raise ImportError('pyarrow is required to write ' + file_type +
+                          ' files, install it with pip or conda') from err
+
+
+# Writer functions by name, and writer names by file extension
+WRITERS = {'xlsx': write_xlsx,
+           'csv': write_csv,
+           'parquet': write_parquet,
+           'feather': write_feather}
+EXTENSIONS = {'.xlsx': 'xlsx',
+              '.xlsm': 'xlsx',
+              '.csv': 'csv',
+              '.parquet': 'parquet',
+              '.pq': 'parquet',
+              '.feather': 'feather',
+              '.arrow': 'feather'}
+
+
+def register_writer(name, function, extensions=()):
+    '''
+    This function adds an output backend.
+    Inputs
+    - name: string, writer name accepted by write_dataframe()
+    - function: callable(dframe, output_file, index=False)
+    - extensions: file extensions, e.g. ['.h5'], mapped to this writer
+    '''
+    assert callable(function), 'writer must be callable'
+    WRITERS[name] = function
+    for extension in extensions:
+        EXTENSIONS[extension.lower()] = name
+
+
+def write_dataframe(dframe, output_file, writer=None, index=False):
+    '''
+    This function exports a dataframe with the writer named by *writer*
+    or, by default, the one registered for the file extension.
+    Inputs
+    - dframe: dataframe to export
+    - output_file: string, output file path and name with extension
+    - writer: None, a writer name from WRITERS ('xlsx', 'csv',
+      'parquet', 'feather') or a callable(dframe, output_file, index)
+    - index: boolean, whether to write the row index
+    '''
+    if writer is None:
+        _, ext = os.path.splitext(output_file)
+        assert ext.lower() in EXTENSIONS, 'Unknown output file type ' + ext
+        writer = EXTENSIONS[ext.lower()]
+    if not callable(writer):
+        assert writer in WRITERS, 'Unknown writer ' + str(writer)
+        writer = WRITERS[writer]
+    writer(dframe, output_file, index=index)
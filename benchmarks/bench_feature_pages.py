@@ -0,0 +1,73 @@
+"""
+This benchmark compares the wall time and peak memory of the single
+feature_vs_n_tau_q() figure with feature_pages() as the number of design
+features grows. Every measurement runs in a fresh worker process, so that
+its peak resident memory is its own.
+Run from the repository root:
+    python -m benchmarks.bench_feature_pages --features 10 50 200
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from benchmarks.datagen import feature_frame
+
+
+def measure(renderer, num_rows, num_features, mode, workers):
+    '''
+    Render the features to a PDF file in this process and return the
+    wall time and the peak resident memory in MB.
+    '''
+    warnings.simplefilter('ignore')
+    import matplotlib
+    matplotlib.use('Agg')
+    from batteryratecap.visualization import feature_vs_n_tau_q
+    from batteryratecap.visualization import feature_pages
+    dframe = feature_frame(num_rows, num_features)
+    features = list(dframe.columns[3:])
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'features.pdf')
+        start = time.perf_counter()
+        if renderer == 'figure':
+            feature_vs_n_tau_q(dframe, features, mode=mode).savefig(path)
+        else:
+            feature_pages(dframe, features, path, mode=mode,
+                          workers=workers)
+        seconds = time.perf_counter() - start
+    # ru_maxrss is in kB on Linux
+    return seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    '''
+    Print wall time and peak memory per renderer and feature count.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=500)
+    parser.add_argument('--features', type=int, nargs='+',
+                        default=[10, 50, 200])
+    parser.add_argument('--modes', nargs='+', default=['scatter', 'hexbin'])
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--max-figure', type=int, default=50,
+                        help='largest feature count for the single figure')
+    args = parser.parse_args()
+    print(f'{"renderer":>8} {"mode":>10} {"features":>8} {"seconds":>8} '
+          f'{"peak MB":>8}')
+    for mode in args.modes:
+        for num_features in args.features:
+            for renderer in ('figure', 'pages'):
+                if renderer == 'figure' and num_features > args.max_figure:
+                    continue
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    seconds, peak = pool.submit(
+                        measure, renderer, args.rows, num_features, mode,
+                        args.workers).result()
+                print(f'{renderer:>8} {mode:>10} {num_features:>8} '
+                      f'{seconds:8.2f} {peak:8.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+This microbenchmark compares the direct form of Tian et al.'s model and
+its Jacobian with fitkernel(), which evaluates both in one pass in log
+space and can reuse output buffers. It also times the fit() solver on
+synthetic datasets with finite-difference and analytic Jacobians.
+Run from the repository root:
+    python -m benchmarks.bench_fitfunc --sizes 1000 100000 1000000
+"""
+import argparse
+import time
+import warnings
+import numpy as np
+from batteryratecap.fitcaprate import fitkernel, fitjac
+from batteryratecap.fitcaprate import _leastsq_fit
+from benchmarks.datagen import capacity_rate_frame
+
+
+def direct_model(rate, tau, exponent_n, capacity_q):
+    '''
+    Former fitfunc(): (rate * tau)**n evaluated twice.
+    '''
+    return capacity_q * (1 - (rate * tau)**exponent_n *
+                         (1 - np.exp(- (rate * tau)**(- exponent_n))))
+
+
+def direct_jac(rate, tau, exponent_n, capacity_q):
+    '''
+    Former fitjac(), without the model.
+    '''
+    rate_tau = rate * tau
+    power = rate_tau**exponent_n
+    decay = np.exp(-1 / power)
+    dmodel = decay + decay / power - 1
+    return np.stack([capacity_q * dmodel * exponent_n * power / tau,
+                     capacity_q * dmodel * power * np.log(rate_tau),
+                     1 - power + power * decay], axis=-1)
+
+
+def best_time(function, repeats=5):
+    '''
+    Best wall time in seconds of *repeats* calls.
+    '''
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def fit_datasets(datasets, jac):
+    '''
+    Fit every dataset with the leastsq() solver of fit(), return the
+    wall time and the mean numbers of model and Jacobian evaluations.
+    Without *jac*, the model evaluations include the finite differences.
+    '''
+    nfev = []
+    njev = []
+    start = time.perf_counter()
+    for rate, normq in datasets:
+        try:
+            _, _, info = _leastsq_fit(rate, normq, [0.5, 1, 200], jac=jac)
+            nfev.append(info['nfev'])
+            njev.append(info.get('njev', 0))
+        except RuntimeError:
+            pass
+    return time.perf_counter() - start, np.mean(nfev), np.mean(njev)
+
+
+def main():
+    '''
+    Print the kernel timings per array size, then the leastsq timings.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 100000, 1000000])
+    parser.add_argument('--datasets', type=int, default=300)
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+    params = (0.5, 1.3, 150.0)
+    print(f"{'points':>9} {'direct f':>10} {'kernel f':>10} "
+          f"{'direct f+J':>11} {'kernel f+J':>11} {'buffers':>10}")
+    for size in args.sizes:
+        rate = np.logspace(-2, 2, size)
+        model = np.empty(size)
+        jac = np.empty((size, 3))
+        times = [
+            best_time(lambda: direct_model(rate, *params)),
+            best_time(lambda: fitkernel(rate, *params, jac=False)),
+            best_time(lambda: (direct_model(rate, *params),
+                               direct_jac(rate, *params))),
+            best_time(lambda: fitkernel(rate, *params)),
+            best_time(lambda: fitkernel(rate, *params, out=model,
+                                        jac_out=jac))]
+        print(f'{size:9d} ' + ' '.join(f'{1e3 * t:9.2f}ms' for t in times))
+    # accuracy far from the usual C-rates
+    rate = np.logspace(-6, 6, 7)
+    print('direct model at 1e-6..1e6 C:', direct_model(rate, *params))
+    print('kernel model at 1e-6..1e6 C:', fitkernel(rate, *params, jac=False))
+    values = capacity_rate_frame(args.datasets).to_numpy(dtype=float)
+    datasets = []
+    for i in range(values.shape[1] // 2):
+        keep = ~np.isnan(values[:, 2 * i]) & ~np.isnan(values[:, 2 * i + 1])
+        datasets.append((values[keep, 2 * i], values[keep, 2 * i + 1]))
+    for name, jac in [('finite differences', None),
+                      ('analytic jac', fitjac)]:
+        seconds, nfev, njev = fit_datasets(datasets, jac)
+        print(f'leastsq {name:>20}: {seconds:6.3f} s for '
+              f'{len(datasets)} datasets, mean evaluations of the model '
+              f'{nfev:5.1f} and of the Jacobian {njev:4.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+This benchmark shows how fitmodel() scales with the number of datasets.
+It times the whole fit and, separately, the assembly of the parameter
+table, comparing the former row-by-row appends with the columnar
+assembly from preallocated arrays.
+Run from the repository root:
+    python -m benchmarks.bench_fitmodel --sizes 100 1000 10000 100000
+"""
+import argparse
+import time
+import warnings
+import numpy as np
+import pandas as pd
+from batteryratecap.fitcaprate import fitmodel, POPT_COLUMNS
+from benchmarks.datagen import capacity_rate_frame
+
+
+def assemble_rowwise(results, labels):
+    '''
+    Former assembly of fitmodel(): grow the dataframe one row at a
+    time. DataFrame.append() is gone from pandas 2, concat is the
+    same quadratic pattern.
+    '''
+    popt_dframe = pd.DataFrame(columns=POPT_COLUMNS)
+    for label, result in zip(labels, results):
+        row = pd.DataFrame([list(label) + list(result)],
+                           columns=POPT_COLUMNS)
+        popt_dframe = pd.concat([popt_dframe, row], ignore_index=True)
+    return popt_dframe
+
+
+def assemble_columnar(results, labels):
+    '''
+    Current assembly of fitmodel(): one dataframe from
+    preallocated arrays.
+    '''
+    popt_dframe = pd.DataFrame(results, columns=POPT_COLUMNS[2:])
+    popt_dframe.insert(0, POPT_COLUMNS[1], labels[:, 1])
+    popt_dframe.insert(0, POPT_COLUMNS[0], labels[:, 0])
+    return popt_dframe
+
+
+def timed(function, *args, **kwargs):
+    '''
+    Wall time in seconds of one call.
+    '''
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    '''
+    Print one line of timings per number of datasets.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100, 1000, 10000, 100000])
+    parser.add_argument('--rowwise-limit', type=int, default=10000,
+                        help='largest size timed with row-by-row appends')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+    print(f"{'datasets':>9} {'fitmodel s':>11} {'us/dataset':>11} "
+          f"{'rowwise s':>10} {'columnar s':>11}")
+    for size in args.sizes:
+        dframe = capacity_rate_frame(size)
+        fit_time = timed(fitmodel, dframe, None, [0.5, 1, 200],
+                         workers=args.workers)
+        results = np.random.default_rng(0).random((size, 6))
+        labels = np.column_stack([np.arange(size) // 3 + 1,
+                                  np.arange(size) % 3 + 1])
+        if size <= args.rowwise_limit:
+            rowwise = f'{timed(assemble_rowwise, results, labels):10.3f}'
+        else:
+            rowwise = f"{'-':>10}"
+        columnar = timed(assemble_columnar, results, labels)
+        print(f'{size:9d} {fit_time:11.3f} {1e6 * fit_time / size:11.1f} '
+              f'{rowwise} {columnar:11.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+This benchmark times the import of every batteryratecap module in a fresh
+interpreter, as a short-lived worker process pays it, and lists the
+heavy third-party packages each import loads.
+Run from the repository root:
+    python -m benchmarks.bench_import --repeat 5
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+MODULES = ['batteryratecap.fitcaprate', 'batteryratecap.batchfit',
+           'batteryratecap.data_converter', 'batteryratecap.correlationtest',
+           'batteryratecap.visualization']
+HEAVY = ['matplotlib', 'sklearn', 'openpyxl', 'scipy', 'pandas']
+
+
+def import_time(module):
+    '''
+    Wall time of one interpreter importing *module*, and the heavy
+    packages found in sys.modules afterwards.
+    '''
+    code = (f'import sys, {module}\n'
+            f'print(" ".join(name for name in {HEAVY!r} '
+            f'if name in sys.modules))')
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code],
+                            capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, result.stdout.split()
+
+
+def main():
+    '''
+    Print the best of several import times per module, with the
+    interpreter startup alone as baseline.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    baseline = min(import_time('sys')[0] for _ in range(args.repeat))
+    print(f'{"interpreter":>32} {baseline:8.3f} s')
+    for module in MODULES:
+        seconds = []
+        for _ in range(args.repeat):
+            elapsed, heavy = import_time(module)
+            seconds.append(elapsed)
+        print(f'{module:>32} {min(seconds) - baseline:8.3f} s  '
+              f'loads {", ".join(heavy) or "none"}')
+
+
+if __name__ == '__main__':
+    main()
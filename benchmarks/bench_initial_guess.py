@@ -0,0 +1,51 @@
+"""
+This benchmark reports the mean number of model evaluations of
+fitmodel() per initial guess strategy, on the bundled demo data and on
+synthetic datasets, together with the number of datasets fitted.
+Run from the repository root:
+    python -m benchmarks.bench_initial_guess --datasets 1000
+"""
+import argparse
+import os
+import time
+import warnings
+import pandas as pd
+from batteryratecap.fitcaprate import fitmodel
+from benchmarks.datagen import capacity_rate_frame
+
+DEMO_FILE = os.path.join(os.path.dirname(__file__), '..', 'doc', 'data',
+                         'input_performancelog.xls')
+STRATEGIES = [[0.5, 1, 200], 'auto', 'grid', 'warm']
+
+
+def report(name, dframe):
+    '''
+    Print one line per initial guess strategy.
+    '''
+    for params0 in STRATEGIES:
+        start = time.perf_counter()
+        _, fit_report = fitmodel(dframe, None, params0, report=True)
+        seconds = time.perf_counter() - start
+        fitted = fit_report['Error'] == ''
+        print(f'{name:>10} {str(params0):>15} '
+              f'{fit_report.loc[fitted, "nfev"].mean():10.2f} '
+              f'{fitted.sum():7d}/{len(fitted):<7d} {seconds:8.3f}')
+
+
+def main():
+    '''
+    Print the mean model evaluations per data and strategy.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--datasets', type=int, default=1000)
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+    print(f"{'data':>10} {'params0':>15} {'mean nfev':>10} "
+          f"{'fitted':>15} {'seconds':>8}")
+    report('demo', pd.read_excel(DEMO_FILE, sheet_name='CapacityRate',
+                                 header=[0, 1, 2]))
+    report('synthetic', capacity_rate_frame(args.datasets))
+
+
+if __name__ == '__main__':
+    main()
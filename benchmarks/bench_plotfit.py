@@ -0,0 +1,57 @@
+"""
+This benchmark times plotfit_pages() on many synthetic fits, and the
+former pyplot plotfit() on one page of 20 panels for comparison.
+Run from the repository root:
+    python -m benchmarks.bench_plotfit --datasets 5000 --workers 4
+"""
+import argparse
+import os
+import tempfile
+import time
+import warnings
+import matplotlib
+from batteryratecap.batchfit import fitmodel_batch
+from batteryratecap.fitcaprate import plotfit, plotfit_pages
+from benchmarks.datagen import capacity_rate_frame
+
+
+def main():
+    '''
+    Print the wall time per page of both renderers.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--datasets', type=int, default=5000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--formats', nargs='+', default=['png', 'pdf'])
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+    dframe = capacity_rate_frame(args.datasets)
+    popt_dframe = fitmodel_batch(dframe, None, [0.5, 1, 200])
+    num_pages = -(-args.datasets // 20)
+    with tempfile.TemporaryDirectory() as folder:
+        start = time.perf_counter()
+        plotfit(dframe.iloc[:, :40], popt_dframe.iloc[:20])
+        plt.savefig(os.path.join(folder, 'legacy.png'))
+        plt.close('all')
+        legacy = time.perf_counter() - start
+        print(f'plotfit, one page of 20 panels: {legacy:.2f} s, '
+              f'{legacy * num_pages / 60:.1f} min for {num_pages} pages '
+              f'if it could paginate')
+        for file_format in args.formats:
+            for workers in args.workers:
+                start = time.perf_counter()
+                paths = plotfit_pages(dframe, popt_dframe,
+                                      os.path.join(folder, 'fits.' +
+                                                   file_format),
+                                      workers=workers)
+                seconds = time.perf_counter() - start
+                print(f'plotfit_pages {file_format} with {workers} '
+                      f'workers: {seconds:.1f} s for {num_pages} pages '
+                      f'in {len(paths)} files, '
+                      f'{seconds / num_pages:.3f} s per page')
+
+
+if __name__ == '__main__':
+    main()
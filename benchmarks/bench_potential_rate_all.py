@@ -0,0 +1,100 @@
+"""
+This benchmark shows how potential_rate_all() scales with the number of
+sheets. It times the whole conversion of a synthetic workbook and,
+separately, the aggregation of the capacity maxima, comparing the former
+concat of one-row dataframes with the one-step record assembly.
+Run from the repository root:
+    python -m benchmarks.bench_potential_rate_all --sheets 10 100 500 2000
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from batteryratecap.data_converter import potential_rate_all
+from batteryratecap.data_converter import _capacity_rate_frame
+from benchmarks.datagen import voltage_capacity_sheets, write_workbook
+
+
+def sheet_records(sheets):
+    '''
+    (paper, set, quantity, C-rate, max) records of every capacity column.
+    '''
+    records = []
+    for sheetname, dframe in sheets.items():
+        rate = sheetname.split("C_")[0]
+        for (paper_num, set_num, quan), columnval in dframe.items():
+            if 'Capacity' in quan:
+                records.append((paper_num, set_num, quan, rate,
+                                np.nanmax(columnval.values)))
+    return records
+
+
+def aggregate_concat(records):
+    '''
+    Former aggregation of potential_rate_all(): concat one-row
+    dataframes, then drop the NaNs column by column.
+    '''
+    df_cap_rate = pd.DataFrame()
+    for paper_num, set_num, quan, rate, max_cap in records:
+        newdf = pd.DataFrame([[rate, max_cap]])
+        newdf.columns = [[paper_num, paper_num],
+                         [set_num, set_num], ['C-rate', quan]]
+        df_cap_rate = pd.concat([df_cap_rate, newdf])
+    return df_cap_rate.apply(lambda x: pd.Series(x.dropna().values))
+
+
+def aggregate_records(records):
+    '''
+    Current aggregation of potential_rate_all(): flat record
+    lists assembled in one step.
+    '''
+    papers, sets, quantities, rates, maxima = zip(*records)
+    return _capacity_rate_frame(papers, sets, quantities, rates, maxima)
+
+
+def timed(function, *args, **kwargs):
+    '''
+    Wall time in seconds of one call.
+    '''
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    '''
+    Print one line of timings per number of sheets.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sheets', type=int, nargs='+',
+                        default=[10, 100, 500, 2000])
+    parser.add_argument('--rows', type=int, default=50)
+    parser.add_argument('--streaming', action='store_true')
+    parser.add_argument('--concat-limit', type=int, default=500,
+                        help='largest sheet count timed with concat')
+    args = parser.parse_args()
+    print(f"{'sheets':>7} {'records':>8} {'convert s':>10} "
+          f"{'ms/sheet':>9} {'concat s':>9} {'records s':>10}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for num_sheets in args.sheets:
+            sheets = voltage_capacity_sheets(num_sheets, num_rows=args.rows)
+            path = os.path.join(tmpdir, 'workbook.xlsx')
+            write_workbook(sheets, path)
+            convert = timed(potential_rate_all, path,
+                            os.path.join(tmpdir, 'out.csv'),
+                            streaming=args.streaming)
+            records = sheet_records(sheets)
+            if num_sheets <= args.concat_limit:
+                concat = f'{timed(aggregate_concat, records):9.3f}'
+            else:
+                concat = f"{'-':>9}"
+            flat = timed(aggregate_records, records)
+            print(f'{num_sheets:7d} {len(records):8d} {convert:10.3f} '
+                  f'{1e3 * convert / num_sheets:9.2f} {concat} '
+                  f'{flat:10.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+This script compares a run of the pytest-benchmark suite with the stored
+baseline, benchmarks/baseline.json, and reports the speedup or
+regression of every benchmark by the ratio of the median times. It exits
+with status 1 when a benchmark is slower than the baseline by more than
+the threshold. Run from the repository root:
+    python -m pytest benchmarks --benchmark-json=run.json
+    python -m benchmarks.compare run.json
+    python -m benchmarks.compare run.json --update
+--update replaces the baseline by the run, keeping only the statistics.
+"""
+import os
+import sys
+import json
+import argparse
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+# Statistics of every benchmark kept in the baseline
+STATS = ['min', 'median', 'mean', 'iqr', 'rounds']
+
+
+def read_run(path):
+    '''
+    This function reads a --benchmark-json file, or a baseline written
+    by write_baseline().
+    Output
+    - scale of the run, or None when it was not recorded
+    - dictionary of benchmark full name to dictionary of STATS
+    '''
+    with open(path, encoding='utf-8') as file:
+        run = json.load(file)
+    stats = {bench['fullname']: {key: bench['stats'][key] for key in STATS}
+             for bench in run['benchmarks']}
+    return run.get('scale'), stats
+
+
+def write_baseline(path, run_file):
+    '''
+    This function writes the STATS of every benchmark of a
+    --benchmark-json file, with the scale and machine of the run.
+    '''
+    with open(run_file, encoding='utf-8') as file:
+        run = json.load(file)
+    machine = run.get('machine_info', {})
+    baseline = {'scale': run.get('scale'), 'datetime': run.get('datetime'),
+                'machine_info': {key: machine.get(key) for key in
+                                 ('machine', 'processor', 'python_version')},
+                'benchmarks': [{'fullname': bench['fullname'],
+                                'stats': {key: bench['stats'][key]
+                                          for key in STATS}}
+                               for bench in run['benchmarks']]}
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(baseline, file, indent=1)
+        file.write('\n')
+
+
+def compare(baseline, current, threshold=0.25):
+    '''
+    This function compares the median times of the benchmarks run in
+    both *baseline* and *current*, dictionaries returned by read_run().
+    Output
+    - list of (full name, baseline median, current median, speedup,
+      status) tuples, speedup being baseline / current, and status
+      'faster' or 'slower' when the speedup is beyond 1 +/- threshold,
+      'new' or 'missing' when the benchmark is in one run only
+    '''
+    rows = []
+    for name in sorted(set(baseline) | set(current)):
+        if name not in baseline:
+            rows.append((name, None, current[name]['median'], None, 'new'))
+            continue
+        if name not in current:
+            rows.append((name, baseline[name]['median'], None, None,
+                         'missing'))
+            continue
+        before = baseline[name]['median']
+        after = current[name]['median']
+        speedup = before / after if after > 0 else float('inf')
+        if speedup > 1 + threshold:
+            status = 'faster'
+        elif speedup < 1 / (1 + threshold):
+            status = 'slower'
+        else:
+            status = ''
+        rows.append((name, before, after, speedup, status))
+    return rows
+
+
+def _seconds(value):
+    '''
+    Median time in the width of its column.
+    '''
+    return f"{'-':>12}" if value is None else f'{value:12.6f}'
+
+
+def main(argv=None):
+    '''
+    Print the comparison, one line per benchmark.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('run', help='--benchmark-json file of the run')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='relative change reported, default 0.25')
+    parser.add_argument('--update', action='store_true',
+                        help='replace the baseline by the run')
+    args = parser.parse_args(argv)
+    if args.update:
+        write_baseline(args.baseline, args.run)
+        print('baseline written to', args.baseline)
+        return 0
+    base_scale, baseline = read_run(args.baseline)
+    scale, current = read_run(args.run)
+    if base_scale != scale:
+        print('warning: baseline scale', base_scale, 'run scale', scale)
+    rows = compare(baseline, current, args.threshold)
+    width = max(len(row[0]) for row in rows)
+    print(f"{'benchmark':<{width}} {'baseline s':>12} {'current s':>12} "
+          f"{'speedup':>8}")
+    for name, before, after, speedup, status in rows:
+        ratio = f"{'-':>8}" if speedup is None else f'{speedup:7.2f}x'
+        print(f'{name:<{width}} {_seconds(before)} {_seconds(after)} '
+              f'{ratio} {status}')
+    slower = [row for row in rows if row[4] == 'slower']
+    faster = [row for row in rows if row[4] == 'faster']
+    print(len(faster), 'faster,', len(slower), 'slower than the baseline',
+          f'by more than {100 * args.threshold:.0f}%')
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
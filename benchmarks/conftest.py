@@ -0,0 +1,95 @@
+"""
+This is the configuration of the pytest-benchmark suite of the
+benchmarks folder. The sizes of the synthetic data are picked by
+--bench-scale: 'small' runs in a few minutes and is the scale of
+benchmarks/baseline.json, 'medium' and 'large' reach the realistic
+scales of 100k datasets and 1e6 cycles. Run from the repository root:
+    python -m pytest benchmarks --bench-scale small \\
+        --benchmark-json=run.json
+    python -m benchmarks.compare run.json
+"""
+import os
+import pytest
+from benchmarks.datagen import voltage_capacity_sheets, write_workbook
+
+# plots are drawn without a display
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+# Data sizes of every scale, each list parametrizes the benchmarks
+# taking the fixture of the same name
+SCALES = {
+    'small': {'num_datasets': [10, 1000],
+              'plot_datasets': [20],
+              'page_datasets': [100],
+              'num_sheets': [10],
+              'cycle_points': [10**4],
+              'sample_size': [1000],
+              'feature_rows': [1000]},
+    'medium': {'num_datasets': [10, 1000, 10000],
+               'plot_datasets': [20, 200],
+               'page_datasets': [100, 1000],
+               'num_sheets': [10, 100],
+               'cycle_points': [10**4, 10**5],
+               'sample_size': [1000, 10000],
+               'feature_rows': [1000, 10000]},
+    'large': {'num_datasets': [10, 1000, 10000, 100000],
+              'plot_datasets': [20, 200],
+              'page_datasets': [100, 1000, 10000],
+              'num_sheets': [10, 100, 500],
+              'cycle_points': [10**4, 10**5, 10**6],
+              'sample_size': [1000, 10000, 100000],
+              'feature_rows': [1000, 10000, 100000]},
+}
+# Rows per voltage-capacity curve and sets per paper of the workbooks
+WORKBOOK_ROWS = 50
+WORKBOOK_SETS = 2
+
+
+def pytest_addoption(parser):
+    '''
+    Add the --bench-scale option.
+    '''
+    parser.addoption('--bench-scale', default='small', choices=list(SCALES),
+                     help='data sizes of the benchmarks, default small')
+
+
+def pytest_generate_tests(metafunc):
+    '''
+    Parametrize the size fixtures of every benchmark by the scale.
+    '''
+    sizes = SCALES[metafunc.config.getoption('bench_scale')]
+    for name, values in sizes.items():
+        if name in metafunc.fixturenames:
+            metafunc.parametrize(name, values)
+
+
+def pytest_benchmark_update_json(config, benchmarks, output_json):
+    '''
+    Record the scale in the --benchmark-json file, compared by
+    benchmarks.compare.
+    '''
+    output_json['scale'] = config.getoption('bench_scale')
+
+
+@pytest.fixture(scope='session')
+def workbooks(tmp_path_factory):
+    '''
+    Factory of synthetic charge/discharge workbooks, each written once
+    per session. workbooks(num_sheets, num_papers) returns the path and
+    sheet names of a workbook with *num_papers* papers on every sheet.
+    '''
+    written = {}
+
+    def workbook(num_sheets, num_papers=4):
+        key = (num_sheets, num_papers)
+        if key not in written:
+            sheets = voltage_capacity_sheets(
+                num_sheets, papers_per_sheet=num_papers,
+                sets_per_paper=WORKBOOK_SETS, num_rows=WORKBOOK_ROWS,
+                num_papers=num_papers)
+            path = str(tmp_path_factory.mktemp('workbooks') /
+                       ('sheets' + str(num_sheets) + '.xlsx'))
+            write_workbook(sheets, path)
+            written[key] = (path, list(sheets))
+        return written[key]
+    return workbook
@@ -0,0 +1,181 @@
+"""
+This module generates synthetic battery data at realistic scales for the
+benchmarks, in the same layouts as the demo data in doc/data.
+"""
+import numpy as np
+import pandas as pd
+import openpyxl
+from batteryratecap.fitcaprate import fitfunc
+
+
+def capacity_rate_frame(num_datasets, num_points=7, sets_per_paper=3,
+                        missing=0.1, seed=0):
+    '''
+    This function generates a capacity-rate dataframe with 3-level
+    headers ('Paper # p', 'set #s', quantity) like the 'CapacityRate'
+    sheet of doc/data/input_performancelog.xls.
+    Inputs
+    - num_datasets: integer, number of (rate, capacity) column pairs
+    - num_points: integer, maximum number of C-rates per dataset
+    - sets_per_paper: integer, number of sets grouped under one paper
+    - missing: fraction of datasets that are one to three points short,
+      padded with NaNs at the bottom
+    - seed: integer, seed of the random generator
+    Output
+    - capacity-rate dataframe
+    '''
+    rng = np.random.default_rng(seed)
+    tau = rng.lognormal(np.log(0.3), 0.5, size=(num_datasets, 1))
+    exponent_n = rng.uniform(0.8, 3, size=(num_datasets, 1))
+    capacity_q = rng.uniform(100, 300, size=(num_datasets, 1))
+    # a fraction of the datasets is one to three points short
+    count = np.full(num_datasets, num_points)
+    short = rng.random(num_datasets) < missing
+    count[short] -= rng.integers(1, 4, size=short.sum())
+    count = np.maximum(count, 2)
+    # C-rates spread evenly on a log scale around the knee of each
+    # capacity-rate curve, shorter datasets span the same range
+    position = np.arange(num_points) / (count[:, None] - 1)
+    position += rng.uniform(-0.1, 0.1, size=position.shape) / count[:, None]
+    rate = np.exp(np.log(0.05) + np.log(100) * position) / tau
+    normq = fitfunc(rate, tau, exponent_n, capacity_q)
+    normq *= 1 + 0.01 * rng.standard_normal(normq.shape)
+    padding = np.arange(num_points) >= count[:, None]
+    rate[padding] = np.nan
+    normq[padding] = np.nan
+    values = np.empty((num_points, 2 * num_datasets))
+    values[:, 0::2] = rate.T
+    values[:, 1::2] = normq.T
+    index = np.arange(num_datasets)
+    papers = np.repeat(['Paper # ' + str(i + 1)
+                        for i in index // sets_per_paper], 2)
+    sets = np.repeat(['set #' + str(i + 1)
+                      for i in index % sets_per_paper], 2)
+    quantities = np.tile(['C rate', 'Capacity (mAh/g)'], num_datasets)
+    columns = pd.MultiIndex.from_arrays([papers, sets, quantities])
+    return pd.DataFrame(values, columns=columns)
+
+
+def feature_frame(num_rows, num_features, seed=0):
+    '''
+    This function generates a dataframe of fit parameters "n", "tau" and
+    "Qmax" and design features, as plotted by visualization, where every
+    feature is a noisy linear function of one of the parameters.
+    Inputs
+    - num_rows: integer, number of fitted datasets
+    - num_features: integer, number of feature columns feature_1, ...
+    - seed: integer, seed of the random generator
+    Output
+    - dataframe with num_features + 3 columns
+    '''
+    rng = np.random.default_rng(seed)
+    params = np.column_stack([rng.uniform(0.8, 3, num_rows),
+                              rng.lognormal(np.log(0.3), 0.5, num_rows),
+                              rng.uniform(100, 300, num_rows)])
+    # each feature follows one parameter, scaled to unit spread
+    source = rng.integers(0, 3, num_features)
+    scaled = (params - params.mean(axis=0)) / params.std(axis=0)
+    values = scaled[:, source] * rng.uniform(-1, 1, num_features) + \
+        rng.standard_normal((num_rows, num_features))
+    dframe = pd.DataFrame(params, columns=['n', 'tau', 'Qmax'])
+    features = pd.DataFrame(values, columns=['feature_' + str(i + 1)
+                                             for i in range(num_features)])
+    return pd.concat([dframe, features], axis=1)
+
+
+def voltage_capacity_sheets(num_sheets, papers_per_sheet=4, sets_per_paper=2,
+                            num_rows=50, num_papers=50, seed=0):
+    '''
+    This function generates charge/discharge sheets in the layout read by
+    potential_rate_all(): one sheet per C-rate, each holding a capacity
+    and a voltage column per paper and set.
+    Inputs
+    - num_sheets: integer, number of sheets
+    - papers_per_sheet: integer, papers drawn for each sheet
+    - sets_per_paper: integer, sets of every paper
+    - num_rows: integer, datapoints per voltage-capacity curve
+    - num_papers: integer, size of the pool of paper numbers
+    - seed: integer, seed of the random generator
+    Output
+    - dictionary of sheet name to dataframe with 3-level headers
+    '''
+    rng = np.random.default_rng(seed)
+    rates = ['0.1', '0.2', '0.5', '1', '2', '5', '10']
+    sheets = {}
+    for i in range(num_sheets):
+        rate = rates[i % len(rates)]
+        direction = ['discharge', 'charge'][(i // len(rates)) % 2]
+        sheetname = rate + 'C_' + direction + str(i)
+        papers = np.sort(rng.choice(num_papers, papers_per_sheet,
+                                    replace=False)) + 1
+        columns = []
+        for paper in papers:
+            for set_num in range(1, sets_per_paper + 1):
+                for quan in ['Capacity (mAh/g)', 'Voltage (V)']:
+                    columns.append(('Paper # ' + str(paper),
+                                    'set #' + str(set_num), quan))
+        capacity = np.sort(rng.uniform(0, 200, size=(num_rows,
+                                                     len(columns) // 2)),
+                           axis=0)
+        voltage = 3.8 - capacity / 150 + 0.05 * rng.random(capacity.shape)
+        values = np.empty((num_rows, len(columns)))
+        values[:, 0::2] = capacity
+        values[:, 1::2] = voltage
+        sheets[sheetname] = pd.DataFrame(
+            values, columns=pd.MultiIndex.from_tuples(columns))
+    return sheets
+
+
+def write_workbook(sheets, path):
+    '''
+    This function writes a dictionary of sheet dataframes with 3-level
+    headers to an .xlsx workbook, one header row per level.
+    '''
+    workbook = openpyxl.Workbook(write_only=True)
+    for sheetname, dframe in sheets.items():
+        worksheet = workbook.create_sheet(sheetname)
+        for level in range(3):
+            worksheet.append(list(dframe.columns.get_level_values(level)))
+        for row in dframe.itertuples(index=False):
+            worksheet.append(list(row))
+    workbook.save(path)
+
+
+def capacity_cycle_array(num_points, current_list=(0.1, 0.2, 0.5, 1, 2, 0.1),
+                         seed=0):
+    '''
+    This function generates capacity-cycle data as read by
+    capacity_cycle(): one 'stair' of capacities per C-rate, fading with
+    the rate, in cycle order.
+    Inputs
+    - num_points: integer, number of cycles, split evenly over the stairs
+    - current_list: C-rates of the stairs in cycle order
+    - seed: integer, seed of the random generator
+    Output
+    - nx2 array of cycle number and capacity
+    '''
+    rng = np.random.default_rng(seed)
+    rates = np.asarray(current_list, dtype=float)
+    levels = 150 / (1 + (rates / 2)**1.5)
+    stair = np.arange(num_points) * len(rates) // num_points
+    capacity = levels[stair] + rng.normal(0, 1, num_points)
+    return np.column_stack([np.arange(1, num_points + 1), capacity])
+
+
+def linear_data(num_points, num_outliers=5, seed=0):
+    '''
+    This function generates correlated x, y arrays around a line with
+    a few points far off it, as tested by correlationtest.
+    Inputs
+    - num_points: integer, length of the arrays
+    - num_outliers: integer, number of points moved off the line
+    - seed: integer, seed of the random generator
+    Output
+    - x and y arrays
+    '''
+    rng = np.random.default_rng(seed)
+    x_array = rng.uniform(0, 10, num_points)
+    y_array = 2 * x_array + 1 + rng.normal(0, 1, num_points)
+    outliers = rng.choice(num_points, num_outliers, replace=False)
+    y_array[outliers] += rng.choice([-1, 1], num_outliers) * 20
+    return x_array, y_array
@@ -0,0 +1,54 @@
+"""
+This is the benchmark of correlationtest.py, testing synthetic
+correlated data at the sizes of benchmarks/conftest.py.
+"""
+import pytest
+from batteryratecap.correlationtest import correlation_hypothesis
+from batteryratecap.correlationtest import linear_outliers
+from benchmarks.datagen import linear_data
+
+pytest.importorskip('pytest_benchmark')
+
+# Rounds of the benchmarks taking more than a second at large scale
+ROUNDS = 3
+
+
+@pytest.mark.parametrize('test', ['pearson', 'spearman'])
+def test_correlation_hypothesis(benchmark, sample_size, test):
+    '''
+    Analytic p value of the correlation.
+    '''
+    x_array, y_array = linear_data(sample_size)
+    benchmark.group = 'correlation_hypothesis'
+    benchmark(correlation_hypothesis, x_array, y_array, 0.05, test=test)
+
+
+@pytest.mark.parametrize('resampling', ['permutation', 'bootstrap'])
+def test_correlation_resampling(benchmark, sample_size, resampling):
+    '''
+    Resampled p value of the correlation, 1000 resamples.
+    '''
+    x_array, y_array = linear_data(sample_size)
+    benchmark.group = 'correlation_hypothesis'
+    benchmark.pedantic(correlation_hypothesis,
+                       args=(x_array, y_array, 0.05),
+                       kwargs={'resampling': resampling,
+                               'num_resamples': 1000, 'seed': 0},
+                       rounds=ROUNDS, iterations=1)
+
+
+def test_linear_outliers(benchmark, sample_size):
+    '''
+    Find and plot the five outliers from the regression line.
+    '''
+    from matplotlib import pyplot as plt
+    x_array, y_array = linear_data(sample_size)
+
+    def outliers():
+        result = linear_outliers(x_array, y_array, 5)
+        plt.close('all')
+        return result
+    benchmark.group = 'linear_outliers'
+    x_no_outliers, _ = benchmark.pedantic(outliers, rounds=ROUNDS,
+                                          iterations=1)
+    assert len(x_no_outliers) == sample_size - 5, 'Five outliers expected'
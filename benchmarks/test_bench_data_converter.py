@@ -0,0 +1,59 @@
+"""
+This is the benchmark of data_converter.py, converting synthetic
+charge/discharge workbooks and capacity-cycle data at the sizes of
+benchmarks/conftest.py.
+"""
+import pytest
+from batteryratecap.data_converter import potential_rate_all
+from batteryratecap.data_converter import potential_rate_paper_set
+from batteryratecap.data_converter import capacity_cycle
+from benchmarks.datagen import capacity_cycle_array
+
+pytest.importorskip('pytest_benchmark')
+
+# Rounds of the benchmarks taking more than a second at large scale
+ROUNDS = 3
+# C-rates of the capacity-cycle stairs
+CURRENT_LIST = [0.1, 0.2, 0.5, 1, 2, 0.1]
+
+
+@pytest.mark.parametrize('streaming', [False, True],
+                         ids=['whole', 'streaming'])
+def test_potential_rate_all(benchmark, workbooks, num_sheets, streaming):
+    '''
+    Convert every paper and set of a workbook.
+    '''
+    path, _ = workbooks(num_sheets)
+    benchmark.group = 'potential_rate_all'
+    result = benchmark.pedantic(potential_rate_all, args=(path, None),
+                                kwargs={'streaming': streaming},
+                                rounds=ROUNDS, iterations=1)
+    assert len(result.columns) > 0, 'Nothing converted'
+
+
+def test_potential_rate_paper_set(benchmark, tmp_path, workbooks,
+                                  num_sheets):
+    '''
+    Convert the sets of one paper found on every sheet.
+    '''
+    path, sheet_names = workbooks(num_sheets)
+    output_file = str(tmp_path / 'paper_set.csv')
+    benchmark.group = 'potential_rate_paper_set'
+    result = benchmark.pedantic(
+        potential_rate_paper_set,
+        args=(path, sheet_names, output_file, 'Paper # 1', 2),
+        rounds=ROUNDS, iterations=1)
+    assert len(result) == num_sheets, 'One row per sheet expected'
+
+
+@pytest.mark.parametrize('num_rate', [None, len(CURRENT_LIST)],
+                         ids=['detected', 'known'])
+def test_capacity_cycle(benchmark, cycle_points, num_rate):
+    '''
+    Group capacity-cycle data into stairs by detect_steps().
+    '''
+    array = capacity_cycle_array(cycle_points, CURRENT_LIST)
+    benchmark.group = 'capacity_cycle'
+    result = benchmark(capacity_cycle, array, num_rate, CURRENT_LIST, 'C',
+                       'mAh/g', plot=False)
+    assert len(result) == len(CURRENT_LIST), 'One row per stair expected'
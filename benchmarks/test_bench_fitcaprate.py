@@ -0,0 +1,79 @@
+"""
+This is the benchmark of fitcaprate.py, fitting and plotting synthetic
+capacity-rate datasets at the sizes of benchmarks/conftest.py.
+"""
+import warnings
+import pytest
+from batteryratecap.fitcaprate import fitmodel, fit, plotfit, plotfit_pages
+from benchmarks.datagen import capacity_rate_frame
+
+pytest.importorskip('pytest_benchmark')
+
+# Rounds of the benchmarks taking more than a second at large scale
+ROUNDS = 3
+
+
+@pytest.fixture(autouse=True)
+def _quiet():
+    '''
+    Silence the warnings of datasets that do not converge.
+    '''
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        yield
+
+
+@pytest.mark.parametrize('params0', [[0.5, 1, 200], 'auto'],
+                         ids=['fixed', 'auto'])
+def test_fitmodel(benchmark, num_datasets, params0):
+    '''
+    Fit every dataset of a capacity-rate dataframe.
+    '''
+    dframe = capacity_rate_frame(num_datasets)
+    benchmark.group = 'fitmodel'
+    result = benchmark.pedantic(fitmodel, args=(dframe, None, params0),
+                                rounds=ROUNDS, iterations=1)
+    assert len(result) == num_datasets, 'One row per dataset expected'
+
+
+@pytest.mark.parametrize('params0', [[0.5, 1, 200], 'auto', 'grid'],
+                         ids=['fixed', 'auto', 'grid'])
+def test_fit(benchmark, params0):
+    '''
+    Fit one dataset.
+    '''
+    dframe = capacity_rate_frame(1, missing=0)
+    benchmark.group = 'fit'
+    popt, _ = benchmark(fit, params0, xdata=dframe.iloc[:, 0].values,
+                        ydata=dframe.iloc[:, 1].values)
+    assert len(popt) == 3, 'Three fit parameters expected'
+
+
+def test_plotfit(benchmark, plot_datasets):
+    '''
+    Plot datasets and their fits on one pyplot figure.
+    '''
+    from matplotlib import pyplot as plt
+    dframe = capacity_rate_frame(plot_datasets)
+    dframe_out = fitmodel(dframe, None, [0.5, 1, 200])
+
+    def plot():
+        plotfit(dframe, dframe_out)
+        plt.close('all')
+    benchmark.group = 'plotfit'
+    benchmark.pedantic(plot, rounds=ROUNDS, iterations=1)
+
+
+@pytest.mark.parametrize('ext', ['.png', '.pdf'])
+def test_plotfit_pages(benchmark, tmp_path, page_datasets, ext):
+    '''
+    Plot datasets and their fits on pages of 5 x 4 panels.
+    '''
+    dframe = capacity_rate_frame(page_datasets)
+    dframe_out = fitmodel(dframe, None, [0.5, 1, 200])
+    benchmark.group = 'plotfit_pages'
+    paths = benchmark.pedantic(
+        plotfit_pages, args=(dframe, dframe_out, str(tmp_path / ('fits' +
+                                                                 ext))),
+        rounds=ROUNDS, iterations=1)
+    assert paths, 'No page written'
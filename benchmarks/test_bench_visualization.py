@@ -0,0 +1,43 @@
+"""
+This is the benchmark of visualization.py, plotting synthetic fit
+parameters and design features at the sizes of benchmarks/conftest.py.
+"""
+import pytest
+from batteryratecap.visualization import feature_vs_n_tau_q, feature_pages
+from benchmarks.datagen import feature_frame
+
+pytest.importorskip('pytest_benchmark')
+
+# Rounds of the benchmarks taking more than a second at large scale
+ROUNDS = 3
+# Features of every plot, two pages of feature_pages()
+NUM_FEATURES = 8
+
+
+def test_feature_vs_n_tau_q(benchmark, feature_rows):
+    '''
+    Plot the features on one pyplot figure.
+    '''
+    from matplotlib import pyplot as plt
+    dframe = feature_frame(feature_rows, NUM_FEATURES)
+    features = list(dframe.columns[3:])
+
+    def plot():
+        feature_vs_n_tau_q(dframe, features, mode='auto')
+        plt.close('all')
+    benchmark.group = 'feature_vs_n_tau_q'
+    benchmark.pedantic(plot, rounds=ROUNDS, iterations=1)
+
+
+@pytest.mark.parametrize('ext', ['.png', '.pdf'])
+def test_feature_pages(benchmark, tmp_path, feature_rows, ext):
+    '''
+    Plot the features on pages of four rows.
+    '''
+    dframe = feature_frame(feature_rows, NUM_FEATURES)
+    benchmark.group = 'feature_pages'
+    paths = benchmark.pedantic(
+        feature_pages, args=(dframe, dframe.columns[3:],
+                             str(tmp_path / ('features' + ext))),
+        rounds=ROUNDS, iterations=1)
+    assert paths, 'No page written'
@@ -0,0 +1,123 @@
+"""
+This is the unit test for batchfit.py.
+"""
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+import git
+import numpy as np
+import pandas as pd
+from batteryratecap.batchfit import pack_datasets
+from batteryratecap.batchfit import batch_fit
+from batteryratecap.batchfit import fitmodel_batch
+from batteryratecap.batchfit import bootstrap_fit
+from batteryratecap.batchfit import fitmodel_bootstrap
+from batteryratecap.fitcaprate import fit
+from batteryratecap.fitcaprate import fitfunc
+
+REPO = git.Repo('.', search_parent_directories=True)
+GIT_PATH = REPO.git.rev_parse("--show-toplevel")
+IN_PATH = os.path.join(GIT_PATH, 'doc/data')
+
+
+def test_pack_datasets():
+    '''
+    Test that ragged column pairs are packed into padded arrays
+    with a mask marking the present datapoints.
+    '''
+    dframe = pd.DataFrame({'r1': [1, 2, 3], 'q1': [10, 9, 8],
+                           'r2': [1, 2, np.nan], 'q2': [5, 4, np.nan]})
+    rate, normq, mask = pack_datasets(dframe)
+    assert rate.shape == (2, 3), 'Unexpected packed array shape'
+    assert mask.sum(axis=1).tolist() == [3, 2], 'Unexpected mask'
+    assert np.all(np.isfinite(rate)) and np.all(np.isfinite(normq)), \
+        'Padded entries must be finite'
+    # Test input dataframe has the correct number of columns
+    try:
+        pack_datasets(pd.DataFrame({'Rate': [1, 2, 3]}))
+    except Exception as err:
+        assert isinstance(err, AssertionError), "Function outputs \
+        the incorrrect error type when input dataframe has the \
+        wrong number of columns"
+
+
+def test_batch_fit():
+    '''
+    Test that the batched solver recovers known parameters of
+    synthetic datasets of different lengths in one call.
+    '''
+    truth = np.array([[0.5, 1.2, 150], [0.1, 2.0, 200], [1.5, 0.8, 120]])
+    rate = np.tile(np.logspace(-1, 1, 8), (3, 1))
+    mask = np.ones(rate.shape, dtype=bool)
+    mask[2, 5:] = False
+    normq = fitfunc(rate, truth[:, 0:1], truth[:, 1:2], truth[:, 2:3])
+    popt, pcov, converged, _ = batch_fit(rate, normq, mask, [0.5, 1, 200])
+    assert np.allclose(popt, truth, rtol=1e-4), 'Known parameters \
+    were not recovered'
+    assert pcov.shape == (3, 3, 3), 'Unexpected covariance shape'
+    assert np.all(converged), 'Batched fit did not converge'
+
+
+def test_fitmodel_batch():
+    '''
+    Test that the batched fit returns the fitmodel() table and
+    agrees with curve_fit on the demo capacity-rate data.
+    '''
+    df_input = pd.read_excel(os.path.join(IN_PATH,
+                                          "input_performancelog.xls"),
+                             sheet_name='CapacityRate',
+                             header=[0, 1, 2])
+    params0 = [0.5, 1, 200]
+    dframe_out = fitmodel_batch(df_input, None, params0)
+    assert dframe_out.shape == (len(df_input.columns) // 2, 8), \
+        'Unexpected shape of fit parameter table'
+    # compare with curve_fit on well-conditioned datasets
+    for i in [0, 1, 8, 9, 10, 12, 13]:
+        data = df_input.iloc[:, [2 * i, 2 * i + 1]].dropna()
+        popt, pcov = fit(params0, xdata=data.iloc[:, 0].values,
+                         ydata=data.iloc[:, 1].values)
+        assert np.allclose(dframe_out.loc[i, ['tau', 'n', 'Qmax']], popt,
+                           rtol=1e-3), 'Batched fit differs from curve_fit'
+        assert np.allclose(dframe_out.loc[i, ['sigma_tau', 'sigma_n',
+                                              'sigma_Qmax']],
+                           np.sqrt(np.diag(pcov)), rtol=1e-2), \
+            'Batched standard deviations differ from curve_fit'
+    # datasets with less than four datapoints are not fitted
+    assert (dframe_out.loc[2, ['tau', 'n', 'Qmax']] == 0).all(), \
+        'Short datasets should not be fitted'
+
+
+def test_bootstrap_fit():
+    '''
+    Test that the bootstrap intervals of a noisy synthetic dataset
+    bracket the fit and that every dataset of the demo data gets a
+    reproducible row, with or without workers.
+    '''
+    rng = np.random.default_rng(0)
+    rate = np.logspace(-1, 1, 6)
+    normq = fitfunc(rate, 0.5, 1.2, 150) + rng.normal(0, 1, 6)
+    for method in ['residual', 'case']:
+        # resamples without degrees of freedom must not warn
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+            popt, conf_int, num_valid = bootstrap_fit(
+                rate, normq, [0.5, 1, 200], 500, method, seed=1)
+        assert conf_int.shape == (3, 2), 'Unexpected interval shape'
+        assert num_valid > 400, 'Too few resamples converged'
+        assert np.all(conf_int[:, 0] <= popt) and \
+            np.all(popt <= conf_int[:, 1]), 'Fit is outside its interval'
+    df_input = pd.read_excel(os.path.join(IN_PATH,
+                                          "input_performancelog.xls"),
+                             sheet_name='CapacityRate',
+                             header=[0, 1, 2])
+    serial = fitmodel_bootstrap(df_input.iloc[:, :6], None, [0.5, 1, 200],
+                                num_resamples=200, seed=2)
+    with ThreadPoolExecutor(2) as pool:
+        parallel = fitmodel_bootstrap(df_input.iloc[:, :6], None,
+                                      [0.5, 1, 200], num_resamples=200,
+                                      seed=2, executor=pool)
+    assert serial.shape == (3, 12), 'Unexpected shape of bootstrap table'
+    pd.testing.assert_frame_equal(serial, parallel)
+    # datasets with less than four datapoints are not fitted
+    assert (serial.loc[2, ['tau', 'n', 'Qmax']] == 0).all(), \
+        'Short datasets should not be fitted'
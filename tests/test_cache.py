@@ -0,0 +1,97 @@
+"""
+This is the unit test for cache.py
+"""
+import os
+import json
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+import git
+import pandas as pd
+from batteryratecap.cache import read_workbook
+from batteryratecap.cache import invalidate
+from batteryratecap.data_converter import potential_rate_paper_set
+
+REPO = git.Repo('.', search_parent_directories=True)
+GIT_PATH = REPO.git.rev_parse("--show-toplevel")
+DATA_PATH = os.path.join(GIT_PATH, 'doc/data')
+IN_PATH = os.path.join(DATA_PATH, 'input_voltage_capacity_by_c-rate.xls')
+
+
+def _fail_read_excel(*args, **kwargs):
+    raise AssertionError('pd.read_excel should not be called')
+
+
+def test_read_workbook(tmp_path, monkeypatch):
+    '''
+    This function tests that a cached workbook matches pd.read_excel and
+    that repeated reads, also through the converters, skip pd.read_excel.
+    '''
+    cache_dir = os.path.join(tmp_path, 'cache')
+    sheets = read_workbook(IN_PATH, cache_dir=cache_dir)
+    expected = pd.read_excel(IN_PATH, sheet_name=None, header=[0, 1, 2])
+    assert list(sheets) == list(expected), 'Sheet order is not kept'
+    monkeypatch.setattr(pd, 'read_excel', _fail_read_excel)
+    cached = read_workbook(IN_PATH, cache_dir=cache_dir)
+    for name, dframe in expected.items():
+        pd.testing.assert_frame_equal(cached[name], dframe)
+    single = read_workbook(IN_PATH, '2C_discharge', cache_dir=cache_dir)
+    pd.testing.assert_frame_equal(single, expected['2C_discharge'])
+    df_cap_rate = potential_rate_paper_set(IN_PATH, ['2C_discharge',
+                                                     '5C_discharge'],
+                                           os.path.join(tmp_path,
+                                                        'out.xlsx'),
+                                           'Paper # 32', 1, cache=cache_dir)
+    assert df_cap_rate.shape == (2, 2), 'Unexpected capacity-rate shape'
+
+
+def test_invalidate(tmp_path):
+    '''
+    This function tests the explicit invalidation of a cached workbook
+    and the eviction of least recently used workbooks above the size
+    limit.
+    '''
+    cache_dir = os.path.join(tmp_path, 'cache')
+    first = os.path.join(tmp_path, 'first.xls')
+    second = os.path.join(tmp_path, 'second.xls')
+    shutil.copy(IN_PATH, first)
+    shutil.copy(os.path.join(DATA_PATH, 'input_performancelog.xls'), second)
+    read_workbook(first, cache_dir=cache_dir)
+    assert len(_entries(cache_dir)) == 1, 'Workbook was not cached'
+    invalidate(first, cache_dir=cache_dir)
+    assert len(_entries(cache_dir)) == 0, 'Workbook was not invalidated'
+    # a one byte limit only keeps the most recently used workbook
+    read_workbook(first, cache_dir=cache_dir, max_bytes=1)
+    read_workbook(second, cache_dir=cache_dir, max_bytes=1)
+    assert len(_entries(cache_dir)) == 1, 'Workbook was not evicted'
+    invalidate(cache_dir=cache_dir)
+    assert len(_entries(cache_dir)) == 0, 'Cache was not cleared'
+
+
+def test_concurrent_reads(tmp_path):
+    '''
+    This function tests that worker processes sharing a cache leave one
+    entry, a valid index and no temporary files.
+    '''
+    cache_dir = os.path.join(tmp_path, 'cache')
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        shapes = list(pool.map(_sheet_shapes, [IN_PATH] * 8,
+                               [cache_dir] * 8))
+    assert all(shape == shapes[0] for shape in shapes), \
+        'Workers read different sheets'
+    assert len(_entries(cache_dir)) == 1, 'Workbook cached more than once'
+    with open(os.path.join(cache_dir, 'index.json'), encoding='utf-8') as file:
+        index = json.load(file)
+    assert len(index['entries']) == 1 and len(index['files']) == 1, \
+        'Index lost or duplicated the workbook'
+    assert not [name for name in os.listdir(cache_dir)
+                if name.startswith('.tmp')], 'Temporary files left over'
+
+
+def _sheet_shapes(input_file, cache_dir):
+    return {name: dframe.shape for name, dframe
+            in read_workbook(input_file, cache_dir=cache_dir).items()}
+
+
+def _entries(cache_dir):
+    return [name for name in os.listdir(cache_dir)
+            if os.path.isdir(os.path.join(cache_dir, name))]
@@ -0,0 +1,116 @@
+"""
+This is the unit test for cli.py.
+"""
+import os
+import json
+import shutil
+import git
+import pandas as pd
+from batteryratecap.cli import main
+from batteryratecap.cli import expand_inputs
+from batteryratecap.cli import read_capacity_rate
+
+REPO = git.Repo('.', search_parent_directories=True)
+GIT_PATH = REPO.git.rev_parse("--show-toplevel")
+IN_PATH = os.path.join(GIT_PATH, 'doc/data')
+VOLTAGE_FILE = os.path.join(IN_PATH, 'input_voltage_capacity_by_c-rate.xls')
+
+
+def _read_profile(path):
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+
+def test_expand_inputs(tmp_path):
+    '''
+    Test that patterns expand to sorted files without duplicates.
+    '''
+    for name in ('b.xls', 'a.xls', 'c.csv'):
+        open(os.path.join(tmp_path, name), 'w', encoding='utf-8').close()
+    inputs = expand_inputs([os.path.join(tmp_path, '*.xls'),
+                            os.path.join(tmp_path, 'a.xls'),
+                            os.path.join(tmp_path, 'missing.xls')])
+    assert [os.path.basename(path) for path in inputs] == \
+        ['a.xls', 'b.xls'], 'Unexpected input files'
+
+
+def test_main(tmp_path):
+    '''
+    Test that convert, fit and correlate chain over several workbooks,
+    with worker processes, and write JSON lines profiles.
+    '''
+    for name in ('first.xls', 'second.xls'):
+        shutil.copy(VOLTAGE_FILE, os.path.join(tmp_path, name))
+    out = os.path.join(tmp_path, 'out')
+    profile = os.path.join(tmp_path, 'profile.jsonl')
+    main(['convert', os.path.join(tmp_path, '*.xls'), '--output-dir', out,
+          '--jobs', '2', '--profile', profile])
+    records = _read_profile(profile)
+    assert [record['event'] for record in records] == \
+        ['file', 'file', 'total'], 'One record per file and a total expected'
+    assert all(record['wall_time'] > 0 for record in records), \
+        'Wall times missing'
+    assert all('process_peak_rss_mb' in record for record in records[:2]), \
+        'Process peak memory missing'
+    main(['fit', os.path.join(out, '*_capacity_rate.xlsx'), '--output-dir',
+          out, '--profile', profile])
+    datasets = [record for record in _read_profile(profile)
+                if record['event'] == 'dataset']
+    assert len(datasets) == 24, 'One record per fitted dataset expected'
+    assert all(record['fit_time'] > 0 for record in datasets
+               if record['error'] == ''), 'Fit times missing'
+    popt_dframe = pd.read_excel(os.path.join(
+        out, 'first_capacity_rate_fitparameters.xlsx'))
+    assert popt_dframe.shape == (12, 8), 'Unexpected fit parameter table'
+    # Test the correlation of the performance log fits
+    main(['fit', os.path.join(IN_PATH, 'input_performancelog.xls'),
+          '--output-dir', out, '--format', 'csv'])
+    main(['correlate', os.path.join(out, 'input_performancelog_'
+                                    'fitparameters.csv'),
+          '--features', os.path.join(IN_PATH, 'input_parameterlog.xls'),
+          '--output-dir', out, '--format', 'csv', '--methods', 'pearson'])
+    result = pd.read_csv(os.path.join(
+        out, 'input_performancelog_fitparameters_correlations.csv'))
+    assert set(result['test']) == {'pearson'}, 'Unexpected tests'
+
+
+def test_profile_stdout(tmp_path, capsys):
+    '''
+    Test that with --profile - every line of stdout is a JSON profile
+    record, whatever the library functions print.
+    '''
+    out = os.path.join(tmp_path, 'out')
+    performance = os.path.join(IN_PATH, 'input_performancelog.xls')
+    commands = [
+        ['convert', VOLTAGE_FILE, '--sheets', '0.5C_discharge',
+         '1C_discharge', '--paper', 'Paper # 32', '--sets', '3'],
+        ['fit', performance, '--store', os.path.join(tmp_path, 'fits.db'),
+         '--format', 'csv'],
+        ['correlate', os.path.join(out, 'input_performancelog_'
+                                   'fitparameters.csv'),
+         '--features', os.path.join(IN_PATH, 'input_parameterlog.xls'),
+         '--methods', 'pearson'],
+        ['run', VOLTAGE_FILE, '--cache-dir', os.path.join(tmp_path, 'cache')]]
+    for command in commands:
+        capsys.readouterr()
+        main(command + ['--output-dir', out, '--profile', '-'])
+        lines = capsys.readouterr().out.splitlines()
+        assert lines, 'No profile records on stdout'
+        records = [json.loads(line) for line in lines]
+        assert records[-1]['event'] == 'total', \
+            'The profile of ' + command[0] + ' has no total'
+
+
+def test_read_capacity_rate():
+    '''
+    Test that the CapacityRate sheet is read by default and that an
+    index column written by the converter is dropped.
+    '''
+    dframe = read_capacity_rate(os.path.join(IN_PATH,
+                                             'input_performancelog.xls'))
+    assert dframe.shape[1] == 34, 'CapacityRate sheet not read'
+    dframe = read_capacity_rate(os.path.join(
+        IN_PATH, 'export_capacity_rate_all.xlsx'))
+    assert dframe.shape[1] % 2 == 0 and \
+        not any(str(column[0]).startswith('Unnamed:')
+                for column in dframe.columns), 'Index column not dropped'
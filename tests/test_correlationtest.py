@@ -1,10 +1,18 @@
 """
 This is the unit test for correlationtest.py
 """
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import pandas as pd
+from scipy import stats
 from batteryratecap.correlationtest import correlation_hypothesis
 from batteryratecap.correlationtest import plot_linear_regression
 from batteryratecap.correlationtest import linear_outliers
+from batteryratecap.correlationtest import outlier_indices
+from batteryratecap.correlationtest import leave_one_out_stderr
+from batteryratecap.correlationtest import correlation_matrix
+from batteryratecap.correlationtest import adjust_p_values
+from batteryratecap.correlationtest import resampled_correlation
 
 
 def test_correlation_hypothesis():
@@ -55,3 +63,130 @@ def test_linear_outliers():
     known case'
     assert set(y_new) == set(y_values[0:4]), 'outlier is not right for \
     known case'
+
+
+def test_outlier_indices():
+    '''
+    This function checks the closed-form leave-one-out standard errors
+    against repeated linregress calls and that duplicated values are
+    removed by position only.
+    '''
+    rng = np.random.default_rng(0)
+    x_values = rng.uniform(0, 10, 50)
+    y_values = 2 * x_values + rng.normal(0, 1, 50)
+    sums = np.array([50, x_values.sum(), y_values.sum(),
+                     x_values @ x_values, x_values @ y_values,
+                     y_values @ y_values])
+    stderr = leave_one_out_stderr(sums, x_values, y_values)
+    brute = [stats.linregress(np.delete(x_values, i),
+                              np.delete(y_values, i)).stderr
+             for i in range(50)]
+    assert np.allclose(stderr, brute), 'leave-one-out stderr is not right'
+    # outliers found one at a time like repeated linregress calls
+    y_values[[3, 30]] += [25, -40]
+    outliers = outlier_indices(x_values, y_values, 2)
+    assert list(outliers) == [30, 3], 'outliers are not right'
+    # a duplicated point elsewhere is kept
+    x_values = np.array([0, 1, 2, 3, 4, 5, 2])
+    y_values = np.array([0, 2, 4, 6, 8, 10, 30])
+    outliers = outlier_indices(x_values, y_values, 1)
+    assert list(outliers) == [6], 'outlier is not right for known case'
+    x_new, _ = linear_outliers(x_values, y_values, 1)
+    assert len(x_new) == 6, 'duplicated value was removed'
+
+
+def test_correlation_matrix():
+    '''
+    This function checks the vectorized correlations and p values
+    against scipy for every pair, with missing values and ties.
+    '''
+    rng = np.random.default_rng(1)
+    features = pd.DataFrame(rng.normal(size=(30, 4)),
+                            columns=['a', 'b', 'c', 'd'])
+    features['d'] = np.round(features['d'])
+    fit_params = pd.DataFrame({'tau': rng.normal(size=30),
+                               'n': features['a'] + rng.normal(size=30),
+                               'Qmax': rng.normal(size=30)})
+    features.iloc[[2, 5], 1] = np.nan
+    result = correlation_matrix(features, fit_params, correction='holm')
+    assert len(result) == 2 * 4 * 3, 'result has the wrong number of rows'
+    for row in result.itertuples():
+        x_values = features[row.feature]
+        y_values = fit_params[row.parameter]
+        keep = x_values.notna() & y_values.notna()
+        if row.test == 'pearson':
+            expected = stats.pearsonr(x_values[keep], y_values[keep])
+        else:
+            expected = stats.spearmanr(x_values[keep], y_values[keep])
+        assert row.n == keep.sum(), 'number of rows is not right'
+        assert np.isclose(row.correlation, expected[0]), \
+            'correlation is not right'
+        assert np.isclose(row.p_value, expected[1]), 'p value is not right'
+    assert (result['p_adjusted'] >= result['p_value']).all(), \
+        'adjusted p values are smaller'
+    # known case for the corrections
+    p_values = np.array([0.01, 0.04, 0.03, np.nan])
+    assert np.allclose(adjust_p_values(p_values, 'bonferroni')[:3],
+                       [0.03, 0.12, 0.09]), 'bonferroni is not right'
+    assert np.allclose(adjust_p_values(p_values, 'holm')[:3],
+                       [0.03, 0.06, 0.06]), 'holm is not right'
+    assert np.allclose(adjust_p_values(p_values, 'fdr_bh')[:3],
+                       [0.03, 0.04, 0.04]), 'fdr_bh is not right'
+    assert np.isnan(adjust_p_values(p_values)[3]), 'NaN is not kept'
+
+
+def test_resampled_correlation():
+    '''
+    This function checks the permutation and bootstrap tests against
+    the analytic ones and that the resamples are reproducible.
+    '''
+    rng = np.random.default_rng(2)
+    x_values = rng.normal(size=40)
+    y_values = 0.4 * x_values + rng.normal(size=40)
+    for test, analytic in [('pearson', stats.pearsonr),
+                           ('spearman', stats.spearmanr)]:
+        expected = analytic(x_values, y_values)
+        corr, p_value, conf_int, p_int = resampled_correlation(
+            x_values, y_values, test, 'permutation', 20000, seed=0,
+            block_size=3000)
+        assert np.isclose(corr, expected[0]), 'correlation is not right'
+        assert abs(p_value - expected[1]) < 0.01, 'p value is not right'
+        assert p_int[0] <= p_value <= p_int[1], \
+            'p value is outside its interval'
+        assert conf_int[0] < corr < conf_int[1], \
+            'correlation is outside its interval'
+        permutation_int = conf_int
+        corr, p_value, conf_int, p_int = resampled_correlation(
+            x_values, y_values, test, 'bootstrap', 20000, seed=0,
+            block_size=3000)
+        assert conf_int[0] < corr < conf_int[1], \
+            'correlation is outside its interval'
+        # both modes give the same bootstrap interval of the correlation
+        assert conf_int == permutation_int, \
+            'correlation intervals of the two modes differ'
+        assert p_value < 0.05, 'bootstrap p value is not right'
+        assert p_int[0] <= p_value <= p_int[1], \
+            'bootstrap p value is outside its interval'
+    # on a small skewed sample the interval is not the Fisher z interval
+    x_skewed = rng.lognormal(0, 1.5, 15)
+    y_skewed = x_skewed + rng.lognormal(0, 1.5, 15)
+    corr, _, conf_int, _ = resampled_correlation(
+        x_skewed, y_skewed, 'pearson', 'permutation', 20000, seed=0)
+    half = stats.norm.ppf(0.975) / np.sqrt(15 - 3)
+    fisher = np.tanh(np.arctanh(corr) + np.array([-half, half]))
+    assert np.abs(np.array(conf_int) - fisher).max() > 0.05, \
+        'permutation interval is the normal theory interval'
+    # same blocks and streams with workers
+    serial = resampled_correlation(x_values, y_values, 'spearman',
+                                   'bootstrap', 5000, seed=3, block_size=700)
+    with ThreadPoolExecutor(2) as pool:
+        parallel = resampled_correlation(x_values, y_values, 'spearman',
+                                         'bootstrap', 5000, seed=3,
+                                         block_size=700, executor=pool)
+    assert serial == parallel, 'resamples are not reproducible'
+    result = correlation_hypothesis(x_values, y_values, 0.05,
+                                    resampling='permutation',
+                                    num_resamples=1000, seed=0)
+    assert len(result) == 3, 'confidence interval is not returned'
+    assert result[2][0] < result[0] < result[2][1], \
+        'the interval is not an interval of the correlation'
@@ -2,13 +2,19 @@
 Unit test for data_converter
 """
 import os
+from concurrent.futures import ThreadPoolExecutor
 import git
 import pandas as pd
 import numpy as np
+from matplotlib import pyplot as plt
 from batteryratecap.data_converter import potential_rate_paper_set
+from batteryratecap.data_converter import potential_rate_papers
 from batteryratecap.data_converter import potential_rate_all
+from batteryratecap.data_converter import iter_potential_rate
 from batteryratecap.data_converter import excel_merge
 from batteryratecap.data_converter import capacity_cycle
+from batteryratecap.data_converter import detect_steps
+from batteryratecap.data_converter import capacity_cycle_batch
 
 REPO = git.Repo('.', search_parent_directories=True)
 GIT_PATH = REPO.git.rev_parse("--show-toplevel")
@@ -65,6 +71,15 @@ def test_potential_rate_all():
     except Exception as err:
         assert isinstance(err, AssertionError), "Function outputs the wrong \
         error type when input file has wrong sheetnames."
+    # Test the capacity-rate layout on the demo workbook
+    df_cap_rate = potential_rate_all(os.path.join(
+        DATA_PATH, 'input_voltage_capacity_by_c-rate.xls'), OUT_PATH)
+    assert df_cap_rate.shape == (8, 24), 'Unexpected capacity-rate shape'
+    assert list(df_cap_rate.columns.get_level_values(2)[:2]) == \
+        ['C-rate', 'Capacity (mAh/g)'], 'Columns should pair C-rate and \
+        capacity'
+    assert np.isclose(df_cap_rate.iloc[0, 1], 114.705626), 'Capacity \
+    maximum is not right for known case'
 
 
 def test_excel_merge():
@@ -107,3 +122,129 @@ def test_capacity_cycle():
     except Exception as err:
         assert isinstance(err, AssertionError), "Function outputs the wrong \
         error type when input array is the wrong shape."
+
+
+def test_iter_potential_rate(tmp_path):
+    '''
+    This function tests that streaming an .xlsx copy of the demo workbook
+    sheet by sheet gives the same capacity-rate dataframe as reading all
+    sheets at once.
+    '''
+    in_path = os.path.join(DATA_PATH, 'input_voltage_capacity_by_c-rate.xls')
+    xlsx_path = os.path.join(tmp_path, 'input.xlsx')
+    sheets = pd.read_excel(in_path, sheet_name=None, header=None)
+    with pd.ExcelWriter(xlsx_path) as excel_writer:
+        for sheetname, sheet in sheets.items():
+            sheet.to_excel(excel_writer, sheet_name=sheetname,
+                           header=False, index=False)
+    partial = list(iter_potential_rate(xlsx_path, chunksize=7))
+    assert len(partial) == len(sheets), 'One partial result per sheet'
+    assert partial[0].iloc[0, 0] == '0.5', 'Partial result of the first \
+    sheet should hold its C-rate'
+    df_all = potential_rate_all(in_path, os.path.join(tmp_path, 'all.xlsx'))
+    df_stream = potential_rate_all(xlsx_path,
+                                   os.path.join(tmp_path, 'stream.xlsx'),
+                                   streaming=True)
+    pd.testing.assert_frame_equal(df_stream, df_all)
+
+
+def test_potential_rate_papers(tmp_path):
+    '''
+    This function tests that the batch conversion of several papers
+    matches potential_rate_paper_set() paper by paper, and that 'all'
+    finds every paper and set of the sheets.
+    '''
+    in_path = os.path.join(DATA_PATH, 'input_voltage_capacity_by_c-rate.xls')
+    sheets = ['0.5C_discharge', '1C_discharge', '2C_discharge']
+    out_path = os.path.join(tmp_path, 'papers.xlsx')
+    df_batch = potential_rate_papers(in_path, sheets, out_path,
+                                     [('Paper # 32', 2)])
+    df_single = potential_rate_paper_set(in_path, sheets, out_path,
+                                         'Paper # 32', 2)
+    assert np.allclose(df_batch.to_numpy(dtype=float),
+                       df_single.to_numpy(dtype=float)), 'Batch \
+    conversion differs from the single paper conversion'
+    df_all = potential_rate_papers(in_path, sheets, out_path)
+    assert ('Paper # 32', 'set #2', 'Capacity (mAh/g)') in df_all.columns, \
+        "Conversion of 'all' papers misses a set"
+    try:
+        potential_rate_papers(in_path, sheets, out_path, [('Paper # 32', '2')])
+    except Exception as err:
+        assert isinstance(err, AssertionError), "Function outputs the wrong \
+        error type when input set number is not an integer."
+
+
+def test_detect_steps():
+    '''
+    This function tests that the stairs of a noisy capacity-cycle case
+    are found with and without the number of stairs, and that the
+    capacity-rate conversion can skip the plot.
+    '''
+    rng = np.random.default_rng(0)
+    levels = np.array([150, 140, 120, 90, 50, 148])
+    capacity = np.repeat(levels, 10) + rng.normal(0, 1, 60)
+    cycle = np.arange(1, 61)
+    # shuffled rows must not change the stairs
+    shuffle = rng.permutation(60)
+    array = np.column_stack([cycle, capacity])[shuffle]
+    labels = detect_steps(array)
+    assert np.array_equal(labels, np.repeat(np.arange(6), 10)[shuffle]), \
+        'Stairs are not right for known case'
+    assert np.array_equal(detect_steps(array, num_rate=6), labels), \
+        'Stairs with known number differ from detected stairs'
+    num_figures = len(plt.get_fignums())
+    df_out = capacity_cycle(array, None, [0.1, 0.2, 0.5, 1, 2, 0.1],
+                            'C', 'mAh/g', plot=False)
+    assert len(plt.get_fignums()) == num_figures, 'No figure expected'
+    assert np.allclose(df_out.iloc[:, 1], levels, atol=1), \
+        'Stair capacities are not right for known case'
+    df_gmm = capacity_cycle(array, 6, [0.1, 0.2, 0.5, 1, 2, 0.1],
+                            'C', 'mAh/g', method='gmm', plot=False)
+    assert df_gmm.shape == (6, 2), 'GaussianMixture fallback failed'
+
+
+def test_capacity_cycle_batch():
+    '''
+    This function tests that the batch conversion gathers the stairs of
+    every cell in one long-format dataframe, in worker processes too, and
+    reports a failing cell without aborting the batch.
+    '''
+    rng = np.random.default_rng(1)
+    cells = {}
+    for cell in ['A1', 'A2']:
+        capacity = np.repeat([150, 120, 60], 8) + rng.normal(0, 1, 24)
+        cells[cell] = (np.column_stack([np.arange(24), capacity]),
+                       [0.1, 1, 10])
+    cells['bad'] = (np.ones((5, 3)), [0.1, 1])
+    df_out, report = capacity_cycle_batch(cells, 'C', 'mAh/g')
+    assert df_out.shape == (6, 3), 'Unexpected long-format shape'
+    assert list(df_out['Cell'].unique()) == ['A1', 'A2'], \
+        'Cells are missing or out of order'
+    assert list(report['Cell']) == ['A1', 'A2', 'bad'], \
+        'One report row per cell expected'
+    assert report['Error'][:2].isnull().all(), 'Valid cells failed'
+    assert 'AssertionError' in report['Error'][2], \
+        'Failing cell was not reported'
+    df_parallel, _ = capacity_cycle_batch(cells, 'C', 'mAh/g', workers=2)
+    pd.testing.assert_frame_equal(df_parallel, df_out)
+    # chunksize reaches the map() of an existing executor
+    with _RecordingExecutor(max_workers=2) as pool:
+        df_executor, _ = capacity_cycle_batch(cells, 'C', 'mAh/g',
+                                              executor=pool, chunksize=2)
+    assert pool.chunksizes == [2], 'chunksize was not passed to the executor'
+    pd.testing.assert_frame_equal(df_executor, df_out)
+
+
+class _RecordingExecutor(ThreadPoolExecutor):
+    '''
+    Thread pool recording the chunksize of every map() call.
+    '''
+
+    def __init__(self, max_workers):
+        super().__init__(max_workers=max_workers)
+        self.chunksizes = []
+
+    def map(self, fn, *iterables, timeout=None, chunksize=1):
+        self.chunksizes.append(chunksize)
+        return super().map(fn, *iterables, timeout=timeout,
+                           chunksize=chunksize)
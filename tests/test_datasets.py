@@ -0,0 +1,83 @@
+"""
+This is the unit test for datasets.py.
+"""
+import os
+import git
+import numpy as np
+import pandas as pd
+from matplotlib import pyplot as plt
+from batteryratecap.datasets import CapacityRateData
+from batteryratecap.fitcaprate import fitmodel, plotfit
+from batteryratecap.data_converter import potential_rate_all
+
+REPO = git.Repo('.', search_parent_directories=True)
+GIT_PATH = REPO.git.rev_parse("--show-toplevel")
+IN_PATH = os.path.join(GIT_PATH, 'doc/data')
+
+
+def test_from_frame():
+    '''
+    Test the conversion from and back to the wide dataframe,
+    and that datasets are views of the flat arrays.
+    '''
+    df_input = pd.read_excel(os.path.join(IN_PATH,
+                                          "input_performancelog.xls"),
+                             sheet_name='CapacityRate',
+                             header=[0, 1, 2])
+    data = CapacityRateData.from_frame(df_input)
+    assert len(data) == len(df_input.columns) // 2, \
+        'One dataset per pair of columns expected'
+    assert data.labels()[:3] == [(1, 1), (1, 1), (11, 1)], \
+        'Paper and set numbers are not right'
+    rate, capacity = data[8]
+    expected = df_input.iloc[:, [16, 17]].dropna().to_numpy()
+    assert np.array_equal(np.column_stack([rate, capacity]), expected), \
+        'Dataset values are not right'
+    assert np.shares_memory(rate, data.rate), 'Datasets must be views'
+    frame = data.to_frame()
+    assert (frame.columns == df_input.columns).all(), 'Headers are lost'
+    assert np.allclose(frame.to_numpy(dtype=float),
+                       df_input.to_numpy(dtype=float)[:len(frame)],
+                       equal_nan=True), 'Round trip changed the values'
+    # Test input dataframe has the correct number of columns
+    try:
+        CapacityRateData.from_frame(pd.DataFrame({'Rate': [1, 2, 3]}))
+    except Exception as err:
+        assert isinstance(err, AssertionError), "Function outputs \
+        the incorrrect error type when input dataframe has the \
+        wrong number of columns"
+    # Test a header level without a paper or set number
+    unnumbered = df_input.iloc[:, :2].copy()
+    unnumbered.columns = pd.MultiIndex.from_tuples(
+        [('Paper # 1', 'set', 'C-rate'), ('Paper # 1', 'set', 'Capacity')])
+    try:
+        CapacityRateData.from_frame(unnumbered)
+        raise AssertionError('Header without a set number accepted')
+    except ValueError as err:
+        assert "'set'" in str(err), 'Offending header not shown'
+
+
+def test_from_records(tmp_path):
+    '''
+    Test that the converters, fitter and plotter accept the datasets
+    and give the same results as with the wide dataframe.
+    '''
+    in_path = os.path.join(IN_PATH, 'input_voltage_capacity_by_c-rate.xls')
+    df_wide = potential_rate_all(in_path, os.path.join(tmp_path, 'w.csv'))
+    data = potential_rate_all(in_path, os.path.join(tmp_path, 'l.csv'),
+                              layout='long')
+    assert isinstance(data, CapacityRateData), 'Long layout not returned'
+    assert np.allclose(data.to_frame().to_numpy(dtype=float),
+                       df_wide.to_numpy(dtype=float), equal_nan=True), \
+        'Long layout differs from the wide dataframe'
+    df_input = pd.read_excel(os.path.join(IN_PATH,
+                                          "input_performancelog.xls"),
+                             sheet_name='CapacityRate',
+                             header=[0, 1, 2])
+    data = CapacityRateData.from_frame(df_input)
+    popt_dframe = fitmodel(data, None, [0.5, 1, 200])
+    pd.testing.assert_frame_equal(popt_dframe,
+                                  fitmodel(df_input, None, [0.5, 1, 200]))
+    plotfit(data, popt_dframe)
+    assert len(plt.gcf().axes) == len(data), 'One panel per dataset expected'
+    plt.close('all')
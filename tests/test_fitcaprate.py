@@ -2,11 +2,23 @@
 This is the unit test for fitcaprate.py.
 """
 import os
+import re
+import sys
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 import git
+import numpy as np
 import pandas as pd
+from scipy.optimize import curve_fit
 from batteryratecap.fitcaprate import fitmodel
 from batteryratecap.fitcaprate import fit
+from batteryratecap.fitcaprate import fit_datasets
 from batteryratecap.fitcaprate import fitfunc
+from batteryratecap.fitcaprate import fitjac
+from batteryratecap.fitcaprate import fitkernel
+from batteryratecap.fitcaprate import initial_guess
+from batteryratecap.fitcaprate import grid_guess
+from batteryratecap.fitcaprate import plotfit_pages
 
 REPO = git.Repo('.', search_parent_directories=True)
 GIT_PATH = REPO.git.rev_parse("--show-toplevel")
@@ -37,11 +49,41 @@ def test_fitmodel():
                                           "input_performancelog.xls"),
                              sheet_name='CapacityRate',
                              header=[0, 1, 2])
-    fitmodel(df_input, out_file, [0.5, 1, 200])
+    popt_dframe = fitmodel(df_input, out_file, [0.5, 1, 200])
     dframe_out = pd.read_excel(out_file)
     assert dframe_out.shape[1] == 8, "There should be \
     8 columns for the paper and set of data, \
     the optimized parameters and their standard deviations"
+    # Test that the returned dataframe matches the exported file
+    assert popt_dframe.shape == (len(df_input.columns) // 2, 8), \
+        "There should be one row of fit parameters per dataset"
+    assert np.allclose(popt_dframe.to_numpy(dtype=float),
+                       dframe_out.to_numpy(dtype=float)), \
+        "Returned fit parameters differ from the exported file"
+
+
+def test_fit_datasets():
+    '''
+    Test that fitting the datasets in worker processes gives the same
+    results, in the same order, as fitting them one by one.
+    '''
+    df_input = pd.read_excel(os.path.join(IN_PATH,
+                                          "input_performancelog.xls"),
+                             sheet_name='CapacityRate',
+                             header=[0, 1, 2])
+    datasets = [(df_input.iloc[:, 2 * i].values,
+                 df_input.iloc[:, 2 * i + 1].values)
+                for i in range(len(df_input.columns) // 2)]
+    serial = fit_datasets(datasets, [0.5, 1, 200])
+    parallel = fit_datasets(datasets, [0.5, 1, 200],
+                            workers=2, chunksize=3)
+    assert len(serial) == len(datasets), 'One result per dataset expected'
+    assert np.allclose(serial, parallel), 'Parallel fit results are \
+    not in the original column order'
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        threaded = fit_datasets(datasets, [0.5, 1, 200], executor=executor)
+    assert np.allclose(serial, threaded), 'Executor fit results are \
+    not in the original column order'
 
 
 def test_fit():
@@ -64,6 +106,16 @@ def test_fit():
     except AssertionError:
         print(f'I should have only three parameters, \
               not {lenparam}')
+    # same fit as curve_fit(), with the number of model evaluations
+    rate = np.array([0.1, 0.2, 0.5, 1, 2, 5, 10, 20])
+    normq = fitfunc(rate, 0.5, 1.2, 200) * (1 + 0.01 * np.sin(rate))
+    popt, pcov, info = fit(params0, xdata=rate, ydata=normq,
+                           full_output=True)
+    expected = curve_fit(fitfunc, rate, normq, p0=params0, jac=fitjac)
+    assert np.allclose(popt, expected[0]), 'fit differs from curve_fit'
+    assert np.allclose(pcov, expected[1]), \
+        'covariance differs from curve_fit'
+    assert info['nfev'] > 0, 'nfev is not returned'
 
 
 def test_fitfunc():
@@ -100,3 +152,160 @@ def test_fitfunc():
             print('the normalized mass capacity normQ should be \
                 less than or equal to the specific capacity Q \
                 at any given discharge rate')
+
+
+def test_fitjac():
+    '''
+    Test the analytic Jacobian of the fit function against
+    central finite differences.
+    '''
+    rate = np.array([0.1, 0.5, 1, 2, 5])
+    params = np.array([0.5, 1.3, 150])
+    jac = fitjac(rate, *params)
+    assert jac.shape == (5, 3), 'Unexpected Jacobian shape'
+    for i in range(3):
+        step = np.zeros(3)
+        step[i] = 1e-6 * params[i]
+        numeric = (fitfunc(rate, *(params + step)) -
+                   fitfunc(rate, *(params - step))) / (2 * step[i])
+        assert np.allclose(jac[:, i], numeric, rtol=1e-5), \
+            'Analytic Jacobian does not match finite differences'
+
+
+def test_fitkernel():
+    '''
+    Test that the kernel fills the given buffers, stays finite and
+    accurate far outside the usual C-rates, and agrees with the
+    direct form of the model in between.
+    '''
+    rate = np.logspace(-6, 6, 25)
+    model = np.empty(25)
+    jac = np.empty((25, 3))
+    result = fitkernel(rate, 0.5, 1.3, 150, out=model, jac_out=jac)
+    assert result[0] is model and result[1] is jac, \
+        'Output buffers were not used'
+    assert np.all(np.isfinite(model)) and np.all(np.isfinite(jac)), \
+        'Kernel is not finite at extreme rates'
+    # plateau at low rates, 150 / (2 (rate tau)**n) at high rates
+    assert np.isclose(model[0], 150), 'Low-rate limit is not right'
+    assert np.isclose(model[-1], 75 / (rate[-1] * 0.5)**1.3, rtol=1e-6), \
+        'High-rate limit is not right'
+    middle = (rate > 1e-2) & (rate < 1e2)
+    power = (rate[middle] * 0.5)**1.3
+    direct = 150 * (1 - power * (1 - np.exp(-1 / power)))
+    assert np.allclose(model[middle], direct, rtol=1e-10), \
+        'Kernel differs from the direct form of the model'
+    assert np.allclose(fitjac(rate, 0.5, 1.3, 150), jac), \
+        'fitjac() differs from the kernel'
+
+
+def test_initial_guess():
+    '''
+    Test that both initial guesses land near known parameters, that
+    warm starts give the same fits in any chunking, and that a dataset
+    that cannot be fitted is recorded instead of raising.
+    '''
+    rate = np.logspace(-1, 1, 6)
+    normq = fitfunc(rate, 0.5, 1.2, 150)
+    for guess in [initial_guess, grid_guess]:
+        params = guess(rate, normq)
+        assert np.allclose(params, [0.5, 1.2, 150], rtol=0.25), \
+            'Initial guess is far from the known parameters'
+    df_input = pd.read_excel(os.path.join(IN_PATH,
+                                          "input_performancelog.xls"),
+                             sheet_name='CapacityRate',
+                             header=[0, 1, 2])
+    popt_dframe, report = fitmodel(df_input, None, 'warm', report=True)
+    fitted = report['Error'] == ''
+    assert (report.loc[fitted, 'nfev'] > 0).all(), 'nfev is not recorded'
+    assert (report.loc[~fitted, 'Error'] ==
+            'less than four datapoints').all(), 'Unexpected fit error'
+    baseline = fitmodel(df_input, None, [0.5, 1, 200])
+    assert np.allclose(popt_dframe.iloc[:, 2:5], baseline.iloc[:, 2:5],
+                       rtol=1e-3), 'Warm started fits differ'
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        threaded = fitmodel(df_input, None, 'warm', executor=executor)
+    assert np.allclose(popt_dframe, threaded), \
+        'Warm started fits depend on the chunks'
+    # noisy flat data does not converge
+    datasets = [(np.array([1., 2, 3, 4, 5]), np.array([5., 4, 5, 3, 5])),
+                (rate, normq)]
+    results, _, errors = fit_datasets(datasets, 'auto', return_info=True)
+    assert errors[0] != '' and errors[1] == '', 'Fit errors are not recorded'
+    assert (results[0] == 0).all(), 'Failed fits should report zeros'
+    assert np.allclose(results[1, :3], [0.5, 1.2, 150]), \
+        'Other datasets were not fitted'
+
+
+def test_plotfit_pages(tmp_path):
+    '''
+    Test that the datasets are spread over numbered PNG pages, or one
+    multi-page PDF file, also from worker processes and executors.
+    '''
+    df_input = pd.read_excel(os.path.join(IN_PATH,
+                                          "input_performancelog.xls"),
+                             sheet_name='CapacityRate',
+                             header=[0, 1, 2])
+    popt_dframe = fitmodel(df_input, None, [0.5, 1, 200])
+    paths = plotfit_pages(df_input, popt_dframe,
+                          os.path.join(tmp_path, 'fits.png'),
+                          rows=2, columns=3)
+    assert [os.path.basename(path) for path in paths] == \
+        ['fits-0001.png', 'fits-0002.png', 'fits-0003.png'], \
+        'One PNG file per page of 6 panels expected'
+    assert all(os.path.getsize(path) > 0 for path in paths), 'Empty page'
+    paths = plotfit_pages(df_input, popt_dframe,
+                          os.path.join(tmp_path, 'fits.pdf'))
+    assert len(paths) == 1 and os.path.exists(paths[0]), 'PDF not written'
+    paths = plotfit_pages(df_input, popt_dframe,
+                          os.path.join(tmp_path, 'parallel.png'),
+                          rows=3, columns=3, workers=2)
+    assert len(paths) == 2 and all(os.path.exists(path) for path in paths), \
+        'Pages rendered by workers are missing'
+    # pages rendered by workers or an executor go into the one PDF file
+    output_file = os.path.join(tmp_path, 'parallel.pdf')
+    paths = plotfit_pages(df_input, popt_dframe, output_file,
+                          rows=2, columns=3, workers=2)
+    assert paths == [output_file], 'Parallel PDF pages not in output_file'
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        paths = plotfit_pages(df_input, popt_dframe, output_file,
+                              rows=2, columns=3, workers=2, executor=pool)
+    assert paths == [output_file], 'Executor PDF pages not in output_file'
+    with open(output_file, 'rb') as file:
+        assert len(re.findall(rb'/Type\s*/Page\b', file.read())) == 3, \
+            'One PDF page per page of 6 panels expected'
+    assert sorted(os.listdir(tmp_path)) == \
+        ['fits-0001.png', 'fits-0002.png', 'fits-0003.png', 'fits.pdf',
+         'parallel-0001.png', 'parallel-0002.png', 'parallel.pdf'], \
+        'Unexpected files written'
+    # Test output file type
+    try:
+        plotfit_pages(df_input, popt_dframe,
+                      os.path.join(tmp_path, 'fits.svg'))
+    except Exception as err:
+        assert isinstance(err, AssertionError), 'Wrong error type'
+
+
+def test_lazy_imports():
+    '''
+    Test that importing the fitting and plotting modules and fitting a
+    dataset, in a fresh interpreter, loads none of matplotlib, sklearn
+    and openpyxl.
+    '''
+    code = (
+        'import sys\n'
+        'import numpy as np\n'
+        'import batteryratecap.fitcaprate, batteryratecap.batchfit\n'
+        'import batteryratecap.data_converter\n'
+        'import batteryratecap.correlationtest\n'
+        'import batteryratecap.visualization\n'
+        'rate = np.array([0.1, 0.5, 1, 2, 5, 10])\n'
+        'normq = batteryratecap.fitcaprate.fitfunc(rate, 0.5, 1.2, 150)\n'
+        'batteryratecap.fitcaprate.fit([0.5, 1, 200], xdata=rate,\n'
+        '                              ydata=normq)\n'
+        "print(' '.join(name for name in ('matplotlib', 'sklearn', "
+        "'openpyxl') if name in sys.modules))\n")
+    result = subprocess.run([sys.executable, '-c', code], cwd=GIT_PATH,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '', \
+        'Heavy modules imported at module level: ' + result.stdout
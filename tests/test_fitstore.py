@@ -0,0 +1,70 @@
+"""
+This is the unit test for fitstore.py.
+"""
+import os
+import git
+import numpy as np
+import pandas as pd
+from batteryratecap.fitcaprate import fitmodel
+from batteryratecap.fitstore import dataset_digest
+from batteryratecap.instrument import instrument
+
+REPO = git.Repo('.', search_parent_directories=True)
+GIT_PATH = REPO.git.rev_parse("--show-toplevel")
+IN_PATH = os.path.join(GIT_PATH, 'doc/data')
+
+
+def test_dataset_digest():
+    '''
+    Test that the fingerprint ignores nulls but not values,
+    order or the initial guess.
+    '''
+    rate = np.array([0.1, 1, 10, np.nan])
+    normq = np.array([150, 140, 20, np.nan])
+    digest = dataset_digest(rate, normq, [0.5, 1, 200])
+    assert digest == dataset_digest(rate[:3], normq[:3], [0.5, 1, 200]), \
+        'Null datapoints change the fingerprint'
+    assert digest != dataset_digest(rate[::-1], normq[::-1], [0.5, 1, 200]), \
+        'Order does not change the fingerprint'
+    assert digest != dataset_digest(rate, normq, 'auto'), \
+        'Initial guess does not change the fingerprint'
+    normq[2] = 21
+    assert digest != dataset_digest(rate, normq, [0.5, 1, 200]), \
+        'Values do not change the fingerprint'
+
+
+def test_fitmodel_store(tmp_path, capsys):
+    '''
+    Test that a rerun takes every dataset from the store with the same
+    results, and that only a changed dataset is fitted again, which is
+    counted instead of printed.
+    '''
+    store = str(tmp_path / 'fits.sqlite')
+    df_input = pd.read_excel(os.path.join(IN_PATH,
+                                          "input_performancelog.xls"),
+                             sheet_name='CapacityRate',
+                             header=[0, 1, 2])
+    first, report = fitmodel(df_input, None, [0.5, 1, 200], report=True,
+                             store=store)
+    assert not report['Cached'].any(), 'Empty store returned results'
+    second, report = fitmodel(df_input, None, [0.5, 1, 200], report=True,
+                              store=store)
+    assert report['Cached'].all(), 'Rerun did not use the store'
+    pd.testing.assert_frame_equal(first, second)
+    df_input.iloc[0, 1] += 1
+    with instrument() as session:
+        third, report = fitmodel(df_input, None, [0.5, 1, 200],
+                                 report=True, store=store)
+    assert session.counters['fit.cached'] == 16 and \
+        session.counters['fit.store_misses'] == 1, 'Store hits not counted'
+    assert capsys.readouterr().out == '', 'The store printed to stdout'
+    assert report['Cached'].tolist() == [False] + [True] * 16, \
+        'Only the changed dataset should be fitted'
+    assert np.allclose(third, fitmodel(df_input, None, [0.5, 1, 200])), \
+        'Results from the store differ from a new fit'
+    # warm starts depend on the neighbouring datasets, never stored
+    for _ in range(2):
+        warm, report = fitmodel(df_input, None, 'warm', report=True,
+                                store=store)
+        assert not report['Cached'].any(), 'Warm fits taken from the store'
+    pd.testing.assert_frame_equal(warm, fitmodel(df_input, None, 'warm'))
@@ -0,0 +1,96 @@
+"""
+This is the unit test for instrument.py.
+"""
+import os
+import json
+import logging
+import git
+import pandas as pd
+from batteryratecap import instrument as hooks
+from batteryratecap.instrument import instrument
+from batteryratecap.fitcaprate import fitmodel
+from batteryratecap.data_converter import potential_rate_all
+
+REPO = git.Repo('.', search_parent_directories=True)
+GIT_PATH = REPO.git.rev_parse("--show-toplevel")
+IN_PATH = os.path.join(GIT_PATH, 'doc/data')
+
+
+def test_disabled():
+    '''
+    Test that the hooks do nothing without an open session.
+    '''
+    assert not hooks.enabled(), 'A session was left open'
+    assert hooks.timer('stage') is hooks.timer('other'), \
+        'Disabled timers should be one shared no-op'
+    hooks.emit('stage', seconds=1)
+    hooks.count('stage')
+    with instrument() as session:
+        assert hooks.enabled(), 'The session is not open'
+    assert session.events == [{'event': 'counters',
+                               'time': session.events[0]['time'],
+                               'counters': {}}], \
+        'Events sent before the session was opened'
+
+
+def test_instrument_fit(tmp_path):
+    '''
+    Test the stage timers, one event per dataset and the counters of
+    fitmodel() and potential_rate_all().
+    '''
+    df_input = pd.read_excel(os.path.join(IN_PATH,
+                                          "input_performancelog.xls"),
+                             sheet_name='CapacityRate', header=[0, 1, 2])
+    with instrument() as session:
+        _, report = fitmodel(df_input, None, [0.5, 1, 200], report=True,
+                             workers=2)
+        potential_rate_all(os.path.join(
+            IN_PATH, 'input_voltage_capacity_by_c-rate.xls'),
+            os.path.join(tmp_path, 'out.xlsx'))
+    names = [event['event'] for event in session.events]
+    for name in ('fit.prepare', 'fit.datasets', 'convert.read',
+                 'convert.sheet', 'convert.build', 'convert.write'):
+        assert name in names, 'No ' + name + ' event'
+    datasets = [event for event in session.events
+                if event['event'] == 'fit.dataset']
+    assert [event['nfev'] for event in datasets] == \
+        report['nfev'].tolist(), 'One event per dataset expected'
+    assert session.counters['fit.converged'] == \
+        sum(event['converged'] for event in datasets), \
+        'Converged fits are not counted'
+    assert session.counters['convert.sheets'] == 9, 'Sheets not counted'
+
+
+def test_sinks(tmp_path, caplog):
+    '''
+    Test the callable, JSON lines file and logging sinks, nested
+    sessions and the error of a failed block.
+    '''
+    received = []
+    path = os.path.join(tmp_path, 'events.jsonl')
+    with caplog.at_level(logging.INFO, logger='batteryratecap'):
+        with instrument(received.append), instrument(path), \
+                instrument('logging'):
+            hooks.count('items', 2)
+            try:
+                with hooks.timer('stage', name='first'):
+                    raise ValueError('bad input')
+            except ValueError:
+                pass
+            else:
+                raise AssertionError('The timer swallowed the exception')
+    assert received[0]['event'] == 'stage' and \
+        received[0]['error'] == 'ValueError: bad input', \
+        'The failed block was not reported'
+    assert received[-1]['counters'] == {'items': 2}, 'Counters not sent'
+    with open(path, encoding='utf-8') as file:
+        lines = [json.loads(line) for line in file]
+    assert [line['event'] for line in lines] == ['stage', 'counters'], \
+        'Unexpected JSON lines'
+    assert len(caplog.records) == 2, 'Events were not logged'
+    # Test the sink type
+    try:
+        with instrument(42):
+            pass
+    except Exception as err:
+        assert isinstance(err, AssertionError), 'Wrong error type'
@@ -0,0 +1,127 @@
+"""
+This is the unit test for pipeline.py.
+"""
+import os
+import logging
+import git
+import pandas as pd
+from batteryratecap import pipeline
+from batteryratecap.pipeline import run_pipeline
+from batteryratecap.pipeline import stage_keys
+from batteryratecap.pipeline import feature_correlations
+from batteryratecap.fitcaprate import fitmodel
+from batteryratecap.instrument import instrument
+
+REPO = git.Repo('.', search_parent_directories=True)
+GIT_PATH = REPO.git.rev_parse("--show-toplevel")
+IN_PATH = os.path.join(GIT_PATH, 'doc/data')
+PERFORMANCE_FILE = os.path.join(IN_PATH, 'input_performancelog.xls')
+PARAMETER_FILE = os.path.join(IN_PATH, 'input_parameterlog.xls')
+VOLTAGE_FILE = os.path.join(IN_PATH, 'input_voltage_capacity_by_c-rate.xls')
+
+
+def _fail_stage(*args, **kwargs):
+    raise AssertionError('This stage should be loaded from its checkpoint')
+
+
+def test_run_pipeline(tmp_path, monkeypatch, capsys, caplog):
+    '''
+    Test that the stages match the functions run one by one, that a
+    rerun loads every stage from its checkpoint, that a changed
+    fit parameter resumes from the fits, and that the stages are
+    logged and not printed.
+    '''
+    cache_dir = os.path.join(tmp_path, 'cache')
+    results = run_pipeline(PERFORMANCE_FILE, PARAMETER_FILE,
+                           sheet_name='CapacityRate', cache_dir=cache_dir)
+    assert list(results) == ['capacity_rate', 'fits', 'correlations'], \
+        'Unexpected stages'
+    df_input = pd.read_excel(PERFORMANCE_FILE, sheet_name='CapacityRate',
+                             header=[0, 1, 2])
+    popt_dframe = fitmodel(df_input, None, [0.5, 1, 200])
+    pd.testing.assert_frame_equal(results['fits'], popt_dframe)
+    assert set(results['correlations']['parameter']) == \
+        {'tau', 'n', 'Qmax'}, 'Every fit parameter should be tested'
+    # Rerun entirely from the checkpoints
+    monkeypatch.setattr(pipeline, 'fitmodel', _fail_stage)
+    monkeypatch.setattr(pipeline, 'correlation_matrix', _fail_stage)
+    rerun = run_pipeline(PERFORMANCE_FILE, PARAMETER_FILE,
+                         sheet_name='CapacityRate', cache_dir=cache_dir)
+    for stage, dframe in results.items():
+        pd.testing.assert_frame_equal(rerun[stage], dframe)
+    # A new initial guess changes the fits and correlations only
+    monkeypatch.undo()
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger='batteryratecap.pipeline'), \
+            instrument() as session:
+        run_pipeline(PERFORMANCE_FILE, PARAMETER_FILE,
+                     sheet_name='CapacityRate', params0='auto',
+                     cache_dir=cache_dir)
+    status = [record.getMessage().split(' in ')[0]
+              for record in caplog.records
+              if record.name == 'batteryratecap.pipeline']
+    assert status == ['capacity_rate loaded from checkpoint',
+                      'fits computed', 'correlations computed'], \
+        'The rerun did not resume from the fits'
+    assert [event['stage'] for event in session.events
+            if event['event'] == 'pipeline.stage'] == \
+        ['capacity_rate', 'fits', 'correlations'], 'Stages not instrumented'
+    assert 'computed' not in capsys.readouterr().out, \
+        'Stages printed to stdout'
+
+
+def test_stage_keys():
+    '''
+    Test that a change of parameters changes the key of its stage
+    and of every later stage only.
+    '''
+    keys = stage_keys(PERFORMANCE_FILE, PARAMETER_FILE, 'CapacityRate')
+    assert keys == stage_keys(PERFORMANCE_FILE, PARAMETER_FILE,
+                              'CapacityRate', params0=[0.5, 1.0, 200.0]), \
+        'Equal parameters give different keys'
+    changed = stage_keys(PERFORMANCE_FILE, PARAMETER_FILE, 'CapacityRate',
+                         params0='auto')
+    assert changed['capacity_rate'] == keys['capacity_rate'], \
+        'The fit parameters changed the capacity-rate key'
+    assert changed['fits'] != keys['fits'] and \
+        changed['correlations'] != keys['correlations'], \
+        'The fit parameters did not change the later keys'
+    assert list(stage_keys(VOLTAGE_FILE)) == ['capacity_rate', 'fits'], \
+        'Without features the correlations should be skipped'
+
+
+def test_feature_correlations():
+    '''
+    Test that failed fits and text values count as missing and that
+    the features are joined by paper and set number.
+    '''
+    fit_params = pd.DataFrame({'Paper #': [1, 1, 2, 3], 'Set': [1, 2, 1, 1],
+                               'tau': [0.1, 0.2, 0.3, 0],
+                               'n': [1, 1.5, 2, 0], 'Qmax': [100, 90, 80, 0],
+                               'sigma_tau': 0, 'sigma_n': 0,
+                               'sigma_Qmax': 0})
+    features = pd.DataFrame({'Paper #': [3, 2, 1, 1], 'Set': [1, 1, 2, 1],
+                             'thickness': [500, 30, 20, 10],
+                             'material': ['N/R', 'Li', 'Li', 'Si']})
+    result = feature_correlations(fit_params, features, methods=['pearson'])
+    assert result['feature'].unique().tolist() == ['thickness'], \
+        'Text features should be left out'
+    assert (result['n'] == 3).all(), 'The failed fit should be missing'
+    assert result['correlation'].iloc[0] > 0.999, \
+        'Features were not joined by paper and set number'
+    # Test the missing join columns
+    try:
+        feature_correlations(fit_params, features.drop(columns='Set'))
+    except Exception as err:
+        assert isinstance(err, AssertionError), 'Wrong error type'
+
+
+def test_main(tmp_path):
+    '''
+    Test that the command line writes the output of every stage.
+    '''
+    pipeline.main([VOLTAGE_FILE, '--output-dir', str(tmp_path),
+                   '--format', 'csv', '--no-cache'])
+    assert sorted(os.listdir(tmp_path)) == ['capacity_rate.csv',
+                                            'fits.csv'], \
+        'Unexpected output files'
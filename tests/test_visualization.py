@@ -1,9 +1,13 @@
 """
 This is the unit test for visualization.py
 """
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 from batteryratecap.visualization import feature_vs_n_tau_q
+from batteryratecap.visualization import feature_pages
 
 
 def test_feature_vs_n_tau_q():
@@ -33,3 +37,57 @@ def test_feature_vs_n_tau_q():
     row, col = specs.get_topmost_subplotspec().get_gridspec().get_geometry()
     assert np.isclose(row, 1) & np.isclose(col, 3), 'Unexpected \
     figure grid size'
+    # Test that several features give one row of panels each
+    df1['anode_thickness'] = [10, 15, 20]
+    fig = feature_vs_n_tau_q(df1, ['cathode_thickness', 'anode_thickness'],
+                             mode='hexbin')
+    assert len(fig.axes) == 6, 'Three panels per feature expected'
+
+
+def test_feature_pages(tmp_path):
+    '''
+    Test that the features are spread over numbered PNG pages, or one
+    multi-page PDF file, in every mode and from worker processes
+    and executors.
+    '''
+    rng = np.random.default_rng(0)
+    dframe = pd.DataFrame(rng.random((50, 8)) + 0.1,
+                          columns=['n', 'tau', 'Qmax'] +
+                          ['feature_' + str(i) for i in range(5)])
+    features = list(dframe.columns[3:])
+    paths = feature_pages(dframe, features,
+                          os.path.join(tmp_path, 'features.png'), per_page=2)
+    assert [os.path.basename(path) for path in paths] == \
+        ['features-0001.png', 'features-0002.png', 'features-0003.png'], \
+        'One PNG file per page of 2 features expected'
+    for mode in ('scatter', 'rasterized', 'hexbin'):
+        paths = feature_pages(dframe, features,
+                              os.path.join(tmp_path, mode + '.pdf'),
+                              mode=mode)
+        assert len(paths) == 1 and os.path.getsize(paths[0]) > 0, \
+            'PDF not written in mode ' + mode
+    # pages rendered by workers or an executor go into the one PDF file
+    output_file = os.path.join(tmp_path, 'parallel.pdf')
+    paths = feature_pages(dframe, features, output_file, per_page=1,
+                          workers=2)
+    assert paths == [output_file], 'Parallel PDF pages not in output_file'
+    # matplotlib is not thread-safe, one thread renders the blocks
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        paths = feature_pages(dframe, features, output_file, per_page=1,
+                              workers=3, executor=pool)
+    assert paths == [output_file], 'Executor PDF pages not in output_file'
+    with open(output_file, 'rb') as file:
+        assert len(re.findall(rb'/Type\s*/Page\b', file.read())) == \
+            len(features), 'One PDF page per feature expected'
+    assert not [name for name in os.listdir(tmp_path)
+                if name.startswith('parallel-')], 'Split PDF files written'
+    # Test the missing parameter columns and unknown modes
+    for kwargs in ({'visualization_df': dframe.drop(columns='tau')},
+                   {'mode': 'contour'}):
+        try:
+            feature_pages(**{'visualization_df': dframe,
+                             'features': features,
+                             'output_file': os.path.join(tmp_path, 'x.pdf'),
+                             **kwargs})
+        except Exception as err:
+            assert isinstance(err, AssertionError), 'Wrong error type'
@@ -0,0 +1,87 @@
+"""
+This is the unit test for writers.py
+"""
+import os
+import numpy as np
+import pandas as pd
+from batteryratecap.writers import write_dataframe
+from batteryratecap.writers import write_xlsx
+from batteryratecap.writers import register_writer
+from batteryratecap.writers import WRITERS, EXTENSIONS
+
+DFRAME = pd.DataFrame({'Paper #': [1, 1, 2], 'Set': [1, 2, 1],
+                       'tau': [0.5, 0.2, 0.1], 'n': [1.2, 2.0, 0.9]})
+
+
+def test_write_dataframe(tmp_path):
+    '''
+    This function tests that the writer is picked from the file
+    extension and that the exported table reads back unchanged.
+    '''
+    readers = {'.xlsx': pd.read_excel, '.csv': pd.read_csv}
+    try:
+        import pyarrow  # noqa: F401
+        readers['.parquet'] = pd.read_parquet
+        readers['.feather'] = pd.read_feather
+    except ImportError:
+        pass
+    for ext, reader in readers.items():
+        output_file = os.path.join(tmp_path, 'fitparameters' + ext)
+        write_dataframe(DFRAME, output_file)
+        assert np.allclose(reader(output_file).to_numpy(dtype=float),
+                           DFRAME.to_numpy(dtype=float)), \
+            'Exported ' + ext + ' file differs from the dataframe'
+    # Test that an explicit writer overrides the extension
+    output_file = os.path.join(tmp_path, 'fitparameters.txt')
+    write_dataframe(DFRAME, output_file, writer='csv')
+    assert pd.read_csv(output_file).shape == DFRAME.shape, \
+        'Explicit writer was not used'
+    # Test that an unknown file extension is rejected
+    try:
+        write_dataframe(DFRAME, os.path.join(tmp_path, 'fitparameters.doc'))
+    except Exception as err:
+        assert isinstance(err, AssertionError), "Function outputs \
+        the wrong error type when the output file type is unknown."
+
+
+def test_write_xlsx(tmp_path):
+    '''
+    This function tests that the streaming write-only mode writes the
+    same multi-level header sheet as a regular openpyxl workbook.
+    '''
+    columns = pd.MultiIndex.from_tuples([('Paper # 1', 'set #1', 'C-rate'),
+                                         ('Paper # 1', 'set #1',
+                                          'Capacity (mAh/g)')])
+    dframe = pd.DataFrame([[0.5, 150.0], [1, 140.0]], columns=columns)
+    streamed = os.path.join(tmp_path, 'streamed.xlsx')
+    regular = os.path.join(tmp_path, 'regular.xlsx')
+    write_xlsx(dframe, streamed, index=True)
+    write_xlsx(dframe, regular, index=True, write_only=False)
+    assert pd.read_excel(streamed, header=None).equals(
+        pd.read_excel(regular, header=None)), \
+        'Write-only workbook differs from the regular workbook'
+
+
+def test_register_writer(tmp_path):
+    '''
+    This function tests that a custom backend can be registered
+    for a new file extension.
+    '''
+    written = []
+    register_writer('record',
+                    lambda dframe, output_file, index=False:
+                    written.append(output_file),
+                    extensions=['.rec'])
+    try:
+        output_file = os.path.join(tmp_path, 'fitparameters.rec')
+        write_dataframe(DFRAME, output_file)
+        assert written == [output_file], 'Registered writer was not called'
+    finally:
+        # the registries are module globals shared with the other tests
+        WRITERS.pop('record', None)
+        EXTENSIONS.pop('.rec', None)
+    try:
+        register_writer('broken', 'not a function')
+    except Exception as err:
+        assert isinstance(err, AssertionError), "Function outputs \
+        the wrong error type when the writer is not callable."